@@ -0,0 +1,485 @@
+#!/usr/local/bin/python3
+# fake_looker.py
+import argparse
+import json
+import logging
+import os
+import re
+import ssl
+import threading
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+try:
+    from . import instance as synthetic
+except ImportError:  # run as a script
+    import instance as synthetic
+
+CERT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         'localhost.pem')
+
+# i__looker history columns, see instance.generate
+DAYS_AGO, MODEL, EXPLORE, FIELDS, FILTERS, SORTS, PIVOTS, STATUS, RUNTIME, \
+    QUERY_ID, RUN_COUNT = range(11)
+
+DIMENSIONS = {
+    'query.model': lambda r: r[MODEL],
+    'query.view': lambda r: r[EXPLORE],
+    'query.formatted_fields': lambda r: r[FIELDS],
+    'query.formatted_filters': lambda r: r[FILTERS],
+    'query.sorts': lambda r: r[SORTS],
+    'query.formatted_pivots': lambda r: r[PIVOTS],
+    'query.id': lambda r: r[QUERY_ID],
+    'history.status': lambda r: r[STATUS],
+    'history.result_source': lambda r: 'query',
+}
+
+# measures are computed from (run_count, total_runtime, min, max) aggregates
+MEASURES = {
+    'history.query_run_count': lambda a: a[0],
+    'history.total_runtime': lambda a: round(a[1], 3),
+    'history.min_runtime': lambda a: a[2],
+    'history.max_runtime': lambda a: a[3],
+    'history.average_runtime': lambda a: a[1] / a[0] if a[0] else None,
+}
+
+
+# splits a Looker string filter expression on unescaped commas and returns
+# a predicate, or None if the expression doesn't filter anything
+def string_filter(expression):
+    if expression is None or expression == '':
+        return None
+    terms, term, escaped = [], '', False
+    for char in expression:
+        if escaped:
+            term += char
+            escaped = False
+        elif char == '^':
+            escaped = True
+        elif char == ',':
+            terms.append(term)
+            term = ''
+        else:
+            term += char
+    terms.append(term)
+    include, exclude = set(), set()
+    for term in terms:
+        term = term.strip()
+        if term == 'NOT NULL':
+            exclude.add(None)
+        elif term.startswith('-'):
+            exclude.add(None if term[1:] == 'NULL' else term[1:])
+        elif term:
+            include.add(None if term == 'NULL' else term)
+    return lambda v: (not include or v in include) and v not in exclude
+
+
+# supports the comparisons Henry uses on measures, e.g. ">=10"
+def number_filter(expression):
+    match = re.match(r'^\s*(>=|<=|>|<|=)?\s*(-?[\d.]+)\s*$', str(expression))
+    if not match:
+        return None
+    op, value = match.group(1) or '=', float(match.group(2))
+    return {'>=': lambda v: v is not None and v >= value,
+            '<=': lambda v: v is not None and v <= value,
+            '>': lambda v: v is not None and v > value,
+            '<': lambda v: v is not None and v < value,
+            '=': lambda v: v == value}[op]
+
+
+# returns the days_ago values matched by a created_date filter: either
+# "N days" or an absolute "YYYY/MM/DD to YYYY/MM/DD" range (end excluded)
+def date_filter(expression, today, days):
+    if not expression:
+        return range(days)
+    match = re.match(r'^\s*(\d+) days?\s*$', expression)
+    if match:
+        return range(min(int(match.group(1)), days))
+    match = re.match(r'^\s*(\S+) to (\S+)\s*$', expression)
+    if match:
+        start, end = [datetime.strptime(d, '%Y/%m/%d').date()
+                      for d in match.groups()]
+        return range(max(0, (today - end).days + 1),
+                     min(days, (today - start).days + 1))
+    return range(days)
+
+
+# serves a synthetic (or previously saved) instance over the subset of the
+# Looker API 3.0 that Henry uses, including i__looker history queries.
+# Every request is counted per endpoint so benchmarks can report API calls
+# alongside timings. latency is added to every request, and query_latency
+# and test_latency on top of it to every query and to every test of a
+# connection test request, to mimic a remote instance.
+class FakeLooker(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, instance, port=0, latency=0, query_latency=0,
+                 test_latency=0):
+        super(FakeLooker, self).__init__(('localhost', port), Handler)
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(CERT_PATH)
+        # handshakes happen on the handler threads rather than in accept
+        self.socket = context.wrap_socket(self.socket, server_side=True,
+                                          do_handshake_on_connect=False)
+        self.instance = instance
+        self.latency = latency
+        self.query_latency = query_latency
+        self.test_latency = test_latency
+        self.fake_logger = logging.getLogger('fake_looker')
+        self.lock = threading.Lock()
+        self.requests = Counter()
+        self.tokens = set()
+        self.workspace = 'production'
+        self.queries = {}
+        self.tasks = {}
+        self.models = {m['name']: m for m in instance['models']}
+        self.projects = {p['id']: p for p in instance['projects']}
+        self.connections = {c['name']: c for c in instance['connections']}
+        # history indexed by day so that date windows only scan their days
+        self.days = max([r[DAYS_AGO] for r in instance['history']] + [0]) + 1
+        self.history = [[] for d in range(self.days)]
+        for row in instance['history']:
+            self.history[row[DAYS_AGO]].append(row)
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def count(self, endpoint):
+        with self.lock:
+            self.requests[endpoint] += 1
+
+    def reset_counts(self):
+        with self.lock:
+            self.requests = Counter()
+
+    def run_query(self, body):
+        if body.get('view') == 'scheduled_plan':
+            jobs = self.instance.get('scheduled_jobs',
+                                     {'success': 120, 'failure': 3})
+            return [{'scheduled_job.count': {'scheduled_job.status': jobs}}]
+        today = date.today()
+        filters = body.get('filters') or {}
+        fields = body['fields']
+        pivots = body.get('pivots') or []
+        row_filters = []
+        having = []
+        for field, expression in filters.items():
+            if field in MEASURES:
+                predicate = number_filter(expression)
+                if predicate is not None:
+                    having.append((field, predicate))
+            elif field in DIMENSIONS:
+                predicate = string_filter(expression)
+                if predicate is not None:
+                    row_filters.append((DIMENSIONS[field], predicate))
+
+        dimensions = [f for f in fields
+                      if f not in MEASURES and f not in pivots]
+        measures = [f for f in fields if f in MEASURES]
+        groups = {}
+        for days_ago in date_filter(filters.get('history.created_date'),
+                                    today, self.days):
+            day = (today - timedelta(days=days_ago)).isoformat()
+            for row in self.history[days_ago]:
+                if not all(p(get(row)) for get, p in row_filters):
+                    continue
+                key = tuple(day if d == 'history.created_date'
+                            else DIMENSIONS[d](row) for d in dimensions)
+                pivot = tuple(DIMENSIONS[p](row) for p in pivots)
+                count, runtime = row[RUN_COUNT], row[RUNTIME]
+                agg = groups.setdefault(key, {}).get(pivot)
+                if agg is None:
+                    groups[key][pivot] = [count, runtime * count, runtime,
+                                          runtime]
+                else:
+                    agg[0] += count
+                    agg[1] += runtime * count
+                    agg[2] = min(agg[2], runtime)
+                    agg[3] = max(agg[3], runtime)
+
+        rows = []
+        for key, by_pivot in groups.items():
+            total = [0, 0, None, None]
+            for agg in by_pivot.values():
+                total[0] += agg[0]
+                total[1] += agg[1]
+                total[2] = agg[2] if total[2] is None \
+                    else min(total[2], agg[2])
+                total[3] = agg[3] if total[3] is None \
+                    else max(total[3], agg[3])
+            if not all(p(MEASURES[f](total)) for f, p in having):
+                continue
+            row = dict(zip(dimensions, key))
+            for measure in measures:
+                if pivots:
+                    row[measure] = {pivots[0]: {
+                        pivot[0]: MEASURES[measure](agg)
+                        for pivot, agg in by_pivot.items()}}
+                else:
+                    row[measure] = MEASURES[measure](total)
+            rows.append(row)
+        # queries without dimensions still return a single row
+        if not rows and not dimensions and not pivots:
+            rows.append({m: MEASURES[m]([0, 0, None, None])
+                         for m in measures})
+
+        for sort in reversed(body.get('sorts') or []):
+            field, _, direction = sort.partition(' ')
+            if field in dimensions or (field in measures and not pivots):
+                rows.sort(key=lambda r: (r.get(field) is None, r.get(field)),
+                          reverse=direction.strip().lower() == 'desc')
+        return rows[:int(body.get('limit') or 500)]
+
+
+class Handler(BaseHTTPRequestHandler):
+    # keep connections alive so clients can reuse them, as with Looker
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately, which with Nagle's algorithm
+    # and delayed acks on a kept alive connection adds 40ms to requests
+    disable_nagle_algorithm = True
+
+    ROUTES = [
+        ('POST', r'login', 'login'),
+        ('GET', r'user', 'user'),
+        ('GET', r'lookml_models', 'models'),
+        ('GET', r'lookml_models/([^/]+)', 'model'),
+        ('GET', r'lookml_models/([^/]+)/explores/([^/]+)', 'explore'),
+        ('GET', r'projects', 'projects'),
+        ('GET', r'projects/([^/]+)', 'project'),
+        ('GET', r'projects/([^/]+)/files', 'project_files'),
+        ('GET', r'projects/([^/]+)/git_branch', 'git_branch'),
+        ('GET', r'projects/([^/]+)/git_connection_tests',
+         'git_connection_tests'),
+        ('GET', r'projects/([^/]+)/git_connection_tests/([^/]+)',
+         'run_git_connection_test'),
+        ('POST', r'queries/run/json', 'run_query'),
+        ('POST', r'queries', 'create_query'),
+        ('POST', r'query_tasks', 'create_query_task'),
+        ('GET', r'query_tasks/multi_results', 'multi_results'),
+        ('GET', r'session', 'get_session'),
+        ('PATCH', r'session', 'update_session'),
+        ('GET', r'connections', 'connections'),
+        ('PUT', r'connections/([^/]+)/test', 'test_connection'),
+        ('GET', r'legacy_features', 'legacy_features'),
+        ('GET', r'integrations', 'integrations'),
+        ('GET', r'versions', 'versions'),
+    ]
+
+    def log_message(self, format, *args):
+        self.server.fake_logger.debug(format, *args)
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def do_PUT(self):
+        self.dispatch('PUT')
+
+    def do_PATCH(self):
+        self.dispatch('PATCH')
+
+    def dispatch(self, method):
+        url = urlparse(self.path)
+        # every value of each parameter, and the last one for convenience
+        self.query = parse_qs(url.query)
+        self.params = {k: v[-1] for k, v in self.query.items()}
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        self.body = json.loads(raw) if raw else None
+        path = url.path[len('/api/3.0/'):]
+        for route_method, pattern, name in self.ROUTES:
+            match = re.fullmatch(pattern, path)
+            if route_method == method and match:
+                break
+        else:
+            return self.respond(404, {'message': 'Not found'})
+        self.server.count(name)
+        if name != 'login' and not self.authorized():
+            return self.respond(401, {'message': 'Requires authentication'})
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        status, body = getattr(self, 'handle_' + name)(*match.groups())
+        self.respond(status, body)
+
+    def authorized(self):
+        auth = self.headers.get('Authorization') or ''
+        return auth.split(' ')[-1] in self.server.tokens
+
+    def respond(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def handle_login(self):
+        token = 'token%s' % len(self.server.tokens)
+        with self.server.lock:
+            self.server.tokens.add(token)
+        return 200, {'access_token': token, 'token_type': 'Bearer',
+                     'expires_in': 3600}
+
+    def handle_user(self):
+        return 200, {'id': 1, 'display_name': 'Henry Benchmark'}
+
+    def handle_models(self):
+        return 200, self.server.instance['models']
+
+    def handle_model(self, model):
+        if model not in self.server.models:
+            return 404, {'message': 'Not found'}
+        return 200, self.server.models[model]
+
+    def handle_explore(self, model, explore):
+        body = self.server.instance['explores'].get(model, {}).get(explore)
+        if body is None:
+            return 404, {'message': 'Not found'}
+        return 200, body
+
+    def handle_projects(self):
+        return 200, [self._project(p)
+                     for p in self.server.instance['projects']]
+
+    def handle_project(self, project):
+        if project not in self.server.projects:
+            return 404, {'message': 'Not found'}
+        return 200, self._project(self.server.projects[project])
+
+    def _project(self, project):
+        return {k: v for k, v in project.items() if k not in ('files', 'ref')}
+
+    def handle_project_files(self, project):
+        if project not in self.server.projects:
+            return 404, {'message': 'Not found'}
+        return 200, self.server.projects[project]['files']
+
+    def handle_git_branch(self, project):
+        if project not in self.server.projects:
+            return 404, {'message': 'Not found'}
+        return 200, {'name': 'master',
+                     'ref': self.server.projects[project]['ref']}
+
+    def handle_git_connection_tests(self, project):
+        return 200, [{'id': t} for t in ('git_remote_url', 'ls_remote',
+                                         'git_push')]
+
+    def handle_run_git_connection_test(self, project, test):
+        return 200, {'id': test, 'status': 'pass', 'message': ''}
+
+    def handle_run_query(self):
+        if self.server.query_latency:
+            time.sleep(self.server.query_latency)
+        return 200, self.server.run_query(self.body)
+
+    def handle_create_query(self):
+        with self.server.lock:
+            query_id = str(len(self.server.queries) + 1)
+            self.server.queries[query_id] = self.body
+        return 200, dict(self.body, id=query_id)
+
+    # tasks run straight away: their latency is paid when they are created
+    def handle_create_query_task(self):
+        body = self.server.queries.get(str(self.body['query_id']))
+        if body is None:
+            return 404, {'message': 'Not found'}
+        if self.server.query_latency:
+            time.sleep(self.server.query_latency)
+        rows = self.server.run_query(body)
+        with self.server.lock:
+            task_id = 'task%s' % len(self.server.tasks)
+            self.server.tasks[task_id] = rows
+        return 200, {'id': task_id, 'query_id': self.body['query_id'],
+                     'status': 'added'}
+
+    def handle_multi_results(self):
+        ids = self.params.get('query_task_ids', '').split(',')
+        return 200, {i: {'status': 'complete',
+                         'data': self.server.tasks[i]}
+                     for i in ids if i in self.server.tasks}
+
+    def handle_get_session(self):
+        return 200, {'workspace_id': self.server.workspace}
+
+    def handle_update_session(self):
+        self.server.workspace = self.body['workspace_id']
+        return 200, {'workspace_id': self.server.workspace}
+
+    def handle_connections(self):
+        return 200, self.server.instance['connections']
+
+    # the last connection fails one of its tests so Pulse has errors to show.
+    # Tests can be given as a comma separated list, as repeated tests
+    # parameters or both, and run one after the other
+    def handle_test_connection(self, connection):
+        if connection not in self.server.connections:
+            return 404, {'message': 'Not found'}
+        tests = [t for value in self.query.get('tests', ['connect'])
+                 for t in value.split(',')]
+        if self.server.test_latency:
+            time.sleep(self.server.test_latency * len(tests))
+        failing = self.server.instance['connections'][-1]['name']
+        return 200, [{'name': t.strip(),
+                      'status': 'error' if connection == failing
+                      and t.strip() == 'kill' else 'success',
+                      'message': 'Cannot kill queries on %s' % connection}
+                     for t in tests]
+
+    def handle_legacy_features(self):
+        return 200, self.server.instance['legacy_features']
+
+    def handle_integrations(self):
+        return 200, self.server.instance['integrations']
+
+    def handle_versions(self):
+        return 200, self.server.instance['version']
+
+
+# serves an instance until interrupted so that Henry itself can be pointed
+# at it (host localhost, the port printed below, any client id and secret)
+def main():
+    parser = argparse.ArgumentParser(description='Fake Looker API server')
+    parser.add_argument('--scale', choices=sorted(synthetic.SCALES),
+                        default='small')
+    parser.add_argument('--fixture', help='Serve a saved instance')
+    parser.add_argument('--save', help='Save the generated instance')
+    parser.add_argument('--port', type=int, default=19999)
+    parser.add_argument('--latency', type=float, default=0,
+                        help='Seconds added to every request')
+    parser.add_argument('--query_latency', type=float, default=0,
+                        help='Seconds added to every query')
+    parser.add_argument('--test_latency', type=float, default=0,
+                        help='Seconds added to every test of a connection')
+    args = parser.parse_args()
+    if args.fixture:
+        instance = synthetic.load(args.fixture)
+    else:
+        instance = synthetic.generate(**synthetic.SCALES[args.scale])
+    if args.save:
+        synthetic.save(instance, args.save)
+    server = FakeLooker(instance, port=args.port, latency=args.latency,
+                        query_latency=args.query_latency,
+                        test_latency=args.test_latency)
+    print('Serving fake Looker on https://localhost:%s' % server.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+#!/usr/local/bin/python3
+# instance.py
+import json
+import random
+
+# benchmark scales: projects, models per project, explores per model, fields
+# per explore, days of history and history rows per day
+SCALES = {
+    'small': dict(projects=2, models=2, explores=5, fields=20, days=30,
+                  queries_per_day=50),
+    'medium': dict(projects=5, models=4, explores=10, fields=50, days=90,
+                   queries_per_day=300),
+    'large': dict(projects=10, models=5, explores=20, fields=100, days=90,
+                  queries_per_day=2000),
+}
+
+STATUSES = ['complete'] * 16 + ['error'] * 2 + ['killed', 'pending']
+
+
+# vacuum skips views with digits in their name, so synthetic names are
+# suffixed with letters instead of numbers (a, b, ..., z, ba, bb, ...)
+def _name(prefix, i):
+    suffix = ''
+    while True:
+        suffix = chr(ord('a') + i % 26) + suffix
+        i //= 26
+        if not i:
+            return prefix + '_' + suffix
+
+
+def _explore(model, name, views, fields, rnd):
+    dimensions, measures = [], []
+    for view in views:
+        for i in range(max(1, fields // len(views))):
+            field = {'name': view + '.' + _name('field', i),
+                     'description': '' if rnd.random() < 0.3 else 'Synthetic'}
+            if i % 4 == 3:
+                measures.append(field)
+            else:
+                dimensions.append(field)
+    joins = [{'name': v, 'sql_on': '${%s.field_a} = ${%s.field_a}'
+              % (views[0], v)} for v in views[1:]]
+    return {'name': name,
+            'model_name': model,
+            'description': '' if rnd.random() < 0.5 else 'Synthetic explore',
+            'hidden': rnd.random() < 0.1,
+            'scopes': views,
+            'joins': joins,
+            'fields': {'dimensions': dimensions, 'measures': measures,
+                       'filters': []}}
+
+
+# builds a synthetic Looker instance. The result is plain json so it can be
+# saved as a fixture and replayed later. History rows are stored relative to
+# today (days_ago) so that fixtures stay valid whenever they are replayed:
+# [days_ago, model, explore, fields, filters, sorts, pivots, status,
+#  runtime, query_id, run_count]
+def generate(projects=2, models=2, explores=5, fields=20, days=30,
+             queries_per_day=50, unused=0.3, seed=0):
+    rnd = random.Random(seed)
+    instance = {'projects': [], 'models': [], 'explores': {}, 'history': []}
+    for p in range(projects):
+        project = _name('project', p)
+        files = []
+        for m in range(models):
+            model = '%s_%s' % (project, _name('model', m))
+            files.append({'id': model + '.model.lkml', 'type': 'model'})
+            model_explores = []
+            for e in range(explores):
+                name = _name('explore', e)
+                views = [name] + [
+                    _name('view', v) for v in rnd.sample(range(26),
+                                                         rnd.randint(0, 4))]
+                body = _explore(model, name, views, fields, rnd)
+                instance['explores'].setdefault(model, {})[name] = body
+                model_explores.append({'name': name})
+            instance['models'].append({'name': model,
+                                       'project_name': project,
+                                       'has_content': True,
+                                       'explores': model_explores})
+        files.extend({'id': _name('view', v) + '.view.lkml', 'type': 'view'}
+                     for v in range(models * explores))
+        instance['projects'].append({
+            'id': project,
+            'pull_request_mode': 'off',
+            'validation_required': False,
+            'git_remote_url': 'git@example.com:%s.git' % project,
+            'ref': '%040x' % rnd.getrandbits(160),
+            'files': files})
+
+    # a share of explores and fields never shows up in history
+    used = [e for m in instance['explores'].values() for e in m.values()
+            if rnd.random() >= unused]
+    query_id = 0
+    for days_ago in range(days):
+        for i in range(queries_per_day if used else 0):
+            explore = rnd.choice(used)
+            exposed = [f['name'] for kind in ('dimensions', 'measures')
+                       for f in explore['fields'][kind]]
+            pool = exposed[:max(1, int(len(exposed) * (1 - unused)))]
+            picked = rnd.sample(pool, min(len(pool), rnd.randint(1, 5)))
+            query_id += 1
+            instance['history'].append([
+                days_ago, explore['model_name'], explore['name'],
+                json.dumps(picked),
+                '%s: "-NULL"' % picked[0] if rnd.random() < 0.5 else None,
+                picked[-1] + ' desc' if rnd.random() < 0.5 else None,
+                None, rnd.choice(STATUSES),
+                round(rnd.expovariate(1 / 3.0), 3), query_id,
+                rnd.randint(1, 20)])
+
+    instance['connections'] = [
+        {'name': 'looker', 'dialect': {'connection_tests': ['connect']}}]
+    instance['connections'].extend(
+        {'name': _name('connection', c),
+         'dialect': {'connection_tests': ['connect', 'kill', 'query',
+                                          'database_timezone']}}
+        for c in range(max(1, projects)))
+    instance['legacy_features'] = [
+        {'name': _name('feature', f), 'enabled': f % 3 == 0}
+        for f in range(6)]
+    instance['integrations'] = [
+        {'label': _name('integration', i), 'enabled': i % 2 == 0}
+        for i in range(4)]
+    instance['version'] = {'looker_release_version': '6.20.10'}
+    return instance
+
+
+def save(instance, path):
+    with open(path, 'w') as f:
+        json.dump(instance, f)
+
+
+def load(path):
+    with open(path, 'r') as f:
+        return json.load(f)
@@ -0,0 +1,164 @@
+#!/usr/local/bin/python3
+# run.py
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import statistics
+import time
+from tabulate import tabulate
+from henry.commands.analyze import Analyze
+from henry.commands.pulse import Pulse
+from henry.commands.vacuum import Vacuum
+from henry.modules.async_lookerapi import AsyncLookerApi
+from henry.modules.lookerapi import LookerApi
+from . import instance as synthetic
+from .fake_looker import FakeLooker
+
+bench_logger = logging.getLogger('benchmark')
+
+USAGE = {'timeframe': 90, 'min_queries': 0}
+
+
+def analyze(which, **kwargs):
+    def run(looker, options):
+        command = Analyze(looker, **options)
+        return command.analyze(which=which, project=None, model=None,
+                               explore=None, sortkey=None, limit=None,
+                               plain=False, **kwargs)
+    return run
+
+
+def vacuum(which, **kwargs):
+    def run(looker, options):
+        command = Vacuum(looker, **options)
+        return command.vacuum(which=which, project=None, model=None,
+                              explore=None, plain=False, **kwargs)
+    return run
+
+
+# `henry pulse`, except that the version check only asks the instance for
+# its version rather than also comparing it with learn.looker.com
+def pulse(looker, options):
+    command = Pulse(looker, async_looker=options['async_looker'],
+                    workers=options['workers'],
+                    window_days=options['window_days'],
+                    query_tasks=options['query_tasks'])
+    command.check_version = lambda: looker.get_version()
+    return command.run_all()
+
+
+COMMANDS = [
+    ('analyze projects', analyze('projects')),
+    ('analyze models', analyze('models', **USAGE)),
+    ('analyze explores', analyze('explores', **USAGE)),
+    ('analyze fields', analyze('fields', **USAGE)),
+    ('vacuum models', vacuum('models', **USAGE)),
+    ('vacuum explores', vacuum('explores', **USAGE)),
+    ('vacuum fields', vacuum('fields', **USAGE)),
+    ('pulse', pulse),
+]
+
+
+def connect(server, args):
+    looker = LookerApi(id='benchmark', secret='benchmark', host='localhost',
+                       port=server.port, access_token=None, timeout=120,
+                       session_info='henry-benchmark',
+                       max_concurrency=args.workers)
+    async_looker = None
+    if args.use_async:
+        async_looker = AsyncLookerApi.from_looker(looker, args.workers)
+    return looker, {'workers': args.workers,
+                    'async_looker': async_looker,
+                    'window_days': args.window_days,
+                    'query_tasks': args.query_tasks}
+
+
+# times one command. Each repeat gets a fresh API client, as a new henry
+# invocation would, and command output is discarded
+def run_command(server, fn, args):
+    timings = []
+    requests = 0
+    for i in range(args.repeat):
+        looker, options = connect(server, args)
+        server.reset_counts()
+        with contextlib.redirect_stdout(io.StringIO()), \
+                contextlib.redirect_stderr(io.StringIO()):
+            started = time.perf_counter()
+            fn(looker, options)
+            timings.append(time.perf_counter() - started)
+        requests = sum(server.requests.values())
+    return {'median': statistics.median(timings), 'min': min(timings),
+            'requests': requests}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Times henry commands against a fake Looker instance')
+    parser.add_argument('--scales', default='small,medium',
+                        help='Comma separated scales from %s'
+                        % ', '.join(synthetic.SCALES))
+    parser.add_argument('--fixture',
+                        help='Replay a saved instance instead of generating '
+                        'one per scale')
+    parser.add_argument('--commands',
+                        help='Comma separated subset of commands to run')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--latency', type=float, default=0.01,
+                        help='Seconds added to every request')
+    parser.add_argument('--query_latency', type=float, default=0.05,
+                        help='Seconds added to every query')
+    parser.add_argument('--test_latency', type=float, default=0.125,
+                        help='Seconds added to every test of a connection')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--async', action='store_true', dest='use_async')
+    parser.add_argument('--query_tasks', action='store_true')
+    parser.add_argument('--window_days', type=int, default=7)
+    parser.add_argument('--output', help='Save the results as json')
+    args = parser.parse_args()
+    # keep expected warnings (e.g. the initial token check) out of the report
+    logging.basicConfig(level=logging.ERROR)
+    # requests lets these override LookerApi's verify=False, which would
+    # reject the fake instance's self-signed certificate
+    for variable in ('REQUESTS_CA_BUNDLE', 'CURL_CA_BUNDLE'):
+        os.environ.pop(variable, None)
+
+    if args.fixture:
+        instances = [(args.fixture, synthetic.load(args.fixture))]
+    else:
+        instances = [(scale, synthetic.generate(**synthetic.SCALES[scale]))
+                     for scale in args.scales.split(',')]
+    commands = COMMANDS
+    if args.commands:
+        selected = [c.strip() for c in args.commands.split(',')]
+        commands = [c for c in COMMANDS if c[0] in selected]
+
+    results = []
+    for scale, instance in instances:
+        server = FakeLooker(instance, latency=args.latency,
+                            query_latency=args.query_latency,
+                            test_latency=args.test_latency).start()
+        try:
+            for name, fn in commands:
+                bench_logger.info('Running %s at %s scale', name, scale)
+                result = run_command(server, fn, args)
+                result.update(scale=scale, command=name)
+                results.append(result)
+        finally:
+            server.stop()
+
+    print(tabulate([[r['scale'], r['command'], '%.3f' % r['median'],
+                     '%.3f' % r['min'], r['requests']] for r in results],
+                   headers=['scale', 'command', 'median (s)', 'min (s)',
+                            'requests'],
+                   tablefmt='psql'))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'options': vars(args), 'results': results}, f,
+                      indent=2)
+
+
+if __name__ == '__main__':
+    main()
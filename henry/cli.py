@@ -1,12 +1,17 @@
 #!/usr/bin/env python3
-from modules.lookerapi import LookerApi
+# the API client, the commands and their dependencies (requests, aiohttp,
+# tabulate, tqdm, yaml) are only imported once the arguments have been
+# parsed, so that --help and argument errors return right away
 import argparse
+import contextlib
 import os
 import errno
 import sys
-from modules.spinner import Spinner
-from modules.auth import authenticate
-import logging.config
+from modules import writers
+from modules.shards import parse_shard
+from modules.profiler import Profiler, track
+from modules.tracer import Tracer
+import logging
 import henry
 import json
 import uuid
@@ -14,31 +19,34 @@ import __version__ as pkg
 LOGGING_CONFIG_PATH = os.path.join(os.path.dirname(henry.__file__),
                                    '.support_files/logging.conf')
 METADATA_PATH = os.path.join(os.path.expanduser('~'), '.henry')
-if not os.path.exists(METADATA_PATH):
-    os.mkdir(METADATA_PATH)
-elif os.path.exists(METADATA_PATH) and not os.path.isdir(METADATA_PATH):
-    print('Cannot create metadata directory in %s' % METADATA_PATH)
-    sys.exit(1)
 LOGGING_LOG_PATH = os.path.join(METADATA_PATH, 'log')
-if not os.path.exists(LOGGING_LOG_PATH):
-    os.mkdir(LOGGING_LOG_PATH)
-elif os.path.exists(LOGGING_LOG_PATH) and not os.path.isdir(LOGGING_LOG_PATH):
-    print('Cannot create log directory in %s' % LOGGING_LOG_PATH)
-    sys.exit(1)
-LOGGING_LOG_PATH = os.path.join(LOGGING_LOG_PATH, 'henry.log')
-logging.config.fileConfig(LOGGING_CONFIG_PATH,
-                          defaults={'logfilename': LOGGING_LOG_PATH},
-                          disable_existing_loggers=False)
-from commands.analyze import Analyze
-from commands.vacuum import Vacuum
-from commands.pulse import Pulse
 
 logger = logging.getLogger('main')
 # sys.tracebacklimit = -1 # enable only on shipped release
 
 
+# creates the metadata and log directories and sets up file logging
+def configure_logging():
+    import logging.config
+    if not os.path.exists(METADATA_PATH):
+        os.mkdir(METADATA_PATH)
+    elif os.path.exists(METADATA_PATH) and not os.path.isdir(METADATA_PATH):
+        print('Cannot create metadata directory in %s' % METADATA_PATH)
+        sys.exit(1)
+    if not os.path.exists(LOGGING_LOG_PATH):
+        os.mkdir(LOGGING_LOG_PATH)
+    elif os.path.exists(LOGGING_LOG_PATH) and \
+            not os.path.isdir(LOGGING_LOG_PATH):
+        print('Cannot create log directory in %s' % LOGGING_LOG_PATH)
+        sys.exit(1)
+    logging.config.fileConfig(LOGGING_CONFIG_PATH,
+                              defaults={'logfilename':
+                                        os.path.join(LOGGING_LOG_PATH,
+                                                     'henry.log')},
+                              disable_existing_loggers=False)
+
+
 def main():
-    logger.info('Starting henry')
     HELP_PATH = os.path.join(os.path.dirname(henry.__file__),
                              '.support_files/help.rtf')
     with open(HELP_PATH, 'r') as myfile:
@@ -47,20 +55,43 @@ def main():
     # load custom config settings if defined in ~/.henry/henry.json
     settings_file = os.path.join(os.getcwd(),'settings.json')
     timeout = 120
+    workers = 1
+    use_async = False
+    cache_ttl = 86400
+    cache_max_size = 512
+    local_usage = False
+    window_days = 7
+    query_tasks = False
+    query_task_timeout = 600
+    max_retries = 5
+    latency_target = None
+    test_timeout = None
     config_path = os.path.join(os.getcwd(),'config.yml')
+    settings = {}
     if settings_file:
         with open(settings_file, 'r') as f:
             settings = json.load(f)
             timeout = settings.get('api_conn_timeout', timeout)
+            workers = settings.get('api_max_concurrency', workers)
+            use_async = settings.get('api_async', use_async)
+            cache_ttl = settings.get('cache_ttl', cache_ttl)
+            cache_max_size = settings.get('cache_max_size', cache_max_size)
+            local_usage = settings.get('usage_store', local_usage)
+            window_days = settings.get('history_window_days', window_days)
+            query_tasks = settings.get('query_tasks', query_tasks)
+            query_task_timeout = settings.get('query_task_timeout',
+                                              query_task_timeout)
+            max_retries = settings.get('api_max_retries', max_retries)
+            latency_target = settings.get('api_latency_target',
+                                          latency_target)
+            test_timeout = settings.get('connection_test_timeout',
+                                        test_timeout)
             host = settings.get('host')
             client_id = settings.get('client_id')
             client_secret = settings.get('client_secret')
             if type(timeout) is list:
                 timeout = tuple(timeout)
             config_path = settings.get('config_path', config_path)
-        logger.info('Loaded config settings from ~/.henry/settings.json, {settings}')
-    else:
-        logger.info('No custom config file found. Using defaults.')
 
     parser = argparse.ArgumentParser(
         description=descStr,
@@ -120,7 +151,8 @@ def main():
     analyze_models.add_argument('--timeframe',
                                 type=int,
                                 default=90,
-                                help='Timeframe (between 0 and 90)')
+                                help='Timeframe in days (up to 90, or longer '
+                                     'with --local_usage)')
     analyze_models.add_argument('--min_queries',
                                 type=int,
                                 default=0,
@@ -149,7 +181,8 @@ def main():
     analyze_explores.add_argument('--timeframe',
                                   type=int,
                                   default=90,
-                                  help='Timeframe (between 0 and 90)')
+                                  help='Timeframe in days (up to 90, or longer '
+                                       'with --local_usage)')
     analyze_explores.add_argument('--min_queries',
                                   type=int,
                                   default=0,
@@ -178,7 +211,8 @@ def main():
     analyze_fields.add_argument('--timeframe',
                                   type=int,
                                   default=90,
-                                  help='Timeframe (between 0 and 90)')
+                                  help='Timeframe in days (up to 90, or longer '
+                                       'with --local_usage)')
     analyze_fields.add_argument('--min_queries',
                                   type=int,
                                   default=0,
@@ -241,7 +275,8 @@ def main():
     vacuum_explores.add_argument('--timeframe',
                                  type=int,
                                  default=90,
-                                 help='Timeframe (between 0 and 90)')
+                                 help='Timeframe in days (up to 90, or longer '
+                                      'with --local_usage)')
 
     vacuum_explores.add_argument('--min_queries',
                                  type=int,
@@ -263,18 +298,188 @@ def main():
     vacuum_fields.add_argument('--timeframe',
                                  type=int,
                                  default=90,
-                                 help='Timeframe (between 0 and 90)')
+                                 help='Timeframe in days (up to 90, or longer '
+                                      'with --local_usage)')
 
     vacuum_fields.add_argument('--min_queries',
                                  type=int,
                                  default=0,
                                  help='Query threshold')
+
+    # MERGE Subcommand
+    merge_parser = subparsers.add_parser('merge', help='merge help',
+                                         usage='henry merge FILE [FILE ...]')
+    merge_parser.set_defaults(which=None)
+    merge_parser.add_argument('files',
+                              nargs='+',
+                              metavar='FILE',
+                              help='Shard files written with --shard')
+    merge_parser.add_argument('--partial',
+                              action='store_true',
+                              help='Merge the shards given even if some '
+                                   'are missing')
+    merge_parser.add_argument('--order_by',
+                              nargs=2,
+                              metavar=('ORDER_FIELD', 'ASC/DESC'),
+                              dest='sortkey',
+                              help='Sort results by a field. Default: the '
+                                   '--order_by of the shards')
+    merge_parser.add_argument('--limit',
+                              type=int,
+                              default=None,
+                              nargs=1,
+                              help='Limit results. Default: the --limit of '
+                                   'the shards')
+    merge_parser.add_argument('--format',
+                              choices=writers.FORMATS,
+                              default='table',
+                              help='Output format. Default: table')
+    merge_parser.add_argument('--output',
+                              type=str,
+                              default=None,
+                              help='Path to file for saving the output. '
+                                   'Paths ending in .gz are compressed, '
+                                   '- is stdout')
+    merge_parser.add_argument('-q', '--quiet',
+                              action='store_true',
+                              help='Silence output')
+    merge_parser.add_argument('--plain',
+                              default=None,
+                              action='store_true',
+                              help='Show results in a table format '
+                                   'without the gridlines')
+    for subparser in [analyze_models, analyze_explores, analyze_fields,
+                      vacuum_models, vacuum_explores, vacuum_fields]:
+        subparser.add_argument('--shard',
+                               type=parse_shard,
+                               default=None,
+                               metavar='i/N',
+                               help='Only go through the i-th of N shards '
+                                    'of the models or explores and write '
+                                    'its rows for henry merge')
+    for subparser in [analyze_models, analyze_explores, analyze_fields,
+                      vacuum_models, vacuum_explores, vacuum_fields, pulse]:
+        subparser.add_argument('--query_tasks',
+                               default=query_tasks,
+                               action='store_true',
+                               help='Run i__looker queries as async query '
+                                    'tasks and poll for their results')
+        subparser.add_argument('--no_query_tasks',
+                               dest='query_tasks',
+                               default=query_tasks,
+                               action='store_false',
+                               help='Run i__looker queries inline even if '
+                                    'query_tasks is set')
+    for subparser in [analyze_projects, analyze_explores, analyze_fields,
+                      vacuum_models, vacuum_explores, vacuum_fields, pulse]:
+        subparser.add_argument('--workers',
+                               type=int,
+                               default=workers,
+                               help='Number of concurrent API calls used to '
+                                    'fetch explores. Default: %s' % workers)
+    for subparser in [analyze_explores, analyze_fields, vacuum_models,
+                      vacuum_explores, vacuum_fields, pulse]:
+        subparser.add_argument('--async',
+                               dest='use_async',
+                               default=use_async,
+                               action='store_true',
+                               help='Issue concurrent API calls from a single '
+                                    'asyncio event loop (requires aiohttp)')
+        subparser.add_argument('--no_async',
+                               dest='use_async',
+                               default=use_async,
+                               action='store_false',
+                               help='Use threads for concurrent API calls '
+                                    'even if api_async is set')
+    for subparser in [analyze_projects, analyze_models, analyze_explores,
+                      analyze_fields, vacuum_models, vacuum_explores,
+                      vacuum_fields]:
+        subparser.add_argument('--no_cache',
+                               action='store_true',
+                               help='Do not read or write the local LookML '
+                                    'metadata cache')
+        subparser.add_argument('--refresh',
+                               action='store_true',
+                               help='Ignore cached LookML metadata and '
+                                    'refresh the cache from the API')
+    for subparser in [analyze_models, analyze_explores, analyze_fields,
+                      vacuum_models, vacuum_explores, vacuum_fields]:
+        subparser.add_argument('--local_usage',
+                               default=local_usage,
+                               action='store_true',
+                               help='Answer usage questions from the local '
+                                    'usage store, fetching only the days '
+                                    'since its last sync')
+        subparser.add_argument('--no_local_usage',
+                               dest='local_usage',
+                               default=local_usage,
+                               action='store_false',
+                               help='Query usage from i__looker even if '
+                                    'usage_store is set')
+    for subparser in [analyze_explores, analyze_fields, vacuum_explores,
+                      vacuum_fields]:
+        subparser.add_argument('--resume',
+                               action='store_true',
+                               help='Continue the last run of the same '
+                                    'command that was interrupted, reusing '
+                                    'the explores it completed')
+    for subparser in [analyze_explores, analyze_fields, vacuum_explores]:
+        subparser.add_argument('--stream',
+                               action='store_true',
+                               help='Write every row as soon as its explore '
+                                    'has been analyzed instead of a table '
+                                    'at the end')
+    for subparser in [analyze_projects, analyze_models, analyze_explores,
+                      analyze_fields, vacuum_models, vacuum_explores,
+                      vacuum_fields]:
+        subparser.add_argument('--format',
+                               choices=writers.FORMATS,
+                               default='table',
+                               help='Output format. Rows are written one '
+                                    'at a time in every format but table. '
+                                    'Default: table')
     for subparser in [analyze_projects, analyze_models, analyze_explores, analyze_fields,
                       vacuum_models, vacuum_explores, vacuum_fields, pulse]:
         subparser.add_argument('--output',
                                type=str,
                                default=None,
-                               help='Path to file for saving the output')
+                               help='Path to file for saving the output. '
+                                    'Paths ending in .gz are compressed, '
+                                    '- is stdout')
+        subparser.add_argument('--profile',
+                               action='store_true',
+                               help='Print the time spent per API endpoint '
+                                    'and per phase once the run is done')
+        subparser.add_argument('--profile_json',
+                               type=str,
+                               default=None,
+                               metavar='PATH',
+                               help='Append the profile of the run to PATH '
+                                    'as a line of JSON')
+        subparser.add_argument('--trace',
+                               type=str,
+                               default=None,
+                               metavar='FILE',
+                               help='Save a Chrome trace of the run to FILE, '
+                                    'to view in chrome://tracing or '
+                                    'Perfetto')
+        subparser.add_argument('--cpu_profile',
+                               type=str,
+                               default=None,
+                               metavar='FILE',
+                               help='Save a cProfile of every thread to '
+                                    'FILE, to read with python -m pstats')
+        subparser.add_argument('--cpu_sample',
+                               action='store_true',
+                               help='With --cpu_profile, sample stacks '
+                                    'instead of tracing every call and save '
+                                    'them as collapsed stacks for flame '
+                                    'graphs')
+        subparser.add_argument('--mem_profile',
+                               action='store_true',
+                               help='Trace memory allocations and print '
+                                    'the memory used per phase and the top '
+                                    'allocators once the run is done')
         subparser.add_argument('-q', '--quiet',
                                action='store_true',
                                help='Silence output')
@@ -313,73 +518,299 @@ def main():
             _args[key] = '[FILTERED]'
         else:
             _args[key] = value
-    logger.info('Parsing args, %s', _args)
 
     if not args['command']:
         print('usage:', parser.usage)
         print('\nNo command specified. Try `henry --help` for help.')
         sys.exit(1)
-    auth_params = ('host', 'port', 'client_id', 'client_secret', 'persist',
-                   'alias', 'path')
-    auth_args = {k: args[k] for k in auth_params}
 
-    # authenticate
+    configure_logging()
+    logger.info('Starting henry')
+    if settings:
+        logger.info('Loaded config settings from %s', settings_file)
+    else:
+        logger.info('No custom config file found. Using defaults.')
+    logger.info('Parsing args, %s', _args)
+    from modules.auth import authenticate
+    # fail on a bad output path before doing any work. Shards are always
+    # written as ndjson
+    if args['output']:
+        check_output(args['output'],
+                     'ndjson' if args.get('shard') else args.get('format'))
+    if args['command'] == 'merge':
+        merge(args)
+        return
     if args['command'] != 'pulse':
         cmd = args['command']+' '+args['which']
     else:
         cmd = args['command']
-    session_info = 'Henry v{pkg.__version__}: cmd={cmd}' \
-                   ', sid=#{uuid.uuid1()}'
-
-    looker = authenticate(timeout, session_info, config_path, **auth_args)
-    # map subcommand to function
-    if args['command'] in ('analyze', 'vacuum'):
-        if args['which'] is None:
-            parser.error("No command")
-        else:
-            if args['command'] == 'analyze':
-                analyze = Analyze(looker)
-                result = analyze.analyze(**args)
-            else:
-                vacuum = Vacuum(looker)
-                result = vacuum.vacuum(**args)
-        # silence outout if --silence flag is used
-        if not args['quiet']:
-            print(result)
-    elif args['command'] == 'pulse':
-                pulse = Pulse(looker)
-                result = pulse.run_all()
-    else:
-        print('No command passed')
+    profiler = None
+    if args['profile'] or args['profile_json'] or args['mem_profile']:
+        profiler = Profiler(memory=args['mem_profile'])
+    tracer = Tracer() if args['trace'] else None
+    cpu_profiler = None
+    if args['cpu_profile']:
+        from modules.cpuprofile import CallProfiler, StackSampler
+        cpu_profiler = StackSampler() if args['cpu_sample'] \
+            else CallProfiler()
+        cpu_profiler.start()
+    journal = None
+    interrupted = False
+    try:
+        auth_params = ('host', 'port', 'client_id', 'client_secret', 'persist',
+                       'alias', 'path')
+        auth_args = {k: args[k] for k in auth_params}
 
-    # save to file if --output flag is used
-    if args['output']:
-        logger.info('Saving results to file: %s', args['output'])
-        if os.path.isdir(args['output']):
-            error = IsADirectoryError(errno.EISDIR,
-                                      os.strerror(errno.EISDIR),
-                                      args['output'])
-            logger.error(error)
-            raise error
-        elif not args['output'].endswith('.txt'):
-            error = ValueError('Output file must be a .txt file')
-            logger.exception(error)
-            raise error
-        elif os.path.isfile(args['output']):
-            error = FileExistsError(errno.EEXIST,
-                                    os.strerror(errno.EEXIST),
-                                    args['output'])
-            logger.error(error)
-            raise error
+        # authenticate
+        session_info = 'Henry v{pkg.__version__}: cmd={cmd}' \
+                       ', sid=#{uuid.uuid1()}'
+
+        workers = args.get('workers') or workers
+        with track('authenticate', profiler, tracer):
+            looker = authenticate(timeout, session_info, config_path,
+                                  max_concurrency=workers,
+                                  max_retries=max_retries,
+                                  latency_target=latency_target,
+                                  settings=settings, profiler=profiler,
+                                  tracer=tracer, **auth_args)
+        if not args.get('no_cache', True):
+            from modules.cache import MetadataCache
+            from modules.fetcher import Fetcher
+            cache = MetadataCache(looker.host, ttl=cache_ttl,
+                                  max_size=cache_max_size * 1024 * 1024,
+                                  refresh=args['refresh'])
+            with track('validate cache', profiler, tracer):
+                cache.validate(Fetcher(looker, workers=workers)
+                               .get_project_revisions())
+            looker.cache = cache
+        usage_store = None
+        if args.get('local_usage'):
+            from modules.usage_store import UsageStore
+            usage_store = UsageStore(looker.host)
+        # runs going explore by explore are checkpointed so that they can
+        # be resumed if interrupted
+        if args['command'] in ('analyze', 'vacuum') and \
+                args['which'] in ('explores', 'fields'):
+            from modules.journal import Journal
+            params = {k: args[k] for k in ('model', 'explore', 'timeframe',
+                                           'min_queries')}
+            # every shard is a run of its own
+            if args['shard']:
+                params['shard'] = args['shard']
+            journal = Journal(looker.host, cmd, params,
+                              resume=args['resume'])
+            if args['resume'] and len(journal):
+                print('Resuming run %s, %s explores done'
+                      % (journal.run_id, len(journal)), file=sys.stderr)
+        async_looker = None
+        if args.get('use_async'):
+            from modules.async_lookerapi import AsyncLookerApi
+            async_looker = AsyncLookerApi.from_looker(looker,
+                                                      max_concurrency=workers)
+        # map subcommand to function
+        if args['command'] in ('analyze', 'vacuum'):
+            write_rows = args.get('stream') or args.get('shard') or \
+                         args.get('format', 'table') != 'table'
+            # progress messages would be mixed up with rows written to
+            # stdout, so they go to stderr instead
+            progress = sys.stdout
+            if write_rows and args['output'] in (None, '-'):
+                progress = sys.stderr
+            if args['which'] is None:
+                parser.error("No command")
+            else:
+                with contextlib.redirect_stdout(progress):
+                    if args['command'] == 'analyze':
+                        from commands.analyze import Analyze
+                        analyze = Analyze(
+                                      looker, workers=workers,
+                                      async_looker=async_looker,
+                                      usage_store=usage_store,
+                                      window_days=window_days,
+                                      query_tasks=args.get('query_tasks'),
+                                      query_task_timeout=query_task_timeout,
+                                      journal=journal,
+                                      shard=args.get('shard'))
+                        result = analyze.analyze(**args)
+                    else:
+                        from commands.vacuum import Vacuum
+                        vacuum = Vacuum(looker, workers=workers,
+                                        async_looker=async_looker,
+                                        usage_store=usage_store,
+                                        window_days=window_days,
+                                        query_tasks=args['query_tasks'],
+                                        query_task_timeout=query_task_timeout,
+                                        journal=journal,
+                                        shard=args.get('shard'))
+                        result = vacuum.vacuum(**args)
+            if args.get('shard'):
+                with track('write output', profiler, tracer):
+                    write_shard(result, looker.host, cmd, args, progress)
+                return
+            if write_rows:
+                with track('write output', profiler, tracer):
+                    write_result(result, args, progress)
+                return
+            # silence outout if --silence flag is used
+            if not args['quiet'] and args['output'] != '-':
+                print(result)
+        elif args['command'] == 'pulse':
+            from commands.pulse import Pulse
+            pulse = Pulse(looker, async_looker=async_looker,
+                          workers=workers, window_days=window_days,
+                          query_tasks=args['query_tasks'],
+                          query_task_timeout=query_task_timeout,
+                          test_timeout=test_timeout)
+            result = pulse.run_all()
         else:
+            print('No command passed')
+
+        # save to file if --output flag is used
+        if args['output']:
+            logger.info('Saving results to file: %s', args['output'])
             try:
-                f = open(args['output'], 'w+')
-                f.write(result+'\n')
-                f.close()
+                with track('write output', profiler, tracer):
+                    f = writers.open_output(args['output'])
+                    f.write(result+'\n')
+                    if f is not sys.stdout:
+                        f.close()
                 logger.info('Results succesfully saved.')
             except Exception as e:
                 logger.error(e)
                 raise(e)
+    except BaseException:
+        interrupted = True
+        if journal is not None and len(journal):
+            print('Progress saved: %s explores done. Run the same command '
+                  'with --resume to continue' % len(journal),
+                  file=sys.stderr)
+        raise
+    finally:
+        if journal is not None:
+            # a run that completed has nothing left to resume
+            if interrupted and len(journal):
+                journal.close()
+            else:
+                journal.remove()
+        if cpu_profiler is not None:
+            cpu_profiler.stop()
+        if profiler is not None:
+            report_profile(profiler, args, cmd)
+        # written last so that saving it doesn't show up in the other
+        # profiles
+        if cpu_profiler is not None:
+            cpu_profiler.write(args['cpu_profile'])
+            logger.info('CPU profile saved to %s', args['cpu_profile'])
+        if tracer is not None:
+            # the whole run, which every other span falls within
+            tracer.complete('henry ' + cmd, tracer.started, cat='run')
+            tracer.write(args['trace'])
+            logger.info('Trace saved to %s', args['trace'])
+
+
+# prints the profile to stderr with --profile (and its memory with
+# --mem_profile) and appends it to the file given with --profile_json
+def report_profile(profiler, args, command):
+    if args['profile']:
+        print(profiler.report(command), file=sys.stderr)
+    if args['mem_profile']:
+        print(profiler.memory_report(command), file=sys.stderr)
+    if args['profile_json']:
+        profiler.dump(args['profile_json'], command)
+        logger.info('Profile saved to %s', args['profile_json'])
+
+
+# combines the shard files of an analyze or vacuum run made with --shard.
+# Only the files are read, so there is nothing to authenticate
+def merge(args):
+    from commands.merge import Merge
+    result = Merge(args['files'], partial=args['partial']).merge(**args)
+    if args['format'] != 'table':
+        write_result(result, args)
+        return
+    if not args['quiet'] and args['output'] != '-':
+        print(result)
+    if args['output']:
+        logger.info('Saving results to file: %s', args['output'])
+        f = writers.open_output(args['output'])
+        f.write(result+'\n')
+        if f is not sys.stdout:
+            f.close()
+        logger.info('Results succesfully saved.')
+
+
+def check_output(path, format=None):
+    if path == '-':
+        return
+    if os.path.isdir(path):
+        error = IsADirectoryError(errno.EISDIR,
+                                  os.strerror(errno.EISDIR),
+                                  path)
+        logger.error(error)
+        raise error
+    elif format in (None, 'table') and \
+            not path.endswith(('.txt', '.txt.gz')):
+        error = ValueError('Output file must be a .txt file')
+        logger.exception(error)
+        raise error
+    elif os.path.isfile(path):
+        error = FileExistsError(errno.EEXIST,
+                                os.strerror(errno.EEXIST),
+                                path)
+        logger.error(error)
+        raise error
+
+
+# writes result rows to --output, or stdout, in --format as they are
+# produced. Anything printed while producing them goes to progress
+def write_result(rows, args, progress=sys.stdout):
+    if args['output']:
+        logger.info('Writing results to: %s', args['output'])
+        out = writers.open_output(args['output'])
+    elif args['quiet']:
+        for row in rows:
+            pass
+        return
+    else:
+        out = sys.stdout
+    writer = writers.get_writer(args['format'], out, plain=args['plain'])
+    try:
+        with contextlib.redirect_stdout(progress):
+            writers.write_rows(writer, rows, flush=out is sys.stdout)
+    except BrokenPipeError:
+        # the reader went away (e.g. `| head`), which is not an error. The
+        # rest of the output is sent to devnull so that flushing stdout on
+        # exit does not fail again
+        logger.info('Output pipe closed by the reader')
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    logger.info('Results succesfully written.')
+
+
+# writes the rows of a --shard run to --output, or stdout, as a shard file
+# for `henry merge`. The header records the run so that merge can tell
+# whether shard files belong together
+def write_shard(rows, host, command, args, progress=sys.stdout):
+    from modules.shards import write_shard as write
+    header = {'host': host,
+              'command': command,
+              'shard': list(args['shard']),
+              'params': {k: args.get(k) for k in ('project', 'model',
+                                                  'explore', 'timeframe',
+                                                  'min_queries')},
+              'sortkey': args.get('sortkey'),
+              'limit': args.get('limit')}
+    out = writers.open_output(args['output'] or '-')
+    try:
+        with contextlib.redirect_stdout(progress):
+            count = write(out, header, rows)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    logger.info('Shard %s/%s saved, %s rows', *args['shard'], count)
 
 if __name__ == "__main__":
     main()
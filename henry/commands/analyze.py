@@ -2,13 +2,29 @@
 import logging
 from henry.modules.fetcher import Fetcher as fetcher
 from henry.modules import styler
+from henry.modules.profiler import phase, timed
+from henry.modules.query_tasks import TIMEOUT
 from tabulate import tabulate
 import json
 
 
 class Analyze(fetcher):
-    def __init__(self, looker):
-        super(Analyze,self).__init__(looker)
+    # columns of the explores and fields rows that only need the explore
+    # listing and the usage snapshot, so rows can be ranked on them before
+    # any explore body is fetched
+    EXPLORE_RANK_KEYS = ('model', 'explore', 'query_count')
+    FIELD_RANK_KEYS = ('model', 'explore')
+
+    def __init__(self, looker, workers=1, async_looker=None,
+                 usage_store=None, window_days=7, query_tasks=False,
+                 journal=None, shard=None, query_task_timeout=TIMEOUT):
+        super(Analyze,self).__init__(looker, workers=workers,
+                                async_looker=async_looker,
+                                usage_store=usage_store,
+                                window_days=window_days,
+                                query_tasks=query_tasks,
+                                journal=journal, shard=shard,
+                                query_task_timeout=query_task_timeout)
         self.analyze_logger = logging.getLogger('analyze')
 
     def analyze(self, **kwargs):
@@ -17,6 +33,12 @@ class Analyze(fetcher):
         p = kwargs['project'] if 'project' in kwargs.keys() else None
         m = kwargs['model'] if 'model' in kwargs.keys() else None
         self.analyze_logger.info('Analyzing %s', kwargs['which'].capitalize())
+        if self.shard is not None:
+            self.analyze_logger.info('Analyzing shard %s/%s', *self.shard)
+            return self._shard_rows(kwargs['which'], project=p, model=m,
+                                    explore=kwargs.get('explore'),
+                                    timeframe=kwargs['timeframe'],
+                                    min_queries=kwargs['min_queries'])
         if kwargs['which'] == 'projects':
             params = {k: kwargs[k] for k in {'project', 'sortkey', 'limit'}}
             self.analyze_logger.info('analyze projects params=%s', params)
@@ -50,7 +72,8 @@ class Analyze(fetcher):
                                             sortkey=kwargs['sortkey'],
                                             limit=kwargs['limit'],
                                             timeframe=kwargs['timeframe'],
-                                            min_queries=kwargs['min_queries'])
+                                            min_queries=kwargs['min_queries'],
+                                            stream=kwargs.get('stream'))
         elif kwargs['which'] == 'fields':
             params = {k: kwargs[k] for k in {'model',
                                              'explore',
@@ -64,18 +87,27 @@ class Analyze(fetcher):
                                             sortkey=kwargs['sortkey'],
                                             limit=kwargs['limit'],
                                             timeframe=kwargs['timeframe'],
-                                            min_queries=kwargs['min_queries'])
+                                            min_queries=kwargs['min_queries'],
+                                            stream=kwargs.get('stream'))
+        # rows are written by the caller as they are produced unless they
+        # are tabulated
+        if kwargs.get('stream') or kwargs.get('format', 'table') != 'table':
+            return result
         self.analyze_logger.info('Analyze Complete')
 
-        result = tabulate(result, headers=headers,
-                          tablefmt=format, numalign='center')
+        with phase(self.looker, 'render table'):
+            result = tabulate(result, headers=headers,
+                              tablefmt=format, numalign='center')
 
         return result
 
+    @timed('analyze projects')
     def _analyze_projects(self, project=None, sortkey=None, limit=None):
         projects = fetcher.get_project_files(self, project=project)
+        all_git_tests = fetcher.test_git_connections(
+                            self, [p['name'] for p in projects])
         info = []
-        for p in projects:
+        for p, git_tests in zip(projects, all_git_tests):
             metadata = list(map(lambda x:
                                 'model' if x['type'] == 'model' else
                                 ('view' if x['type'] == 'view' else None),
@@ -83,7 +115,6 @@ class Analyze(fetcher):
 
             model_count = metadata.count('model')
             view_count = metadata.count('view')
-            git_tests = fetcher.test_git_connection(self, p['name'])
             info.append({
                 'project': p['name'],
                 'model_count': model_count,
@@ -94,35 +125,59 @@ class Analyze(fetcher):
             })
 
         valid_values = list(info[0].keys())
-        info = styler.sort(info, valid_values, sortkey)
-        info = styler.limit(info, limit=limit)
+        info = styler.top(info, valid_values, sortkey, limit)
 
         return info
 
+    # the rows of the models or explores in the shard of this run, unsorted
+    # and unlimited, as (position in an unsharded run, row). `henry merge`
+    # puts them back in order with the rows of the other shards and sorts,
+    # limits and tabulates them
+    def _shard_rows(self, which, project=None, model=None, explore=None,
+                    timeframe=90, min_queries=0):
+        if which == 'models':
+            rows = self._model_info(project=project, model=model,
+                                    timeframe=timeframe,
+                                    min_queries=min_queries)
+            return fetcher.index_model_rows(self, rows, project=project,
+                                            model=model)
+        fn = self._explore_info if which == 'explores' \
+            else self._explore_field_info
+        return fetcher.iter_shard_rows(self, fn, model=model,
+                                       explore=explore,
+                                       timeframe=timeframe,
+                                       min_queries=min_queries)
+
     def _analyze_models(self, project=None, model=None,
                         sortkey=None, limit=None,
                         timeframe=90, min_queries=0):
+        info = self._model_info(project=project, model=model,
+                                timeframe=timeframe, min_queries=min_queries)
+        valid_values = list(info[0].keys())
+        info = styler.top(info, valid_values, sortkey, limit)
+        return info
+
+    @timed('analyze models')
+    def _model_info(self, project=None, model=None, timeframe=90,
+                    min_queries=0):
         print('fetching all models...')
         models = fetcher.get_models(self, project=project,
                                     model=model, verbose=1)
+        models = [m for m in models if self.in_shard(m['name'])]
         print('complete.')
         print('fetching used models...')
-        used_models = fetcher.get_used_models(self, timeframe, min_queries)
+        # explore names come with the model listing, so a single usage
+        # query is enough to find the unused explores of every model
+        usage = fetcher.get_model_usage(self, models, model=model,
+                                        timeframe=timeframe,
+                                        min_queries=min_queries,
+                                        model_min_queries=min_queries)
         print('complete.')
         info = []
 
-        total = len(used_models)
-        complete = 1
         for m in models:
-            print('Processing {} of {} models'.format(complete,total))
             explore_count = len(m['explores'])
-            if m['name'] in used_models:
-                query_run_count = used_models[m['name']]
-            else:
-                query_run_count = 0
-            unused_explores = fetcher.get_unused_explores(self, m['name'],
-                                                          timeframe,
-                                                          min_queries)
+            query_run_count, unused_explores = usage[m['name']]
             info.append({
                 'project': m['project_name'],
                 'model': m['name'],
@@ -130,133 +185,244 @@ class Analyze(fetcher):
                 'unused_explores': len(unused_explores),
                 'query_run_count': query_run_count
             })
-            complete += 1
-        valid_values = list(info[0].keys())
-        info = styler.sort(info, valid_values, sortkey)
-        info = styler.limit(info, limit=limit)
         return info
 
+    # whether --order_by and --limit can be pushed down to the explore
+    # listing: rows are limited and either unsorted or sorted on one of
+    # rank_keys
+    def _pushdown(self, rank_keys, explore=None, sortkey=None, limit=None):
+        return explore is None and limit is not None and \
+            (sortkey is None or sortkey[0] in rank_keys)
+
+    def _rank(self, pair, usage):
+        m, e = pair
+        return {'model': m,
+                'explore': e,
+                'query_count': usage.explores.get(m, {}).get(e, 0)}
+
+    # rows of fn(explore, usage) for the top limit explores only. Explores
+    # are ranked on their listing and usage with a bounded heap, and only
+    # the bodies of the top ones are fetched. Since explores can go missing
+    # (bug #32748) more are ranked in if the top ones fall short
+    def _top_explores(self, fn, rank_keys, model=None, sortkey=None,
+                      limit=None, min_queries=0, timeframe=90):
+        usage = fetcher.get_usage_snapshot(self, model=model,
+                                           timeframe=timeframe,
+                                           min_queries=min_queries)
+        candidates = [(self._rank(p, usage), p)
+                      for p in fetcher.get_explores(self, model=model)]
+        if sortkey is not None:
+            sk, reverse = styler.sort_order(list(rank_keys), sortkey)
+        self.analyze_logger.info('Analyzing the top %s of %s explores',
+                                 limit[0], len(candidates))
+        n = limit[0]
+        found = 0
+        ranked = []
+        while found < limit[0] and len(ranked) < len(candidates):
+            if sortkey is None:
+                top = candidates[:n]
+            else:
+                top = styler.nsorted(candidates, n,
+                                     key=lambda c: c[0][sk],
+                                     reverse=reverse)
+            # the top n + m start with the top n, so only new ones are
+            # fetched
+            pairs = [p for _, p in top[len(ranked):]]
+            ranked = top
+            for e in fetcher.iter_explores(self, pairs=pairs):
+                yield fn(e, usage)
+                found += 1
+                if found == limit[0]:
+                    return
+            n *= 2
+
+    # streams rows of fn(explore, usage) as explores arrive (or from the
+    # journal of an interrupted run), sorted and limited by styler.stream,
+    # or by _top_explores if that can be pushed down
+    def _stream_explores(self, fn, rank_keys, model=None, explore=None,
+                         sortkey=None, limit=None, min_queries=0,
+                         timeframe=90):
+        if self._pushdown(rank_keys, explore, sortkey, limit):
+            rows = self._top_explores(fn, rank_keys, model=model,
+                                      sortkey=sortkey, limit=limit,
+                                      min_queries=min_queries,
+                                      timeframe=timeframe)
+        else:
+            rows = fetcher.iter_explore_rows(self, fn, model=model,
+                                             explore=explore,
+                                             timeframe=timeframe,
+                                             min_queries=min_queries)
+            rows = styler.stream(rows, sortkey, limit)
+        empty = True
+        for row in rows:
+            empty = False
+            yield row
+        if empty:
+            self.analyze_logger.error('No matching explores found')
+            raise Exception('No matching explores found')
+
     def _analyze_fields(self, model=None, explore=None,
                         sortkey=None, limit=None,
-                        min_queries=0, timeframe=90):
+                        min_queries=0, timeframe=90, stream=False):
+        # a run with a journal goes explore by explore too, so that every row
+        # is checkpointed as soon as it is done
+        pushdown = self._pushdown(self.FIELD_RANK_KEYS, explore, sortkey,
+                                  limit)
+        if stream or pushdown or self.journal is not None:
+            rows = self._stream_explores(self._explore_field_info,
+                                         self.FIELD_RANK_KEYS,
+                                         model=model, explore=explore,
+                                         sortkey=sortkey, limit=limit,
+                                         min_queries=min_queries,
+                                         timeframe=timeframe)
+            if stream:
+                return rows
+            if pushdown:
+                print('Analyzing the top {} explores...'.format(limit[0]))
+            else:
+                print('Analyzing explores...')
+            return list(rows)
 
         print('Retrieving explores for fields...')
         explores = fetcher.get_explores(self, model=model,
                                         explore=explore, verbose=1)
+        usage = fetcher.get_usage_snapshot(self, model=model,
+                                           timeframe=timeframe,
+                                           min_queries=min_queries)
         info = []
         progress = 1
         for e in explores:
-            print('Analyzing {}.{}, {} of {} explores'.format(e['model_name'],
-                                                              e['name'],
+            print('Analyzing {}.{}, {} of {} explores'.format(e.model_name,
+                                                              e.name,
                                                               progress,
                                                               len(explores)))
             if e is None:
                 pass
             else:
-                _used_fields = fetcher.get_used_explore_fields(self,
-                                                               e['model_name'],
-                                                               e['scopes'],
-                                                               timeframe,
-                                                               min_queries)
-                used_fields = list(_used_fields.keys())
-                exposed_fields = fetcher.get_explore_fields(self,
-                                                    explore=e,
-                                                    scoped_names=1)
-                unused_fields = set(exposed_fields) - set(used_fields)
-                field_count = len(exposed_fields)
-
-                missing_description = 0
-                dimensions = 0
-                measures = 0
-                for dim in e['fields']['dimensions']:
-                    dimensions += 1
-                    if not dim['description']:
-                        missing_description += 1
-                for measure in e['fields']['measures']:
-                    measures += 1
-                    if not measure['description']:
-                        missing_description += 1
-
-                info.append({
-                    'model': e['model_name'],
-                    'explore': e['name'],
-                    'field_count': field_count,
-                    'unused_fields': len(unused_fields),
-                    'missing_description': missing_description,
-                    'dimensions': dimensions,
-                    'measures': measures
-                })
+                info.append(self._explore_field_info(e, usage))
                 progress += 1
         if not info:
             self.analyze_logger.error('No matching explores found')
             raise Exception('No matching explores found')
         valid_values = list(info[0].keys())
-        info = styler.sort(info, valid_values, sortkey)
-        info = styler.limit(info, limit=limit)
+        info = styler.top(info, valid_values, sortkey, limit)
         return info
 
+    @timed('analyze explore fields')
+    def _explore_field_info(self, e, usage):
+        _used_fields = usage.used_explore_fields(e.model_name,
+                                                 e.scopes)
+        used_fields = list(_used_fields.keys())
+        exposed_fields = fetcher.get_explore_fields(self,
+                                                    explore=e,
+                                                    scoped_names=1)
+        unused_fields = set(exposed_fields) - set(used_fields)
+        field_count = len(exposed_fields)
+
+        missing_description = 0
+        dimensions = 0
+        measures = 0
+        for dim in e.dimensions:
+            dimensions += 1
+            if not dim.described:
+                missing_description += 1
+        for measure in e.measures:
+            measures += 1
+            if not measure.described:
+                missing_description += 1
+
+        return {
+            'model': e.model_name,
+            'explore': e.name,
+            'field_count': field_count,
+            'unused_fields': len(unused_fields),
+            'missing_description': missing_description,
+            'dimensions': dimensions,
+            'measures': measures
+        }
+
     def _analyze_explores(self, model=None, explore=None,
                           sortkey=None, limit=None,
-                          min_queries=0, timeframe=90):
+                          min_queries=0, timeframe=90, stream=False):
+        # a run with a journal goes explore by explore too, so that every row
+        # is checkpointed as soon as it is done
+        pushdown = self._pushdown(self.EXPLORE_RANK_KEYS, explore, sortkey,
+                                  limit)
+        if stream or pushdown or self.journal is not None:
+            rows = self._stream_explores(self._explore_info,
+                                         self.EXPLORE_RANK_KEYS,
+                                         model=model, explore=explore,
+                                         sortkey=sortkey, limit=limit,
+                                         min_queries=min_queries,
+                                         timeframe=timeframe)
+            if stream:
+                return rows
+            if pushdown:
+                print('Analyzing the top {} explores...'.format(limit[0]))
+            else:
+                print('Analyzing explores...')
+            return list(rows)
+
         print('fetching...')
         explores = fetcher.get_explores(self, model=model,
                                         explore=explore, verbose=1)
         print('fetching explores complete')
-        explores_usage = {}
+        usage = fetcher.get_usage_snapshot(self, model=model,
+                                           timeframe=timeframe,
+                                           min_queries=min_queries)
         info = []
         total = len(explores)
         completed = 1
         for e in explores:
-            print('Analyzing {}, {} of {} explores'.format(e['name'],
+            print('Analyzing {}, {} of {} explores'.format(e.name,
                                                         completed,
                                                         total))
             # in case explore does not exist (bug - #32748)
             if e is None:
                 pass
             else:
-                _used_fields = fetcher.get_used_explore_fields(self,
-                                                               e['model_name'],
-                                                               e['scopes'],
-                                                               timeframe,
-                                                               min_queries)
-                used_fields = list(_used_fields.keys())
-                exposed_fields = fetcher.get_explore_fields(self,
-                                                            explore=e,
-                                                            scoped_names=1)
-                unused_fields = set(exposed_fields) - set(used_fields)
-                field_count = len(exposed_fields)
-                query_count = fetcher.get_used_explores(self,
-                                                        model=e['model_name'],
-                                                        explore=e['name'])
-
-                all_joins = set(e['scopes'])
-                all_joins.remove(e['name'])
-                used_joins = set([i.split('.')[2] for i in used_fields])
-                unused_joins = len(list(all_joins - used_joins))
-
-                has_description = 'Yes' if e['description'] else 'No'
-
-                if query_count.get(e['name']):
-                    query_count = query_count[e['name']]
-                else:
-                    query_count = 0
-                info.append({
-                    'model': e['model_name'],
-                    'explore': e['name'],
-                    'is_hidden': e['hidden'],
-                    'has_description': has_description,
-                    'join_count': len(all_joins),
-                    'unused_joins': unused_joins,
-                    'field_count': field_count,
-                    'unused_fields': len(unused_fields),
-                    'query_count': query_count
-                })
+                info.append(self._explore_info(e, usage))
                 completed += 1
 
         if not info:
             self.analyze_logger.error('No matching explores found')
             raise Exception('No matching explores found')
         valid_values = list(info[0].keys())
-        info = styler.sort(info, valid_values, sortkey)
-        info = styler.limit(info, limit=limit)
+        info = styler.top(info, valid_values, sortkey, limit)
         return info
+
+    @timed('analyze explore')
+    def _explore_info(self, e, usage):
+        _used_fields = usage.used_explore_fields(e.model_name,
+                                                 e.scopes)
+        used_fields = list(_used_fields.keys())
+        exposed_fields = fetcher.get_explore_fields(self,
+                                                    explore=e,
+                                                    scoped_names=1)
+        unused_fields = set(exposed_fields) - set(used_fields)
+        field_count = len(exposed_fields)
+        query_count = usage.used_explores(e.model_name,
+                                          explore=e.name)
+
+        all_joins = set(e.scopes)
+        all_joins.remove(e.name)
+        used_joins = set([i.split('.')[2] for i in used_fields])
+        unused_joins = len(list(all_joins - used_joins))
+
+        has_description = 'Yes' if e.has_description else 'No'
+
+        if query_count.get(e.name):
+            query_count = query_count[e.name]
+        else:
+            query_count = 0
+        return {
+            'model': e.model_name,
+            'explore': e.name,
+            'is_hidden': e.hidden,
+            'has_description': has_description,
+            'join_count': len(all_joins),
+            'unused_joins': unused_joins,
+            'field_count': field_count,
+            'unused_fields': len(unused_fields),
+            'query_count': query_count
+        }
@@ -0,0 +1,37 @@
+#!/usr/local/bin/python3
+import logging
+from henry.commands.vacuum import unused_view_fields
+from henry.modules import styler
+from henry.modules.shards import read_shards
+
+
+# combines the shard files written by analyze and vacuum runs with --shard
+# into the result of the same command run unsharded. It works on the files
+# only, so no connection to Looker is needed
+class Merge(object):
+    def __init__(self, paths, partial=False):
+        self.merge_logger = logging.getLogger('merge')
+        self.header, self.rows = read_shards(paths, partial=partial)
+        self.command = self.header['command']
+
+    def merge(self, **kwargs):
+        format = 'plain' if kwargs['plain'] else 'psql'
+        headers = '' if kwargs['plain'] else 'keys'
+        # --order_by and --limit of the shard runs, unless given again
+        sortkey = kwargs['sortkey'] or self.header.get('sortkey')
+        limit = kwargs['limit'] or self.header.get('limit')
+        self.merge_logger.info('Merging %s, sortkey=%s, limit=%s',
+                               self.command, sortkey, limit)
+        rows = self.rows
+        if self.command == 'vacuum fields':
+            # the union of the fields used and exposed across explores
+            rows = unused_view_fields(rows)
+        rows = styler.stream(rows, sortkey, limit)
+        if kwargs.get('format', 'table') != 'table':
+            return rows
+        info = list(rows)
+        if not info:
+            self.merge_logger.error('No rows to merge')
+            raise Exception('No rows to merge')
+        return styler.tabulate(info, headers=headers, tablefmt=format,
+                               numalign='center')
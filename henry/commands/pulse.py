@@ -2,19 +2,34 @@
 import logging
 import re
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from textwrap import fill
 from tqdm import tqdm
 from tabulate import tabulate
 from tqdm import trange
 from henry.modules.color import color
+from henry.modules.profiler import timed
+from henry.modules.query_splitter import QuerySplitter
+from henry.modules.query_tasks import QueryTaskRunner, TIMEOUT
 
 
 class Pulse(object):
 
     postfix_default = [dict(value="RUNNING")]
 
-    def __init__(self, looker):
+    def __init__(self, looker, async_looker=None, workers=1, window_days=7,
+                 query_tasks=False, test_timeout=None,
+                 query_task_timeout=TIMEOUT):
         self.looker = looker
+        self.async_looker = async_looker
+        self.workers = max(1, workers or 1)
+        # seconds after which a connection test is reported as failed
+        self.test_timeout = test_timeout
+        runner = QueryTaskRunner(looker, workers=self.workers,
+                                 timeout=query_task_timeout) \
+            if query_tasks else None
+        self.splitter = QuerySplitter(looker, workers=workers,
+                                      window_days=window_days, runner=runner)
         self.pulse_logger = logging.getLogger('pulse')
         self.bar = '%s%s{postfix[0][value]}%s {desc}: ' \
                    '{percentage:3.0f}%% |{bar}|[{elapsed}<' \
@@ -23,25 +38,56 @@ class Pulse(object):
                                      color.ENDC)
         self.postfix_default = [dict(value="RUNNING")]
 
+    # the five checks are independent. With more than one worker, or with
+    # the async client, they run side by side, each with its own progress
+    # bar, and their reports are printed in order as soon as they and the
+    # checks before them are done. Only the connection check uses the async
+    # client, so its event loop is never shared between checks
     def run_all(self):
         self.pulse_logger.info('Checking instance pulse')
+        checks = [self._report_connections, self._report_query_stats,
+                  self._report_scheduled_plans,
+                  self._report_legacy_features, self._report_version]
+        if self.workers == 1 and self.async_looker is None:
+            for position, check in enumerate(checks):
+                print(self._run_check(check, position))
+        else:
+            with ThreadPoolExecutor(max_workers=len(checks)) as executor:
+                reports = [executor.submit(self._run_check, check, position)
+                           for position, check in enumerate(checks)]
+                for report in reports:
+                    print(report.result())
+        self.pulse_logger.info('Complete: Checking instance pulse')
+
+        return
+
+    # runs one check, turning a failure into its report so that the
+    # reports of the other checks are still printed
+    def _run_check(self, check, position):
+        try:
+            return check(position)
+        except Exception as e:
+            self.pulse_logger.exception('Check failed: %s', check.__name__)
+            return 'Error: %s failed: %s' % (
+                       check.__name__[len('_report_'):].replace('_', ' '), e)
+
+    def _report_connections(self, position=None):
         self.pulse_logger.info('Checking Connections')
-        result = self.check_connections()
-        print(result)
+        result = self.check_connections(position=position)
         self.pulse_logger.info('Complete: Checking Connections')
+        return result
 
+    def _report_query_stats(self, position=None):
         self.pulse_logger.info('Analyzing Query Stats')
-        r1, r2, r3 = self.check_query_stats()
-        print(r1)
-        print(r2)
-        print(r3)
+        result = '\n'.join(self.check_query_stats(position=position))
         self.pulse_logger.info('Complete: Analyzing Query Stats')
+        return result
 
-        # check scheduled plans
-        self.pulse_logger.info('Analyzing Query Stats')
+    def _report_scheduled_plans(self, position=None):
+        self.pulse_logger.info('Analyzing Scheduled Plans')
         with trange(1, desc='(3/5) Analyzing Scheduled Plans',
-                    bar_format=self.bar, postfix=self.postfix_default,
-                    ncols=100, miniters=0) as t:
+                    bar_format=self.bar, postfix=self._postfix(),
+                    ncols=100, miniters=0, position=position) as t:
             for i in t:
                 result = self.check_scheduled_plans()
                 fail_flag = 0
@@ -52,38 +98,58 @@ class Pulse(object):
                                       tablefmt='psql', numalign='center')
                 t.postfix[0]["value"] = 'DONE'
                 t.update()
-        print(result)
         if fail_flag == 1:
-            print('Navigate to /admin/scheduled_jobs on your instance for '
-                  'more details')
+            result += ('\nNavigate to /admin/scheduled_jobs on your '
+                       'instance for more details')
         self.pulse_logger.info('Complete: Analyzing Scheduled Plans')
+        return result
 
-        # check enabled legacy features
+    def _report_legacy_features(self, position=None):
         self.pulse_logger.info('Checking Legacy Features')
         with trange(1, desc='(4/5) Legacy Features', bar_format=self.bar,
-                    postfix=self.postfix_default, ncols=100, miniters=0) as t:
+                    postfix=self._postfix(), ncols=100, miniters=0,
+                    position=position) as t:
             for i in t:
                 result = self.check_legacy_features()
                 t.postfix[0]["value"] = 'DONE'
                 t.update()
-        print(result)
         self.pulse_logger.info('Complete: Checking Legacy Features')
+        return result
 
-        # check looker version
+    def _report_version(self, position=None):
         self.pulse_logger.info('Checking Version')
-        t = trange(1, desc='(5/5) Version', bar_format=self.bar,
-                   postfix=self.postfix_default, ncols=100)
-        for i in t:
-            result = self.check_version()
-            t.postfix[0]["value"] = "DONE"
-            t.update()
-        print(result)
+        with trange(1, desc='(5/5) Version', bar_format=self.bar,
+                    postfix=self._postfix(), ncols=100,
+                    position=position) as t:
+            for i in t:
+                result = self.check_version()
+                t.postfix[0]["value"] = "DONE"
+                t.update()
         self.pulse_logger.info('Complete: Checking Version')
-        self.pulse_logger.info('Complete: Checking instance pulse')
-
-        return
+        return result
 
-    def check_connections(self):
+    # every bar needs its own postfix as bars may be updated concurrently
+    def _postfix(self):
+        return [dict(value="RUNNING")]
+
+    # runs a single connection test, turning a timeout into a failed test
+    # so that one unresponsive database doesn't hold up the others
+    def _test_connection(self, connection, tests):
+        try:
+            return self.looker.test_connection(connection, {'tests': tests},
+                                               timeout=self.test_timeout)
+        except requests.exceptions.Timeout:
+            return self._timed_out(connection)
+
+    def _timed_out(self, connection):
+        self.pulse_logger.warning('Connection test for %s timed out',
+                                  connection)
+        return [{'status': 'error',
+                 'message': 'Connection test timed out after %ss'
+                            % self.test_timeout}]
+
+    @timed('check connections')
+    def check_connections(self, position=None):
         result = []
         connections = []
         for c in self.looker.get_connections():
@@ -93,32 +159,64 @@ class Pulse(object):
                 connections.append((c_name, c_tests))
 
         with tqdm(total=len(connections), desc='(1/5) Testing Connections',
-                  bar_format=self.bar, postfix=self.postfix_default,
-                  ncols=100, miniters=0) as t:
-            for idx, (c, tests) in enumerate(connections):
-                tests = {'tests': tests}
-                results = self.looker.test_connection(c, tests)
-                formatted_results = []
-                fail_flag = 0
-                for i in results:
-                    if i['status'] == 'error':
-                        formatted_results.append('-- ' + fill(i['message'],
-                                                              width=100))
-                        fail_flag = 1
-                formatted_results = list(set(formatted_results))
-                status = '\n'.join(formatted_results)
-                result.append({'Connection': c,
-                               'Status': 'OK' if fail_flag == 0 else status})
-                if idx == len(connections) - 1:
-                    t.postfix[0]['value'] = 'DONE'
-                t.update()
+                  bar_format=self.bar, postfix=self._postfix(),
+                  ncols=100, miniters=0, position=position) as t:
+            if self.async_looker is not None:
+                # all connection tests are in flight at once, bounded by the
+                # async client's concurrency limit
+                async def run_test(connection):
+                    c, tests = connection
+                    try:
+                        results = await self.async_looker.test_connection(
+                                      c, {'tests': tests},
+                                      timeout=self.test_timeout)
+                    except requests.exceptions.Timeout:
+                        results = self._timed_out(c)
+                    t.update()
+                    return results
+                all_results = self.async_looker.map(run_test, connections)
+            else:
+                # tests run on up to self.workers threads and the bar moves
+                # as each one finishes, whatever the order
+                def run_test(connection):
+                    results = self._test_connection(*connection)
+                    t.update()
+                    return results
+                if self.workers == 1:
+                    all_results = [run_test(c) for c in connections]
+                else:
+                    with ThreadPoolExecutor(
+                            max_workers=self.workers) as executor:
+                        all_results = list(executor.map(run_test,
+                                                        connections))
+            t.postfix[0]['value'] = 'DONE'
+            t.refresh()
+
+        for (c, tests), results in zip(connections, all_results):
+            formatted_results = []
+            fail_flag = 0
+            if results is None:
+                # the api client has already logged the error
+                formatted_results.append('-- Connection test failed')
+                fail_flag = 1
+            for i in results or []:
+                if i['status'] == 'error':
+                    formatted_results.append('-- ' + fill(i['message'],
+                                                          width=100))
+                    fail_flag = 1
+            formatted_results = list(set(formatted_results))
+            status = '\n'.join(formatted_results)
+            result.append({'Connection': c,
+                           'Status': 'OK' if fail_flag == 0 else status})
 
         return tabulate(result, headers="keys", tablefmt='psql')
 
-    def check_query_stats(self):
+    @timed('check query stats')
+    def check_query_stats(self, position=None):
         # check query stats
         with trange(3, desc='(2/5) Analyzing Query Stats', bar_format=self.bar,
-                    postfix=self.postfix_default, ncols=100, miniters=0) as t:
+                    postfix=self._postfix(), ncols=100, miniters=0,
+                    position=position) as t:
             for i in t:
                 if i == 0:
                     query_count = self.get_query_type_count()
@@ -168,8 +266,8 @@ class Pulse(object):
             "limit": "50000"
         }
 
-        r = self.looker.run_inline_query(result_format="json", body=body,
-                                         fields={"cache": "false"})
+        # split by date so that busy instances don't silently hit the limit
+        r = self.splitter.run_timeframe(body, 30, fields={"cache": "false"})
 
         if r:
             ids = (', ').join([str(query['query.id']) for query in r])
@@ -287,6 +385,7 @@ class Pulse(object):
 
         return response
 
+    @timed('check scheduled plans')
     def check_scheduled_plans(self):
         body = {
             "model": "i__looker",
@@ -314,6 +413,7 @@ class Pulse(object):
         else:
             return "No Plans Found"
 
+    @timed('check integrations')
     def check_integrations(self):
         response = self.looker.get_integrations()
         integrations = []
@@ -325,6 +425,7 @@ class Pulse(object):
 
         return result
 
+    @timed('check legacy features')
     def check_legacy_features(self):
         response = self.looker.get_legacy_features()
         _result = []
@@ -338,11 +439,13 @@ class Pulse(object):
             result = 'No legacy features found'
         return result
 
+    @timed('check version')
     def check_version(self):
         _v = self.looker.get_version()['looker_release_version']
         version = re.findall(r'(\d.\d+)', _v)[0]
         session = requests.Session()
-        _lv = session.get('https://learn.looker.com:19999/versions').json()
+        _lv = session.get('https://learn.looker.com:19999/versions',
+                          timeout=self.looker.timeout).json()
         _lv = _lv['looker_release_version']
         latest_version = re.findall(r'(\d.\d+)', _lv)[0]
         if version == latest_version:
@@ -2,13 +2,23 @@
 import logging
 from henry.modules import styler
 from henry.modules.fetcher import Fetcher as fetcher
+from henry.modules.profiler import phase, timed
+from henry.modules.query_tasks import TIMEOUT
 import re
 import sys
 
 
 class Vacuum(fetcher):
-    def __init__(self, looker):
-        super(Vacuum,self).__init__(looker)
+    def __init__(self, looker, workers=1, async_looker=None,
+                 usage_store=None, window_days=7, query_tasks=False,
+                 journal=None, shard=None, query_task_timeout=TIMEOUT):
+        super(Vacuum,self).__init__(looker, workers=workers,
+                                async_looker=async_looker,
+                                usage_store=usage_store,
+                                window_days=window_days,
+                                query_tasks=query_tasks,
+                                journal=journal, shard=shard,
+                                query_task_timeout=query_task_timeout)
         self.vacuum_logger = logging.getLogger('vacuum')
 
     def vacuum(self, **kwargs):
@@ -16,6 +26,12 @@ class Vacuum(fetcher):
         m = kwargs['model'] if 'model' in kwargs.keys() else None
         format = 'plain' if kwargs['plain'] else 'psql'
         headers = '' if kwargs['plain'] else 'keys'
+        if self.shard is not None:
+            self.vacuum_logger.info('Vacuuming shard %s/%s', *self.shard)
+            return self._shard_rows(kwargs['which'], project=p, model=m,
+                                    explore=kwargs.get('explore'),
+                                    timeframe=kwargs['timeframe'],
+                                    min_queries=kwargs['min_queries'])
         if kwargs['which'] == 'models':
             self.vacuum_logger.info('Vacuuming Models')
             params = {k: kwargs[k] for k in {'project',
@@ -37,7 +53,8 @@ class Vacuum(fetcher):
             result = self._vacuum_explores(model=m,
                                            explore=kwargs['explore'],
                                            min_queries=kwargs['min_queries'],
-                                           timeframe=kwargs['timeframe'])
+                                           timeframe=kwargs['timeframe'],
+                                           stream=kwargs.get('stream'))
         if kwargs['which'] == 'fields':
             self.vacuum_logger.info('Vacuuming Fields')
             params = {k: kwargs[k] for k in {'model',
@@ -49,170 +66,243 @@ class Vacuum(fetcher):
                                            explore=kwargs['explore'],
                                            min_queries=kwargs['min_queries'],
                                            timeframe=kwargs['timeframe'])
+        # rows are written by the caller as they are produced unless they
+        # are tabulated
+        if kwargs.get('stream') or kwargs.get('format', 'table') != 'table':
+            return result
         self.vacuum_logger.info('Vacuum Complete')
-        result = styler.tabulate(result, headers=headers,
-                                 tablefmt=format, numalign='center')
+        with phase(self.looker, 'render table'):
+            result = styler.tabulate(result, headers=headers,
+                                     tablefmt=format, numalign='center')
         return result
 
+    # the rows of the models or explores in the shard of this run, as
+    # (position in an unsharded run, row). For fields these are the fields
+    # used and exposed per explore, since a field is only unused if no
+    # explore of any shard uses it. `henry merge` combines them with the
+    # rows of the other shards
+    def _shard_rows(self, which, project=None, model=None, explore=None,
+                    timeframe=90, min_queries=0):
+        if which == 'models':
+            rows = self._vacuum_models(project=project, model=model,
+                                       timeframe=timeframe,
+                                       min_queries=min_queries)
+            return fetcher.index_model_rows(self, rows, project=project,
+                                            model=model)
+        fn = self._explore_info if which == 'explores' \
+            else self._explore_fields
+        return fetcher.iter_shard_rows(self, fn, model=model,
+                                       explore=explore,
+                                       timeframe=timeframe,
+                                       min_queries=min_queries)
+
+    @timed('vacuum models')
     def _vacuum_models(self, project=None, model=None, timeframe=90,
                        min_queries=0):
-        if model is None:
-            model = fetcher.get_models(self, project=project)
-        else:
-            model = model.split()
-        used_models = fetcher.get_used_models(self, timeframe)
+        models = fetcher.get_models(self, project=project, model=model,
+                                    verbose=1)
+        models = [m for m in models if self.in_shard(m['name'])]
+        # explore names come with the model listing, so a single usage
+        # query is enough to find the unused explores of every model
+        usage = fetcher.get_model_usage(self, models, model=model,
+                                        timeframe=timeframe,
+                                        min_queries=min_queries)
         info = []
-        for m in model:
-            explores = [e['name'] for e in fetcher.get_explores(self, model=m,
-                                                                verbose=1)]
-            unused_explores = fetcher.get_unused_explores(self, m,
-                                                          timeframe,
-                                                          min_queries)
-            query_run_count = used_models[m] if m in used_models.keys() else 0
+        for m in models:
+            query_run_count, unused_explores = usage[m['name']]
             unused_explores = ('\n').join(unused_explores)
             info.append({
-                        'model': m,
+                        'model': m['name'],
                         'unused_explores': unused_explores or 'None',
                         'model_query_run_count': query_run_count})
 
         return info
 
+    @timed('vacuum fields')
     def _vacuum_fields(self, model=None, explore=None, timeframe=90,
                         min_queries=0):
+        if self.journal is not None:
+            # checkpointed explore by explore
+            print('Analyzing explores...')
+            explores = fetcher.iter_explore_rows(self, self._explore_fields,
+                                                 model=model,
+                                                 explore=explore,
+                                                 timeframe=timeframe,
+                                                 min_queries=min_queries)
+        else:
+            explores = self._iter_explore_fields(model=model,
+                                                 explore=explore,
+                                                 timeframe=timeframe,
+                                                 min_queries=min_queries)
+        info = unused_view_fields(explores)
+        if not info:
+            self.vacuum_logger.error('No matching explores found')
+            raise Exception('No matching explores found')
+        return info
+
+    def _vacuum_explores(self, model=None, explore=None, timeframe=90,
+                         min_queries=0, stream=False):
+        # a run with a journal goes explore by explore too, so that every row
+        # is checkpointed as soon as it is done
+        if stream or self.journal is not None:
+            rows = self._stream_explores(model=model, explore=explore,
+                                         timeframe=timeframe,
+                                         min_queries=min_queries)
+            return rows if stream else list(rows)
         explores = fetcher.get_explores(self,
                                         model=model,
                                         explore=explore,
                                         verbose=1)
+        usage = fetcher.get_usage_snapshot(self, model=model,
+                                           timeframe=timeframe,
+                                           min_queries=min_queries)
         info = []
-        master_exposed_fields = set()
-        master_used_fields = set()
-        distinct_views = set()
-        progress = 1
         for e in explores:
-            print('Analyzing {}.{}, {} of {} explores'.format(e['model_name'],
-                                                                  e['name'],
-                                                                  progress,
-                                                                  len(explores)))
-            # get field usage from i__looker using all the views inside explore
-            # returns fields in the form of model.explore.view.field
-            _used_fields = fetcher.get_used_explore_fields(self,
-                                                           e['model_name'],
-                                                           e['scopes'],
-                                                           timeframe,
-                                                           min_queries)
-            used_fields = list(_used_fields.keys())
-
-            # get field picker fields in the form of model.explore.view.field
-            exposed_fields = fetcher.get_explore_fields(self,
-                                                        explore=e,
-                                                        scoped_names=1)
-            _unused_fields = set(exposed_fields) - set(used_fields)
-
-            # Get fields used in joins
-            for join in e['joins']:
-                if join['sql_on'] is not None:
-                    f = re.findall('\{(.*?)\}',join['sql_on'])
-                    for field in f:
-                        master_used_fields.add(field)
-                        distinct_views.add(field.split('.')[0])
-            #Get used fields
-            for field in used_fields:
-                field = '.'.join(field.split('.')[2:])
-                master_used_fields.add(field)
-                distinct_views.add(field.split('.')[0])
-            #Get all fields
-            for field in exposed_fields:
-                #strip out the model and explore
-                field = '.'.join(field.split('.')[2:])
-                master_exposed_fields.add(field)
-                distinct_views.add(field.split('.')[0])
-            progress += 1
-
-        # Fields to ignore if they contain the following:
-        ignore_list = ['week','quarter','year','month','raw','date','time']
-
-        # Get all unused fields and then organize them by their view
-        master_unused_fields = master_exposed_fields-master_used_fields
-        for view in sorted(list(distinct_views)):
-            if any(char.isdigit() for char in view):
-                continue
-            unused_fields = []
-            for field in master_unused_fields:
-                # always keep id fields and basic count fields
-                field_name = field.split('.')[1]
-                if field_name == 'id' or field_name == 'count' or 'id' in field_name.split('_'):
-                    continue
-                elif any(ignore in field for ignore in ignore_list):
-                    continue
-                if field.split('.')[0] == view:
-                    unused_fields.append(field)
-            unused_fields = ('\n').join(unused_fields)
-            if unused_fields is not None:
-                info.append({
-                            'view': view,
-                            'unused_fields': unused_fields
-                            })
+            info.append(self._explore_info(e, usage))
         if not info:
             self.vacuum_logger.error('No matching explores found')
             raise Exception('No matching explores found')
         return info
 
-    def _vacuum_explores(self, model=None, explore=None, timeframe=90,
+    # yields the rows of _vacuum_explores as explores arrive (or from the
+    # journal of an interrupted run)
+    def _stream_explores(self, model=None, explore=None, timeframe=90,
                          min_queries=0):
+        rows = fetcher.iter_explore_rows(self, self._explore_info,
+                                         model=model, explore=explore,
+                                         timeframe=timeframe,
+                                         min_queries=min_queries)
+        empty = True
+        for row in rows:
+            empty = False
+            yield row
+        if empty:
+            self.vacuum_logger.error('No matching explores found')
+            raise Exception('No matching explores found')
+
+    def _iter_explore_fields(self, model=None, explore=None, timeframe=90,
+                             min_queries=0):
         explores = fetcher.get_explores(self,
                                         model=model,
                                         explore=explore,
                                         verbose=1)
-        info = []
+        usage = fetcher.get_usage_snapshot(self, model=model,
+                                           timeframe=timeframe,
+                                           min_queries=min_queries)
+        progress = 1
         for e in explores:
-            # get field usage from i__looker using all the views inside explore
-            # returns fields in the form of model.explore.view.field
-            _used_fields = fetcher.get_used_explore_fields(self,
-                                                           e['model_name'],
-                                                           e['scopes'],
-                                                           timeframe,
-                                                           min_queries)
-            used_fields = list(_used_fields.keys())
-            # get field picker fields in the form of model.explore.view.field
-            exposed_fields = fetcher.get_explore_fields(self,
-                                                        explore=e,
-                                                        scoped_names=1)
-            _unused_fields = set(exposed_fields) - set(used_fields)
-
-            # remove scoping
-            all_joins = set(e['scopes'])
-            all_joins.remove(e['name'])
-            used_joins = set([i.split('.')[2] for i in used_fields])
-
-            _unused_joins = list(all_joins - used_joins)
-            unused_joins = ('\n').join(_unused_joins) or 'N/A'
-
-            # only keep fields that belong to used joins (unused joins fields
-            # don't matter) if there's at least one used join (including the
-            # base view). else don't match anything
-            temp = list(used_joins)
-            temp.append(e['name'])
-            pattern = ('|').join(temp) or 'ALL'
-            unused_fields = []
-            if pattern != 'ALL':
-                for field in _unused_fields:
-                    f = re.match(r'^({0}).*'.format(pattern),
-                                 '.'.join(field.split('.')[2:]))
-                    if f is not None:
-                        unused_fields.append(f.group(0))
-                unused_fields = sorted(unused_fields)
-                unused_fields = ('\n').join(unused_fields)
-            else:
-                unused_fields = styler.color.format(pattern,
-                                                    'fail',
-                                                    'color')
+            print('Analyzing {}.{}, {} of {} explores'.format(e.model_name,
+                                                              e.name,
+                                                              progress,
+                                                              len(explores)))
+            yield self._explore_fields(e, usage)
+            progress += 1
+
+    # the view.field names an explore uses (in queries or in its joins) and
+    # exposes, as lists so that they can be journaled
+    @timed('vacuum explore fields')
+    def _explore_fields(self, e, usage):
+        used = []
+        # get fields used in joins
+        for sql_on in e.join_sql_on:
+            used.extend(re.findall('\{(.*?)\}', sql_on))
+        # get field usage from the snapshot using all the views in explore
+        # returns fields in the form of model.explore.view.field
+        _used_fields = usage.used_explore_fields(e.model_name, e.scopes)
+        # strip out the model and explore
+        used.extend('.'.join(field.split('.')[2:]) for field in _used_fields)
+        # get field picker fields in the form of model.explore.view.field
+        exposed_fields = fetcher.get_explore_fields(self, explore=e,
+                                                    scoped_names=1)
+        exposed = ['.'.join(field.split('.')[2:]) for field in exposed_fields]
+        return {'used': used, 'exposed': exposed}
+
+    @timed('vacuum explore')
+    def _explore_info(self, e, usage):
+        # get field usage from the snapshot using all the views in explore
+        # returns fields in the form of model.explore.view.field
+        _used_fields = usage.used_explore_fields(e.model_name,
+                                                 e.scopes)
+        used_fields = list(_used_fields.keys())
+        # get field picker fields in the form of model.explore.view.field
+        exposed_fields = fetcher.get_explore_fields(self,
+                                                    explore=e,
+                                                    scoped_names=1)
+        _unused_fields = set(exposed_fields) - set(used_fields)
+
+        # remove scoping
+        all_joins = set(e.scopes)
+        all_joins.remove(e.name)
+        used_joins = set([i.split('.')[2] for i in used_fields])
+
+        _unused_joins = list(all_joins - used_joins)
+        unused_joins = ('\n').join(_unused_joins) or 'N/A'
+
+        # only keep fields that belong to used joins (unused joins fields
+        # don't matter) if there's at least one used join (including the
+        # base view). else don't match anything
+        temp = list(used_joins)
+        temp.append(e.name)
+        pattern = ('|').join(temp) or 'ALL'
+        unused_fields = []
+        if pattern != 'ALL':
+            for field in _unused_fields:
+                f = re.match(r'^({0}).*'.format(pattern),
+                             '.'.join(field.split('.')[2:]))
+                if f is not None:
+                    unused_fields.append(f.group(0))
+            unused_fields = sorted(unused_fields)
+            unused_fields = ('\n').join(unused_fields)
+        else:
+            unused_fields = styler.color.format(pattern,
+                                                'fail',
+                                                'color')
+        return {
+                'model': e.model_name,
+                'explore': e.name,
+                'unused_joins': unused_joins,
+                'unused_fields': unused_fields
+                }
+
+
+# the unused fields of every view, from the fields used and exposed by each
+# explore as returned by Vacuum._explore_fields. A field is unused if no
+# explore uses it, so every explore has to be in explores
+def unused_view_fields(explores):
+    info = []
+    master_exposed_fields = set()
+    master_used_fields = set()
+    distinct_views = set()
+    for fields in explores:
+        for field in fields['used']:
+            master_used_fields.add(field)
+            distinct_views.add(field.split('.')[0])
+        for field in fields['exposed']:
+            master_exposed_fields.add(field)
+            distinct_views.add(field.split('.')[0])
+
+    # Fields to ignore if they contain the following:
+    ignore_list = ['week','quarter','year','month','raw','date','time']
+
+    # Get all unused fields and then organize them by their view
+    master_unused_fields = master_exposed_fields-master_used_fields
+    for view in sorted(list(distinct_views)):
+        if any(char.isdigit() for char in view):
+            continue
+        unused_fields = []
+        for field in master_unused_fields:
+            # always keep id fields and basic count fields
+            field_name = field.split('.')[1]
+            if field_name == 'id' or field_name == 'count' or 'id' in field_name.split('_'):
+                continue
+            elif any(ignore in field for ignore in ignore_list):
+                continue
+            if field.split('.')[0] == view:
+                unused_fields.append(field)
+        unused_fields = ('\n').join(unused_fields)
+        if unused_fields is not None:
             info.append({
-                        'model': e['model_name'],
-                        'explore': e['name'],
-                        'unused_joins': unused_joins,
+                        'view': view,
                         'unused_fields': unused_fields
                         })
-        if not info:
-            self.vacuum_logger.error('No matching explores found')
-            raise Exception('No matching explores found')
-        return info
+    return info
@@ -0,0 +1,90 @@
+#!/usr/local/bin/python3
+# aggregator.py
+from array import array
+from collections import Counter
+from .usage import FIELD_COLUMNS, FIELD_PATTERN
+
+# parsed field lists are reused for rows with the same query columns, which
+# history repeats a lot. The cache is dropped once it reaches this size
+PARSE_CACHE_SIZE = 100000
+
+
+# counts the fields used in i__looker history rows as they are added, so
+# rows can be streamed in and discarded. Model, explore and field names are
+# interned to integer ids and counts are kept in an array indexed by a slot
+# per (model, explore, field), so memory grows with the number of distinct
+# fields rather than rows.
+class FieldAggregator(object):
+    def __init__(self):
+        self.ids = {}
+        self.names = []
+        # {(model id, explore id): {field id: slot}}
+        self.slots = {}
+        self.counts = array('q')
+        self.parsed = {}
+
+    def _id(self, name):
+        i = self.ids.get(name)
+        if i is None:
+            i = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return i
+
+    # field ids referenced by the query columns of a row, parsed with a
+    # single pass over all of them
+    def _fields(self, row):
+        text = '\n'.join([str(row[c]) for c in FIELD_COLUMNS])
+        fields = self.parsed.get(text)
+        if fields is None:
+            if len(self.parsed) >= PARSE_CACHE_SIZE:
+                self.parsed.clear()
+            fields = self.parsed[text] = [self._id(f) for f in
+                                          FIELD_PATTERN.findall(text)]
+        return fields
+
+    def _slots(self, model, explore):
+        key = (self._id(model), self._id(explore))
+        slots = self.slots.get(key)
+        if slots is None:
+            slots = self.slots[key] = {}
+        return slots
+
+    def _add(self, slots, field, count):
+        slot = slots.get(field)
+        if slot is None:
+            slot = slots[field] = len(self.counts)
+            self.counts.append(0)
+        self.counts[slot] += count
+
+    def add(self, row):
+        slots = self._slots(row['query.model'], row['query.view'])
+        run_count = int(row['history.query_run_count'])
+        for field in self._fields(row):
+            self._add(slots, field, run_count)
+
+    # adds up the counts of another FieldAggregator
+    def update(self, other):
+        for model, explore, field, count in other.items():
+            self._add(self._slots(model, explore), self._id(field), count)
+
+    # yields (model, explore, view.field, count)
+    def items(self):
+        names, counts = self.names, self.counts
+        for (model, explore), slots in self.slots.items():
+            for field, slot in slots.items():
+                yield names[model], names[explore], names[field], counts[slot]
+
+    # {model.explore.view.field: count}, as returned by
+    # Fetcher.get_used_explore_fields
+    def scoped(self):
+        return {'%s.%s.%s' % (m, e, f): count
+                for m, e, f, count in self.items()}
+
+    # {model: {explore: Counter}} where the counter is keyed on view.field,
+    # as used by UsageSnapshot
+    @property
+    def usage(self):
+        usage = {}
+        for m, e, f, count in self.items():
+            usage.setdefault(m, {}).setdefault(e, Counter())[f] = count
+        return usage
@@ -0,0 +1,401 @@
+# -*- coding: UTF-8 -*-
+import asyncio
+import functools
+import json
+import logging
+import queue
+import requests
+import threading
+import time
+from .profiler import endpoint
+from .ratelimit import retry_delay, parse_retry_after, retryable
+try:
+    import aiohttp
+except ImportError:  # optional dependency, see `pip install henry[async]`
+    aiohttp = None
+
+
+# asyncio counterpart of LookerApi. It exposes the same methods as coroutines
+# and returns (or raises) the same way their synchronous versions do. It does
+# not log in by itself: it reuses the token of an authenticated LookerApi.
+# A semaphore caps the number of requests in flight at any one time.
+class AsyncLookerApi(object):
+    def __init__(self, host, port, access_token, timeout, session_info,
+                 max_concurrency=10, max_retries=5):
+        if aiohttp is None:
+            raise ImportError('Async mode requires aiohttp. Install it with '
+                              '`pip install henry[async]`')
+        self.api_logger = logging.getLogger('lookerapi')
+        self.host = host
+        self.port = port
+        self.access_token = access_token
+        self.timeout = timeout
+        self.session_info = session_info
+        self.max_concurrency = max(1, max_concurrency or 1)
+        self.max_retries = max_retries
+        self.session = None
+        self.semaphore = None
+        # LookerApi the token comes from, which renews it once it expires
+        self.looker = None
+        # optional MetadataCache shared with the synchronous client
+        self.cache = None
+        # optional Profiler and Tracer shared with the synchronous client
+        self.profiler = None
+        self.tracer = None
+
+    @classmethod
+    def from_looker(cls, looker, max_concurrency=10):
+        api = cls(host=looker.host,
+                  port=looker.port,
+                  access_token=looker.get_access_token(),
+                  timeout=looker.timeout,
+                  session_info=looker.session.headers.get('User-Agent'),
+                  max_concurrency=max_concurrency,
+                  max_retries=looker.max_retries)
+        api.looker = looker
+        api.cache = looker.cache
+        api.profiler = looker.profiler
+        api.tracer = looker.tracer
+        return api
+
+    # sessions and semaphores are bound to the running event loop, so they
+    # are created on entry and torn down on exit
+    async def __aenter__(self):
+        if isinstance(self.timeout, tuple):
+            timeout = aiohttp.ClientTimeout(sock_connect=self.timeout[0],
+                                            sock_read=self.timeout[1])
+        else:
+            timeout = aiohttp.ClientTimeout(total=self.timeout)
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency,
+                                         ssl=False)
+        self.session = aiohttp.ClientSession(
+                           connector=connector,
+                           timeout=timeout,
+                           headers={'Authorization': 'token %s'
+                                    % self.access_token,
+                                    'User-Agent': self.session_info})
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, tb):
+        await self.session.close()
+        self.session = None
+        self.semaphore = None
+
+    # runs fn (which returns a coroutine) for every item on a fresh event
+    # loop and returns the results in the same order as items
+    def map(self, fn, items):
+        async def run():
+            async with self:
+                return await asyncio.gather(*[fn(i) for i in items])
+        return asyncio.run(run())
+
+    # like map, but yields the results in the same order as items while the
+    # rest are still running. The event loop runs on a background thread
+    # and hands results over through a queue. Calls still running when the
+    # generator is closed early (e.g. by --limit) are cancelled
+    def imap(self, fn, items):
+        items = list(items)
+        results = queue.Queue()
+        stopped = threading.Event()
+        running = {}
+
+        async def call(i, item):
+            try:
+                results.put((i, await fn(item), None))
+            except Exception as e:
+                results.put((i, None, e))
+
+        async def run():
+            async with self:
+                calls = asyncio.gather(*[call(i, item)
+                                         for i, item in enumerate(items)])
+                running['cancel'] = functools.partial(
+                    asyncio.get_running_loop().call_soon_threadsafe,
+                    calls.cancel)
+                if stopped.is_set():
+                    calls.cancel()
+                try:
+                    await calls
+                except asyncio.CancelledError:
+                    self.api_logger.info('Cancelled the remaining requests')
+
+        def loop():
+            try:
+                asyncio.run(run())
+            except Exception as e:
+                results.put((None, None, e))
+
+        thread = threading.Thread(target=loop, daemon=True)
+        thread.start()
+        # results that arrived ahead of the ones before them
+        pending = {}
+        try:
+            for i in range(len(items)):
+                while i not in pending:
+                    j, result, error = results.get()
+                    if j is None:
+                        raise error
+                    pending[j] = (result, error)
+                result, error = pending.pop(i)
+                if error is not None:
+                    raise error
+                yield result
+        finally:
+            stopped.set()
+            if 'cancel' in running:
+                running['cancel']()
+            thread.join()
+
+    # returns (status, json) so that callers can mirror LookerApi's error
+    # handling for the endpoint. Retries and token renewal follow the same
+    # policy as LookerApi. A timeout (in seconds) overrides the session's
+    # and raises requests.exceptions.Timeout as soon as it expires, without
+    # retrying
+    async def _request(self, method, path, params=None, body=None,
+                       timeout=None, retry=None):
+        if retry is None:
+            retry = method == 'GET'
+        url = 'https://{}:{}/api/3.0/{}'.format(self.host, self.port, path)
+        options = {}
+        if timeout:
+            options['timeout'] = aiohttp.ClientTimeout(total=timeout)
+        attempt = 0
+        renewed = False
+        while True:
+            status, retry_after, error = None, None, None
+            token = self.access_token
+            queued = time.time()
+            async with self.semaphore:
+                self.api_logger.info('Request to %s => %s /api/3.0/%s, %s',
+                                     self.host, method, path, params or {})
+                started = time.time()
+                try:
+                    async with self.session.request(method, url,
+                                                    params=params or None,
+                                                    data=body,
+                                                    **options) as r:
+                        content = await r.read()
+                        self._record(method, url, queued, started,
+                                     len(content), attempt, r.status)
+                        if r.status < 400:
+                            self.api_logger.info('Request Complete: %s',
+                                                 r.status)
+                            # as r.json() does, an empty body is None
+                            return r.status, (json.loads(content)
+                                              if content.strip() else None)
+                        status = r.status
+                        retry_after = r.headers.get('Retry-After')
+                except (aiohttp.ClientConnectionError,
+                        asyncio.TimeoutError) as e:
+                    self._record(method, url, queued, started, 0, attempt)
+                    if timeout and isinstance(e, asyncio.TimeoutError):
+                        raise requests.exceptions.Timeout(
+                            'Request to %s timed out after %ss'
+                            % (url, timeout))
+                    error = e
+
+            # a token that expired or was revoked is renewed once by the
+            # LookerApi it came from and the request sent again
+            if status == 401 and not renewed and self.looker is not None \
+                    and self.looker.secret:
+                self.api_logger.warning('Auth token rejected by %s', url)
+                await self._renew_token(token)
+                renewed = True
+                continue
+            if attempt >= self.max_retries or \
+                    not retryable(status, retry_after, idempotent=retry):
+                if error is not None:
+                    raise error
+                self.api_logger.warning('Request Complete: %s', status)
+                return status, None
+            delay = retry_delay(attempt, parse_retry_after(retry_after))
+            self.api_logger.warning('Request to %s failed (%s), retrying in '
+                                    '%.1fs (%s of %s)', url, error or status,
+                                    delay, attempt + 1, self.max_retries)
+            slept = time.time()
+            await asyncio.sleep(delay)
+            if self.tracer is not None:
+                self.tracer.wait('retry backoff', slept,
+                                 args={'url': url, 'attempt': attempt + 1},
+                                 overlap=True)
+            attempt += 1
+
+    # logs in on a worker thread so that other requests carry on meanwhile.
+    # The LookerApi only logs in again if no one else has renewed token yet
+    async def _renew_token(self, token):
+        await asyncio.get_running_loop().run_in_executor(
+            None, self.looker.renew_token, token)
+        self.access_token = self.looker.get_access_token()
+        self.session.headers['Authorization'] = 'token %s' \
+            % self.access_token
+
+    # requests share the thread of the event loop and overlap, so their
+    # spans are traced as async events. status is None for a failed
+    # connection
+    def _record(self, method, url, queued, started, nbytes, attempt,
+                status=None):
+        ended = time.time()
+        if self.profiler is not None:
+            self.profiler.request(method, url, ended - started, nbytes,
+                                  retry=attempt > 0,
+                                  error=status is None or status >= 400)
+        if self.tracer is not None:
+            name = endpoint(method, url)
+            self.tracer.wait('semaphore wait', queued, started,
+                             args={'endpoint': name}, overlap=True)
+            args = {'url': url.split('/api/3.0/', 1)[-1], 'status': status}
+            if attempt:
+                args['attempt'] = attempt
+            self.tracer.complete(name, started, ended, cat='api', args=args,
+                                 overlap=True)
+
+    # same exception type LookerApi raises so callers handle both alike
+    def _raise(self, status, path):
+        self.api_logger.error('Request Complete: %s', status)
+        raise requests.exceptions.HTTPError('%s Error for url: /api/3.0/%s'
+                                            % (status, path))
+
+# GET /lookml_models/
+    async def get_models(self, fields={}):
+        if self.cache is not None and not fields:
+            cached = self.cache.get('models')
+            if cached is not None:
+                if self.profiler is not None:
+                    self.profiler.cache_hit('GET', 'lookml_models')
+                return cached
+        status, r = await self._request('GET', 'lookml_models', fields)
+        if r is None:
+            self._raise(status, 'lookml_models')
+        if self.cache is not None and not fields:
+            self.cache.set(r, 'models')
+        return r
+
+# GET /lookml_models/{{NAME}}
+    async def get_model(self, model_name=None, fields={}):
+        path = 'lookml_models/{}'.format(model_name)
+        if self.cache is not None and not fields:
+            cached = self.cache.get('models', model_name)
+            if cached is not None:
+                if self.profiler is not None:
+                    self.profiler.cache_hit('GET', path)
+                return [cached]
+        status, r = await self._request('GET', path, fields)
+        if r is None:
+            self._raise(status, path)
+        if self.cache is not None and not fields:
+            self.cache.set(r, 'models', model_name)
+        return [r]
+
+# GET /lookml_models/{{NAME}}/explores/{{NAME}}
+    async def get_explore(self, model_name=None, explore_name=None,
+                          fields={}):
+        if self.cache is not None and not fields:
+            cached = self.cache.get('explores', model_name, explore_name)
+            if cached is not None:
+                if self.profiler is not None:
+                    self.profiler.cache_hit('GET',
+                                            'lookml_models/%s/explores/%s'
+                                            % (model_name, explore_name))
+                return [cached]
+        path = 'lookml_models/{}/explores/{}'.format(model_name, explore_name)
+        status, r = await self._request('GET', path, fields)
+        if r is None:
+            return []
+        if self.cache is not None and not fields:
+            self.cache.set(r, 'explores', model_name, explore_name)
+        return [r]
+
+# GET /projects
+    async def get_projects(self, fields={}):
+        status, r = await self._request('GET', 'projects', fields)
+        if r is None:
+            self._raise(status, 'projects')
+        return r
+
+# GET /projects/{project_id}
+    async def get_project(self, project_id=None, fields={}):
+        path = 'projects/{}'.format(project_id)
+        status, r = await self._request('GET', path, fields)
+        if r is None:
+            self._raise(status, path)
+        return [r]
+
+# GET /projects/{project_id}/files
+    async def get_project_files(self, project=None, fields={}):
+        path = 'projects/{}/files'.format(project)
+        status, r = await self._request('GET', path, fields)
+        if r is None:
+            print('Project not found: %s' % project)
+        return r
+
+# POST /queries/run/{result_format}
+    async def run_inline_query(self, result_format, body, fields={}):
+        self.api_logger.info('Query params=%s', body)
+        path = 'queries/run/{}'.format(result_format)
+        status, r = await self._request('POST', path, fields,
+                                        body=json.dumps(body), retry=True)
+        if r is None:
+            print('Error: %s response from %s' % (status, path))
+        return r
+
+# PATCH session
+    async def update_session(self, mode):
+        body = {'workspace_id': str(mode)}
+        status, r = await self._request('PATCH', 'session',
+                                        body=json.dumps(body), retry=True)
+        if r is None:
+            print('Error: %s response from session' % status)
+        return r
+
+# GET session
+    async def get_session(self, fields={}):
+        status, r = await self._request('GET', 'session')
+        if r is None:
+            print('Error: %s response from session' % status)
+        return r
+
+# GET /projects/{project_id}/git_connection_tests
+    async def git_connection_tests(self, project_id, fields={}):
+        path = 'projects/{}/git_connection_tests'.format(project_id)
+        status, r = await self._request('GET', path)
+        if r is None:
+            print('Error: %s response from %s' % (status, path))
+        return r
+
+# GET /projects/{project_id}/git_connection_tests/{test_id}
+    async def run_git_connection_test(self, project_id, test_id, fields={}):
+        path = 'projects/{}/git_connection_tests/{}'.format(project_id,
+                                                            test_id)
+        status, r = await self._request('GET', path)
+        if r is None:
+            print('Error: %s response from %s' % (status, path))
+        return r
+
+# GET /connections
+    async def get_connections(self, fields={}):
+        status, r = await self._request('GET', 'connections')
+        return r
+
+# PUT /connections/{connection_name}/test
+    async def test_connection(self, connection, fields={}, timeout=None):
+        path = 'connections/{}/test'.format(connection)
+        status, r = await self._request('PUT', path, fields, timeout=timeout)
+        return r
+
+# GET /legacy_features
+    async def get_legacy_features(self, fields={}):
+        status, r = await self._request('GET', 'legacy_features')
+        return r
+
+# GET /integrations
+    async def get_integrations(self, fields={}):
+        status, r = await self._request('GET', 'integrations')
+        return r
+
+# GET /versions
+    async def get_version(self, fields={}):
+        status, r = await self._request('GET', 'versions')
+        if r is None:
+            print('Error: %s response from versions' % status)
+        return r
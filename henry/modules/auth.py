@@ -11,16 +11,21 @@ auth_logger = logging.getLogger('auth')
 
 
 # returns an instanstiated Looker object using the
-# credentials supplied by the auth argument group
-def authenticate(timeout, session_info, config_path, **kwargs):
+# credentials supplied by the auth argument group. settings are the parsed
+# settings.json, which is read here if they are not passed in
+def authenticate(timeout, session_info, config_path, max_concurrency=1,
+                 max_retries=5, latency_target=None, settings=None,
+                 profiler=None, tracer=None, **kwargs):
 
-    settings_file = os.path.join(os.getcwd(),'settings.json')
-    with open(settings_file, 'r') as f:
-        settings = json.load(f)
+    if settings is None:
+        settings_file = os.path.join(os.getcwd(),'settings.json')
+        with open(settings_file, 'r') as f:
+            settings = json.load(f)
         timeout = settings.get('api_conn_timeout', timeout)
-        host = settings.get('host')
-        client_id = settings.get('client_id')
-        client_secret = settings.get('client_secret')
+    host = settings.get('host')
+    client_id = settings.get('client_id')
+    client_secret = settings.get('client_secret')
+    token_expires = None
     auth_logger.info('Authenticating into Looker API')
     # precedence: --path, global config, default
     cleanpath = kwargs['path'] or config_path
@@ -56,6 +61,8 @@ def authenticate(timeout, session_info, config_path, **kwargs):
             #  last auth token. Works if --persist was previously used,
             # otherwise it fails)
             token = params['hosts'][kwargs['host']]['access_token']
+            token_expires = params['hosts'][kwargs['host']].get(
+                                'token_expires')
         except KeyError as error:
             auth_logger.error('Auth Error: %s not found' % error,
                               exc_info=False)
@@ -73,6 +80,12 @@ def authenticate(timeout, session_info, config_path, **kwargs):
                        access_token=token,
                        timeout=timeout,
                        session_info=session_info,
+                       max_concurrency=max_concurrency,
+                       max_retries=max_retries,
+                       latency_target=latency_target,
+                       token_expires=token_expires,
+                       profiler=profiler,
+                       tracer=tracer,
                        )
     auth_logger.info('Authentication Successful')
 
@@ -98,6 +111,9 @@ def authenticate(timeout, session_info, config_path, **kwargs):
             params = yaml.safe_load(f)
             access_token = looker.get_access_token()
             params['hosts'][kwargs['host']]['access_token'] = access_token
+            # lets the next run use the token without checking it first
+            params['hosts'][kwargs['host']]['token_expires'] = \
+                looker.token_expires
 
         with open(cleanpath, 'w') as f:
             yaml.safe_dump(params, f, default_flow_style=False)
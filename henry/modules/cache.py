@@ -0,0 +1,106 @@
+#!/usr/local/bin/python3
+# cache.py
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from urllib.parse import quote
+
+
+# on-disk cache for LookML metadata (model listings and explore bodies) kept
+# under ~/.henry/cache/<host>/. Entries expire after ttl seconds and the
+# least recently used ones are evicted once the cache grows beyond max_size
+# bytes. The whole cache is dropped when the projects' git revisions change.
+class MetadataCache(object):
+    def __init__(self, host, ttl=86400, max_size=512 * 1024 * 1024,
+                 refresh=False, path=None):
+        self.cache_logger = logging.getLogger('cache')
+        self.path = path or os.path.join(os.path.expanduser('~'), '.henry',
+                                         'cache', quote(host, safe=''))
+        self.ttl = ttl
+        self.max_size = max_size
+        # when refreshing, entries are rewritten but never read
+        self.refresh = refresh
+        self.lock = threading.Lock()
+        os.makedirs(self.path, exist_ok=True)
+        self.size = sum(os.path.getsize(f) for f in self._files())
+
+    def _files(self):
+        for root, dirs, files in os.walk(self.path):
+            for f in files:
+                if f.endswith('.json'):
+                    yield os.path.join(root, f)
+
+    def _file(self, key):
+        parts = [quote(str(k), safe='') for k in key]
+        return os.path.join(self.path, *parts) + '.json'
+
+    def get(self, *key):
+        if self.refresh:
+            return None
+        path = self._file(key)
+        try:
+            with open(path, 'r') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            self.cache_logger.info('Cache miss: %s', '/'.join(key))
+            return None
+        age = time.time() - entry['cached_at']
+        if self.ttl is not None and age > self.ttl:
+            self.cache_logger.info('Cache expired: %s', '/'.join(key))
+            return None
+        # the file's mtime tracks recency of use for LRU eviction
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self.cache_logger.info('Cache hit: %s', '/'.join(key))
+        return entry['value']
+
+    def set(self, value, *key):
+        path = self._file(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = '%s.%s.tmp' % (path, threading.get_ident())
+        with open(tmp, 'w') as f:
+            json.dump({'cached_at': time.time(), 'value': value}, f)
+        with self.lock:
+            old_size = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(tmp, path)
+            self.size += os.path.getsize(path) - old_size
+            if self.size > self.max_size:
+                self._evict()
+
+    def _evict(self):
+        files = sorted(self._files(), key=os.path.getmtime)
+        self.cache_logger.info('Cache is %s bytes, evicting least recently '
+                               'used entries', self.size)
+        for f in files:
+            if self.size <= self.max_size:
+                break
+            self.size -= os.path.getsize(f)
+            os.remove(f)
+
+    def clear(self):
+        with self.lock:
+            for f in list(self._files()):
+                os.remove(f)
+            self.size = 0
+
+    # drops every entry if the LookML revisions differ from the ones the
+    # cache was populated with. revisions is a {project: git ref} dict
+    def validate(self, revisions):
+        fingerprint = hashlib.sha1(json.dumps(revisions, sort_keys=True)
+                                   .encode('utf-8')).hexdigest()
+        path = os.path.join(self.path, 'revision')
+        try:
+            with open(path, 'r') as f:
+                current = f.read().strip()
+        except OSError:
+            current = None
+        if current != fingerprint:
+            self.cache_logger.info('LookML revision changed, clearing cache')
+            self.clear()
+            with open(path, 'w') as f:
+                f.write(fingerprint)
@@ -0,0 +1,98 @@
+#!/usr/local/bin/python3
+# cpuprofile.py
+import cProfile
+import collections
+import os
+import pstats
+import sys
+import threading
+
+# seconds between two samples of StackSampler
+SAMPLE_INTERVAL = 0.005
+
+# since Python 3.12 cProfile profiles every thread of the process and only
+# one profiler can be enabled at a time
+PROCESS_WIDE = sys.version_info >= (3, 12)
+
+
+# profiles every call of a run with cProfile. Most of the work happens in
+# worker threads, so threads started while it runs get a profiler of their
+# own and the stats of all of them are merged into one pstats file, which
+# can be read with `python -m pstats FILE`, snakeviz etc. Where cProfile is
+# process wide a single profiler covers every thread instead
+class CallProfiler(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.profiles = []
+
+    # called by the first event of every new thread, after which the
+    # thread's own profiler takes over
+    def _thread_started(self, frame, event, arg):
+        self._enable()
+
+    def _enable(self):
+        profile = cProfile.Profile()
+        with self.lock:
+            self.profiles.append(profile)
+        profile.enable()
+
+    def start(self):
+        if not PROCESS_WIDE:
+            threading.setprofile(self._thread_started)
+        self._enable()
+
+    def stop(self):
+        if not PROCESS_WIDE:
+            threading.setprofile(None)
+        self.profiles[0].disable()
+
+    def write(self, path):
+        with self.lock:
+            profiles = [p for p in self.profiles if p.getstats()]
+        if profiles:
+            pstats.Stats(*profiles).dump_stats(path)
+
+
+# samples the stack of every thread at a fixed interval instead of tracing
+# each call, which keeps the overhead low enough for production sized runs.
+# Sampling is by wall clock time, so threads waiting on the API show up as
+# well. Samples are written as collapsed stacks, a 'thread;frame;...;frame
+# count' line per distinct stack, as read by flamegraph.pl, speedscope etc.
+class StackSampler(object):
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def _sample(self):
+        me = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append('%s (%s:%s)'
+                                 % (code.co_name,
+                                    os.path.basename(code.co_filename),
+                                    code.co_firstlineno))
+                    frame = frame.f_back
+                stack.append(names.get(ident, 'thread'))
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self.thread = threading.Thread(target=self._sample,
+                                       name='stack-sampler', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write('%s %s\n' % (stack, count))
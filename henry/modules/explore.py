@@ -0,0 +1,65 @@
+#!/usr/local/bin/python3
+# explore.py
+import sys
+
+
+# a dimension, measure or filter of an explore. Only the name and whether
+# the field is described are kept
+class Field(object):
+    __slots__ = ('name', 'described')
+
+    def __init__(self, name, described):
+        self.name = name
+        self.described = described
+
+
+# the parts of an explore body that analyze and vacuum use. Explore bodies
+# carry the sql, labels, descriptions etc. of every field, so each body is
+# turned into an Explore as it arrives and discarded, which keeps memory
+# flat as the number of explores grows. Names are interned since views and
+# their fields are shared by many explores
+class Explore(object):
+    __slots__ = ('name', 'model_name', 'has_description', 'hidden', 'scopes',
+                 'join_sql_on', 'dimensions', 'measures', 'filters')
+
+    def __init__(self, name, model_name, has_description=False, hidden=False,
+                 scopes=(), join_sql_on=(), dimensions=(), measures=(),
+                 filters=()):
+        self.name = name
+        self.model_name = model_name
+        self.has_description = has_description
+        self.hidden = hidden
+        # view names, the base view included
+        self.scopes = scopes
+        # sql_on of joins that have one
+        self.join_sql_on = join_sql_on
+        self.dimensions = dimensions
+        self.measures = measures
+        self.filters = filters
+
+    @classmethod
+    def from_json(cls, body):
+        fields = body.get('fields') or {}
+        return cls(name=sys.intern(body['name']),
+                   model_name=sys.intern(body['model_name']),
+                   has_description=bool(body.get('description')),
+                   hidden=bool(body.get('hidden')),
+                   scopes=tuple(sys.intern(s)
+                                for s in body.get('scopes') or ()),
+                   join_sql_on=tuple(j['sql_on']
+                                     for j in body.get('joins') or ()
+                                     if j.get('sql_on') is not None),
+                   dimensions=_fields(fields.get('dimensions')),
+                   measures=_fields(fields.get('measures')),
+                   filters=_fields(fields.get('filters')))
+
+
+def _fields(fields):
+    return tuple(Field(sys.intern(f['name']), bool(f.get('description')))
+                 for f in fields or ())
+
+
+# turns the bodies returned by LookerApi.get_explore ([] for a missing
+# explore, else [body]) into Explores
+def compact(bodies):
+    return [Explore.from_json(b) for b in bodies]
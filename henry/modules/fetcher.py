@@ -1,20 +1,73 @@
 #!/usr/local/bin/python3
 from . import styler
-from collections import Counter
+from .query_splitter import QuerySplitter
+from .query_tasks import QueryTaskRunner, TIMEOUT
+from .aggregator import FieldAggregator
+from .explore import compact
+from .profiler import phase, timed
+from .shards import in_shard
+from .usage import UsageSnapshot
+from concurrent.futures import Future, ThreadPoolExecutor
 import logging
-import re
-import sys
-reload(sys)
-
-sys.setdefaultencoding('utf-8')
-
 
 
 class Fetcher(object):
-    def __init__(self, looker):
+    def __init__(self, looker, workers=1, async_looker=None,
+                 usage_store=None, window_days=7, query_tasks=False,
+                 journal=None, shard=None, query_task_timeout=TIMEOUT):
         self.looker = looker
+        self.async_looker = async_looker
+        self.usage_store = usage_store
+        # optional Journal checkpointing the rows made per explore
+        self.journal = journal
+        # (i, N) to only go through the i-th of N shards of the models or
+        # explores, see shards.py
+        self.shard = shard
+        self.workers = max(1, workers or 1)
+        runner = QueryTaskRunner(looker, workers=self.workers,
+                                 timeout=query_task_timeout) \
+            if query_tasks else None
+        self.splitter = QuerySplitter(looker, workers=self.workers,
+                                      window_days=window_days, runner=runner)
         self.fetch_logger = logging.getLogger('fetcher')
 
+    # returns the local usage store, synced to cover timeframe, or None if
+    # usage should be queried from i__looker directly
+    def _synced_usage_store(self, timeframe):
+        if self.usage_store is not None:
+            with phase(self.looker, 'sync usage store'):
+                self.usage_store.sync(self.splitter, timeframe)
+        return self.usage_store
+
+    # runs an i__looker history query split into date windows so that large
+    # timeframes are neither truncated by the row limit nor run serially
+    def _run_history_query(self, body, timeframe, min_queries=0):
+        return self._history_rows(self.splitter.run_timeframe(
+                   body, timeframe,
+                   measures=['history.query_run_count'],
+                   having={'history.query_run_count': min_queries}))
+
+    # the splitter returns None for a history query that failed, after the
+    # api client has reported the error. Usage missing that history would
+    # show used content as unused, so the run stops instead
+    def _history_rows(self, rows):
+        if rows is None:
+            self.fetch_logger.error('History query failed')
+            raise Exception('Failed to fetch usage from i__looker')
+        return rows
+
+    # applies fn to every item using up to self.workers threads. Results are
+    # returned in the same order as items regardless of completion order
+    def _map(self, fn, items):
+        items = list(items)
+        if self.workers == 1 or len(items) < 2:
+            return [fn(i) for i in items]
+        self.fetch_logger.info('Fanning out %s calls over %s workers',
+                               len(items), self.workers)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return list(executor.map(fn, items))
+
+    @timed('fetch project files')
     def get_project_files(self, project=None):
         self.fetch_logger.info('Fetching projects, %s', locals())
         if project is None:
@@ -24,10 +77,18 @@ class Fetcher(object):
             self.fetch_logger.info('Fetching project files for %s', project)
             projects = self.looker.get_project(project)
 
-        project_data = []
-        for p in projects:
-            project_files = self.looker.get_project_files(project=p['id'])
+        # listings are cached per git revision, so they are only fetched
+        # again once something has been deployed
+        revisions = {}
+        if self.looker.cache is not None:
+            revisions = self.get_project_revisions([p['id'] for p in projects])
+        files = self._map(
+                    lambda p: self._project_files(p['id'],
+                                                  revisions.get(p['id'])),
+                    projects)
 
+        project_data = []
+        for p, project_files in zip(projects, files):
             project_data.append({
                 'name': p['id'],
                 'pr_mode': p['pull_request_mode'],
@@ -38,10 +99,37 @@ class Fetcher(object):
         self.fetch_logger.info('Fetch Complete :: Projects')
         return project_data
 
+    def _project_files(self, project, revision=None):
+        cache = self.looker.cache
+        if cache is not None and revision:
+            files = cache.get('project_files', project, revision)
+            if files is not None:
+                return files
+        files = self.looker.get_project_files(project=project)
+        if cache is not None and revision and files is not None:
+            cache.set(files, 'project_files', project, revision)
+        return files
+
+    # returns {project: git ref} for every project, or for the given project
+    # ids. Used to tell whether cached LookML metadata still matches what is
+    # deployed
+    @timed('fetch project revisions')
+    def get_project_revisions(self, projects=None):
+        self.fetch_logger.info('Fetching project revisions')
+        if projects is None:
+            projects = [p['id'] for p in self.looker.get_projects()]
+        branches = self._map(self.looker.get_git_branch, projects)
+        revisions = {}
+        for project, branch in zip(projects, branches):
+            revisions[project] = branch.get('ref') if branch else None
+        self.fetch_logger.info('Fetch Complete :: Project Revisions')
+        return revisions
+
     # function that returns list of model definitions or model names (with
     # verbose 0 or 1 respectively) Allows the user to specify a project name,
     # a model name or nothing at all. project paramater is a string while model
     # parameter is a list
+    @timed('fetch models')
     def get_models(self, project=None, model=None, verbose=0, scoped_names=0):
         if project is None and model is None:
             self.fetch_logger.info('Fetching all models, %s', locals())
@@ -72,23 +160,25 @@ class Fetcher(object):
         self.fetch_logger.info('Fetch Complete :: Models')
         return models
 
+    @timed('fetch used models')
     def get_used_models(self, timeframe=90, min_queries=0):
         self.fetch_logger.info('Fetching used models from i__looker, %s',
                                locals())
-        timeframe = str(timeframe) + ' days'
-        min_queries = '>=' + str(min_queries)
+        store = self._synced_usage_store(timeframe)
+        if store is not None:
+            return store.used_models(timeframe, min_queries)
         body = {
             "model": "i__looker",
             "view": "history",
             "fields": ["query.model", "history.query_run_count"],
-            "filters": {"history.created_date": timeframe,
+            "filters": {"history.created_date": str(timeframe) + ' days',
                         "query.model": "-i^_^_looker",
-                        "history.query_run_count": min_queries
+                        "history.query_run_count": '>=' + str(min_queries)
                         },
             "limit": "50000"
         }
 
-        response = self.looker.run_inline_query("json", body)
+        response = self._run_history_query(body, timeframe, min_queries)
 
         x = {}
         for r in response:
@@ -96,48 +186,201 @@ class Fetcher(object):
         self.fetch_logger.info('Used Models Fetch Complete')
         return(x)
 
+    # whether the model (or model.explore) named by names is in the shard
+    # of this run
+    def in_shard(self, *names):
+        return in_shard(self.shard, *names)
+
+    # (model, explore) names of every explore, in the order of the model
+    # listing
+    def _explore_listing(self, model=None):
+        models = self.get_models(model=model, verbose=1)
+        return [(mdl['name'], e['name']) for mdl in models
+                for e in mdl['explores']]
+
+    # {(model, explore): position} in the explores of an unsharded run, so
+    # that the rows of the shards can be merged back in that order
+    def explore_positions(self, model=None, explore=None):
+        if explore is not None:
+            return {(model, explore): 0}
+        return {p: i for i, p in enumerate(self._explore_listing(model))}
+
     # errors have to be handled more downstream if explore does not exist due
-    # to bug #32748
+    # to bug #32748. Explores are returned as compact Explore records (see
+    # explore.py), or as (model, explore) name pairs unless verbose. Only
+    # the explores of the shard are returned when sharded
+    @timed('fetch explores')
     def get_explores(self, model=None, explore=None, scoped_names=0,
                      verbose=0):
         explores = []
-        if explore is not None:
+        if explore is not None and not self.in_shard(model, explore):
+            self.fetch_logger.info('Explore %s is not in shard %s/%s',
+                                   explore, *self.shard)
+        elif explore is not None:
             self.fetch_logger.info('Fetching explore %s, %s', explore,
                                    locals())
             e = self.looker.get_explore(model_name=model, explore_name=explore)
-            if e:
-                explores.extend(e)
+            explores.extend(compact(e))
         else:
             self.fetch_logger.info('Fetching all explores, %s', locals())
-            models = self.get_models(model=model, verbose=1)
-            for mdl in models:
-                for e in mdl['explores']:
-                    if verbose == 1:
-                        explores.extend(self.looker.get_explore(mdl['name'],
-                                                                e['name']))
-                    else:
-                        explores.append((mdl['name'], e['name']))
+            pairs = [p for p in self._explore_listing(model=model)
+                     if self.in_shard(*p)]
+            if verbose == 1:
+                # bodies are compacted as soon as they arrive so that only
+                # one body per worker is held at a time
+                if self.async_looker is not None:
+                    async def get_explore(p):
+                        return compact(
+                            await self.async_looker.get_explore(*p))
+                    bodies = self.async_looker.map(get_explore, pairs)
+                else:
+                    bodies = self._map(
+                        lambda p: compact(self.looker.get_explore(*p)), pairs)
+                # missing explores come back as [] and are dropped here
+                for e in bodies:
+                    explores.extend(e)
+            else:
+                explores.extend(pairs)
         self.fetch_logger.info('Fetch Complete :: Explores')
         return explores
 
+    # yields the same explores as get_explores(verbose=1), in the same
+    # order, as soon as they and the ones before them have arrived. pairs
+    # of (model, explore) names, as returned by get_explores(verbose=0),
+    # restrict it to those explores
+    def iter_explores(self, model=None, explore=None, pairs=None):
+        if explore is not None:
+            for e in self.get_explores(model=model, explore=explore):
+                yield e
+            return
+        if pairs is None:
+            pairs = self.get_explores(model=model)
+        self.fetch_logger.info('Streaming %s explores', len(pairs))
+        if self.async_looker is not None:
+            async def get_explore(p):
+                return compact(await self.async_looker.get_explore(*p))
+            bodies = self.async_looker.imap(get_explore, pairs)
+            for e in bodies:
+                yield from e
+        elif self.workers == 1:
+            for p in pairs:
+                yield from compact(self.looker.get_explore(*p))
+        else:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for e in executor.map(
+                        lambda p: compact(self.looker.get_explore(*p)),
+                        pairs):
+                    yield from e
+        self.fetch_logger.info('Fetch Complete :: Explores')
+
+    # the usage snapshot as a future, taken by executor while explores are
+    # being fetched. A local usage store is read on the calling thread
+    # instead, since it has little to wait for
+    def _usage_future(self, executor, model=None, timeframe=90,
+                      min_queries=0):
+        if self.usage_store is None:
+            return executor.submit(self.get_usage_snapshot, model=model,
+                                   timeframe=timeframe,
+                                   min_queries=min_queries)
+        usage = Future()
+        usage.set_result(self.get_usage_snapshot(model=model,
+                                                 timeframe=timeframe,
+                                                 min_queries=min_queries))
+        return usage
+
+    # yields (explore, usage snapshot) as explores arrive. The snapshot is
+    # taken while the first explores are being fetched
+    def iter_explore_usage(self, model=None, explore=None, timeframe=90,
+                           min_queries=0):
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            usage = self._usage_future(executor, model=model,
+                                       timeframe=timeframe,
+                                       min_queries=min_queries)
+            for e in self.iter_explores(model=model, explore=explore):
+                yield e, usage.result()
+
+    # yields fn(explore, usage) for every explore, in the order of
+    # iter_explores, as explores arrive. Rows are recorded in the journal
+    # as they are made, and the rows it recorded before (in a run that was
+    # interrupted) are yielded as they were instead of fetching and
+    # analyzing their explores again
+    def iter_explore_rows(self, fn, model=None, explore=None, timeframe=90,
+                          min_queries=0):
+        journal = self.journal
+        if journal is None:
+            for e, usage in self.iter_explore_usage(model=model,
+                                                    explore=explore,
+                                                    timeframe=timeframe,
+                                                    min_queries=min_queries):
+                yield fn(e, usage)
+            return
+        if explore is not None:
+            pairs = [(model, explore)] if self.in_shard(model, explore) \
+                else []
+        else:
+            pairs = self.get_explores(model=model)
+        todo = [p for p in pairs if p not in journal]
+        if len(todo) < len(pairs):
+            self.fetch_logger.info('Reusing %s of %s explores',
+                                   len(pairs) - len(todo), len(pairs))
+        if not todo:
+            for p in pairs:
+                yield journal.get(p)
+            return
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            usage = self._usage_future(executor, model=model,
+                                       timeframe=timeframe,
+                                       min_queries=min_queries)
+            explores = self.iter_explores(pairs=todo)
+            e = next(explores, None)
+            for p in pairs:
+                if p in journal:
+                    yield journal.get(p)
+                # explores that went missing (bug #32748) are skipped
+                elif e is not None and (e.model_name, e.name) == tuple(p):
+                    row = fn(e, usage.result())
+                    journal.record(e.model_name, e.name, row)
+                    yield row
+                    e = next(explores, None)
+
+    # yields (position, fn(explore, usage)) for the explores of the shard
+    # as iter_explore_rows does, position being that of the explore in an
+    # unsharded run. Rows are journaled along with their position
+    def iter_shard_rows(self, fn, model=None, explore=None, timeframe=90,
+                        min_queries=0):
+        positions = self.explore_positions(model=model, explore=explore)
+
+        def indexed(e, usage):
+            return positions[(e.model_name, e.name)], fn(e, usage)
+        return self.iter_explore_rows(indexed, model=model, explore=explore,
+                                      timeframe=timeframe,
+                                      min_queries=min_queries)
+
+    # (position, row) for rows of the shard's models, position being that
+    # of the model in an unsharded run
+    def index_model_rows(self, rows, project=None, model=None):
+        models = self.get_models(project=project, model=model)
+        positions = {m: i for i, m in enumerate(models)}
+        return [(positions[r['model']], r) for r in rows]
+
     def get_explore_fields(self, explore=None, scoped_names=0):
         self.fetch_logger.info('Parsing explore body for fields')
         fields = []
-        for dimension in explore['fields']['dimensions']:
+        for dimension in explore.dimensions:
             # if dimension['hidden'] is not True:
-            fields.append((explore['model_name']+'.'
-                          + explore['name'] + '.')*scoped_names
-                          + dimension['name'])
-        for measure in explore['fields']['measures']:
+            fields.append((explore.model_name+'.'
+                          + explore.name + '.')*scoped_names
+                          + dimension.name)
+        for measure in explore.measures:
             # if measure['hidden'] is not True:
-            fields.append((explore['model_name']+'.'
-                          + explore['name']+'.')*scoped_names
-                          + measure['name'])
-        for fltr in explore['fields']['filters']:
+            fields.append((explore.model_name+'.'
+                          + explore.name+'.')*scoped_names
+                          + measure.name)
+        for fltr in explore.filters:
             # if fltr['hidden'] is not True:
-            fields.append((explore['model_name']+'.'
-                          + explore['name']+'.')*scoped_names
-                          + fltr['name'])
+            fields.append((explore.model_name+'.'
+                          + explore.name+'.')*scoped_names
+                          + fltr.name)
         self.fetch_logger.info('Parsing Complete')
         return list(set(fields))
 
@@ -147,6 +390,7 @@ class Fetcher(object):
         dim_count, measure_count, has_description = 0,0,0
 
 
+    @timed('fetch unused explores')
     def get_unused_explores(self, model=None, timeframe=90, min_queries=0):
         self.fetch_logger.info('Fetching unused explores, %s', locals())
         used_explores = self.get_used_explores(model=model,
@@ -166,14 +410,17 @@ class Fetcher(object):
     # query.fields are is view.field (view is view name used in the explore)
     # to uniquely identify fields, explore.view.field should be used,
     # or even better, model.explore.view.field
+    @timed('fetch used explore fields')
     def get_used_explore_fields(self, model=None, explore=None, timeframe=90,
                                 min_queries=0):
         self.fetch_logger.info('Fetching exposed explore fields, %s', locals())
+        store = self._synced_usage_store(timeframe)
+        if store is not None:
+            usage = store.snapshot(model, timeframe, min_queries)
+            return usage.used_explore_fields(model, explore)
         m = model.replace('_', '^_') + ',' if model is not None else ''
         m += "-i^_^_looker"
         e = ','.join(explore).replace('_', '^_')
-        min_queries = '>=' + str(min_queries)
-        timeframe = str(timeframe) + ' days'
         body = {
             "model": "i__looker",
             "view": "history",
@@ -182,70 +429,64 @@ class Fetcher(object):
                        "query.formatted_filters", "query.sorts",
                        "query.formatted_pivots",
                        "history.query_run_count"],
-            "filters": {"history.created_date": timeframe,
+            "filters": {"history.created_date": str(timeframe) + ' days',
                         "query.model": m,
                         "query.view": e,
-                        "history.query_run_count": min_queries},
+                        "history.query_run_count": '>=' + str(min_queries)},
             "limit": "100000"
         }
         # returns only fields used from a given explore
-        response = self.looker.run_inline_query("json", body)
+        start, end = self.splitter.timeframe_range(timeframe)
+        usage = self._used_fields(body, start, end, min_queries)
 
-        formatted_fields = []
-        for row in response:
-            fields = []
-            explore = row['query.view']
-            model = row['query.model']
-            run_count = row['history.query_run_count']
-            fields.extend(re.findall(r'(\w+\.\w+)',
-                                     str(row['query.formatted_fields'])))
-            fields.extend(re.findall(r'(\w+\.\w+)',
-                                     str(row['query.formatted_filters'])))
-            fields.extend(re.findall(r'(\w+\.\w+)',
-                                     str(row['query.formatted_pivots'])))
-            fields.extend(re.findall(r'(\w+\.\w+)',
-                                     str(row['query.sorts'])))
-            for field in fields:
-                s = model + '.' + explore + '.' + field + '.' + str(run_count)
-                formatted_fields.extend([s])
-
-        field_name = []
-        field_use_count = []
-        for row in formatted_fields:
-            field = '.'.join(row.split('.')[:-1])  # remove the count
-            field_name.append(field)  # model.explore.view scoped
-            count = int(row.split('.')[-1])
-            field_use_count.append({
-                'field_name': field,
-                'count': count
-            })
+        c = usage.scoped()
+        self.fetch_logger.info('Fetch Complete :: Exposed Explore Fields ')
+        return c
 
-        c = Counter()
+    # counts the fields used in i__looker field usage rows
+    def _aggregate_used_fields(self, response):
+        usage = FieldAggregator()
+        for row in response:
+            usage.add(row)
+        return usage
 
-        for value in field_use_count:
-            c[value['field_name']] += value['count']
-        self.fetch_logger.info('Fetch Complete :: Exposed Explore Fields ')
-        return dict(c)
+    # field usage of the history rows of body between start and end. Since
+    # every history row has run at least once, a min_queries of 0 or 1
+    # filters nothing and rows are streamed and counted as they arrive.
+    # Otherwise rows are merged across date windows before the threshold
+    # is applied
+    def _used_fields(self, body, start, end, min_queries=0):
+        if min_queries <= 1:
+            return self._history_rows(
+                       self.splitter.aggregate(body, start, end,
+                                               FieldAggregator))
+        rows = self.splitter.run(body, start, end,
+                                 measures=['history.query_run_count'],
+                                 having={'history.query_run_count':
+                                         min_queries})
+        return self._aggregate_used_fields(self._history_rows(rows))
 
+    @timed('fetch used explores')
     def get_used_explores(self, model=None, explore=None,
                           timeframe=90, min_queries=0):
         self.fetch_logger.info('Fetching used explores, %s', locals())
-        timeframe = str(timeframe) + ' days'
-        min_queries = '>=' + str(min_queries)
+        store = self._synced_usage_store(timeframe)
+        if store is not None:
+            return store.used_explores(model, explore, timeframe, min_queries)
         m = model.replace('_', '^_') + ',' if model is not None else ''
         body = {
             "model": "i__looker",
             "view": "history",
             "fields": ["query.view", "history.query_run_count"],
-            "filters": {"history.created_date": timeframe,
+            "filters": {"history.created_date": str(timeframe) + ' days',
                         "query.model": m,
-                        "history.query_run_count": min_queries,
+                        "history.query_run_count": '>=' + str(min_queries),
                         "query.view": explore
                         },
             "limit": "50000"
         }
 
-        response = self.looker.run_inline_query("json", body)
+        response = self._run_history_query(body, timeframe, min_queries)
 
         x = {}
         for r in response:
@@ -253,9 +494,105 @@ class Fetcher(object):
         self.fetch_logger.info('Fetch Complete :: Used Explores')
         return(x)
 
+    # fetches explore and field usage for every explore in the timeframe
+    # using two grouped i__looker queries. Commands then look up usage per
+    # explore in the returned snapshot instead of querying history each time.
+    # With fields=False only explore usage is fetched
+    @timed('fetch usage snapshot')
+    def get_usage_snapshot(self, model=None, timeframe=90, min_queries=0,
+                           fields=True):
+        self.fetch_logger.info('Fetching usage snapshot, %s', locals())
+        store = self._synced_usage_store(timeframe)
+        if store is not None:
+            return store.snapshot(model, timeframe, min_queries, fields)
+        m = model.replace('_', '^_') + ',' if model is not None else ''
+        m += "-i^_^_looker"
+        filters = {"history.created_date": str(timeframe) + ' days',
+                   "query.model": m,
+                   "history.query_run_count": '>=' + str(min_queries)}
+        explore_body = {
+            "model": "i__looker",
+            "view": "history",
+            "fields": ["query.model", "query.view",
+                       "history.query_run_count"],
+            "filters": filters,
+            "limit": "50000"
+        }
+        field_body = {
+            "model": "i__looker",
+            "view": "history",
+            "fields": ["query.model", "query.view",
+                       "query.formatted_fields",
+                       "query.formatted_filters", "query.sorts",
+                       "query.formatted_pivots",
+                       "history.query_run_count"],
+            "filters": filters,
+            "limit": "100000"
+        }
+
+        explore_usage = {}
+        field_usage = {}
+        # both queries run side by side rather than one after the other
+        start, end = self.splitter.timeframe_range(timeframe)
+        measures = ['history.query_run_count']
+        having = {'history.query_run_count': min_queries}
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            explore_rows = executor.submit(
+                self.splitter.run, explore_body, start, end, measures,
+                having)
+            if fields:
+                field_usage = executor.submit(self._used_fields, field_body,
+                                              start, end, min_queries)
+                field_usage = field_usage.result().usage
+            explore_rows = self._history_rows(explore_rows.result())
+        for r in explore_rows:
+            explore_usage.setdefault(r['query.model'], {})[r['query.view']] = \
+                r['history.query_run_count']
+        self.fetch_logger.info('Fetch Complete :: Usage Snapshot')
+        return UsageSnapshot(explores=explore_usage, fields=field_usage)
+
+    # git connection tests need the session in dev mode, which only has to
+    # be switched once per session
+    def _enter_dev_mode(self):
+        if self.looker.workspace != 'dev':
+            self.looker.update_session(mode='dev')
+
+    # runs the git connection tests of several projects side by side.
+    # Results are returned in the same order as projects
+    @timed('test git connections')
+    def test_git_connections(self, projects):
+        self._enter_dev_mode()
+        return self._map(self._run_git_connection_tests, projects)
+
+    # usage of every model from the /lookml_models listing (models, as
+    # returned by get_models with verbose=1) and a single explore usage
+    # query, without downloading any explore body. Returns
+    # {model: (query_run_count, unused explore names)}
+    @timed('fetch model usage')
+    def get_model_usage(self, models, model=None, timeframe=90,
+                        min_queries=0, model_min_queries=0):
+        self.fetch_logger.info('Fetching model usage, %s',
+                               {'model': model, 'timeframe': timeframe,
+                                'min_queries': min_queries})
+        # no threshold here: model counts add up all of their explores
+        usage = self.get_usage_snapshot(model=model, timeframe=timeframe,
+                                        fields=False)
+        used_models = usage.used_models(model_min_queries)
+        result = {}
+        for m in models:
+            used = usage.used_explores(m['name'])
+            unused = [e['name'] for e in m['explores']
+                      if e['name'] not in used
+                      or used[e['name']] < min_queries]
+            result[m['name']] = (used_models.get(m['name'], 0), unused)
+        self.fetch_logger.info('Fetch Complete :: Model Usage')
+        return result
+
     def test_git_connection(self, project):
-        # enter dev mode
-        self.looker.update_session(mode='dev')
+        self._enter_dev_mode()
+        return self._run_git_connection_tests(project)
+
+    def _run_git_connection_tests(self, project):
         # obtain tests available
         tests = []
         for test in self.looker.git_connection_tests(project_id=project):
@@ -0,0 +1,84 @@
+#!/usr/local/bin/python3
+# journal.py
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+
+
+# append-only checkpoint of a long analyze/vacuum run, under
+# ~/.henry/runs/<run id>/journal.ndjson. The row computed for every
+# explore is recorded as soon as it is done, so that a run that fails part
+# way (network errors, an expired token, ctrl-c) can be resumed and only
+# analyze the explores that are left. The run id is derived from the
+# instance, the command and its parameters, so running the same command
+# again finds the journal of the interrupted run. A run that completes
+# removes its journal
+class Journal(object):
+    def __init__(self, host, command, params, resume=False, path=None):
+        self.journal_logger = logging.getLogger('journal')
+        key = json.dumps([host, command, params], sort_keys=True)
+        self.run_id = hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]
+        if path is None:
+            path = os.path.join(os.path.expanduser('~'), '.henry', 'runs',
+                                self.run_id)
+        os.makedirs(path, exist_ok=True)
+        self.directory = path
+        self.path = os.path.join(path, 'journal.ndjson')
+        # {(model, explore): row}
+        self.rows = {}
+        if resume and os.path.exists(self.path):
+            self._load()
+        else:
+            if resume:
+                self.journal_logger.info('No run to resume')
+            self._start(host, command, params)
+        self.file = open(self.path, 'a')
+
+    def _start(self, host, command, params):
+        with open(self.path, 'w') as f:
+            f.write(json.dumps({'run': self.run_id, 'host': host,
+                                'command': command, 'params': params,
+                                'started': time.time()}) + '\n')
+        self.journal_logger.info('Started run %s', self.run_id)
+
+    def _load(self):
+        with open(self.path) as f:
+            # the first line describes the run
+            next(f, None)
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # cut short by the interruption
+                    continue
+                self.rows[(entry['model'], entry['explore'])] = entry['row']
+        self.journal_logger.info('Resuming run %s, %s explores done',
+                                 self.run_id, len(self.rows))
+
+    def __contains__(self, pair):
+        return tuple(pair) in self.rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def get(self, pair):
+        return self.rows.get(tuple(pair))
+
+    # rows are flushed one at a time so that they survive the process
+    def record(self, model, explore, row):
+        self.rows[(model, explore)] = row
+        self.file.write(json.dumps({'model': model, 'explore': explore,
+                                    'row': row}) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    # drops the journal of a run that completed
+    def remove(self):
+        self.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self.journal_logger.info('Run %s complete', self.run_id)
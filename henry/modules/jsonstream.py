@@ -0,0 +1,66 @@
+#!/usr/local/bin/python3
+# jsonstream.py
+import codecs
+import json
+
+_decoder = json.JSONDecoder()
+_whitespace = ' \t\n\r'
+
+
+# yields the elements of a top level JSON array as its chunks (bytes)
+# arrive, e.g. from requests' iter_content. Only the element being decoded
+# is buffered, so memory stays bounded by the largest row rather than the
+# size of the response
+def iter_json_array(chunks):
+    text = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    buffer = ''
+    pos = 0
+    started = False
+    # after an element only a separator or the end of the array may follow
+    separator = False
+    empty = True
+    done = False
+    while True:
+        while pos < len(buffer) and buffer[pos] in _whitespace:
+            pos += 1
+        if pos < len(buffer):
+            char = buffer[pos]
+            if not started:
+                if char != '[':
+                    raise ValueError('Expected a JSON array')
+                started = True
+                pos += 1
+                continue
+            if char == ']' and (separator or empty):
+                return
+            if separator:
+                if char != ',':
+                    raise ValueError('Expected , or ] at position %s' % pos)
+                separator = False
+                pos += 1
+                continue
+            try:
+                row, end = _decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # most likely the element continues in the next chunk
+                if done:
+                    raise
+            else:
+                # a number at the very end of the buffer may be cut short
+                if end < len(buffer) or done:
+                    yield row
+                    pos = end
+                    separator = True
+                    empty = False
+                    continue
+        elif done:
+            raise ValueError('Unexpected end of JSON array')
+
+        chunk = next(chunks, None)
+        if chunk is None:
+            buffer = buffer[pos:] + text.decode(b'', final=True)
+            done = True
+        else:
+            buffer = buffer[pos:] + text.decode(chunk)
+        pos = 0
@@ -1,39 +1,215 @@
 # -*- coding: UTF-8 -*-
 import requests
+from requests.adapters import HTTPAdapter
 import json
 import sys
+import threading
+import time
 import logging
 import logging.config
+from .jsonstream import iter_json_array
+from .memo import SingleFlight
+from .profiler import endpoint
+from .ratelimit import AdaptiveLimiter, RETRY_STATUSES, retry_delay, \
+                       parse_retry_after, retryable
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
 requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
 logging.getLogger("urllib3").setLevel(logging.WARNING)
 
+# a token that expires within this many seconds is checked before use
+TOKEN_EXPIRY_MARGIN = 60
+
 
 class LookerApi(object):
     def __init__(self, id, secret, host, port, access_token, timeout,
-                 session_info):
+                 session_info, max_concurrency=1, max_retries=5,
+                 latency_target=None, token_expires=None, profiler=None,
+                 tracer=None):
         self.api_logger = logging.getLogger('lookerapi')
         self.id = id
         self.secret = secret
         self.host = host
         self.port = port
         self.access_token = access_token
+        # when access_token expires (epoch seconds), if known
+        self.token_expires = token_expires
+        self.auth_lock = threading.Lock()
         self.timeout = timeout
+        # optional MetadataCache for model and explore definitions
+        self.cache = None
+        # optional Profiler recording the requests of the run
+        self.profiler = profiler
+        # optional Tracer recording the requests of the run as spans
+        self.tracer = tracer
+        self.max_retries = max_retries
+        self.limiter = AdaptiveLimiter(max_concurrency,
+                                       latency_target=latency_target)
+        self.memo = SingleFlight()
+        # workspace of the API session, once switched with update_session
+        self.workspace = None
 
         self.session = requests.Session()
         self.session.verify = False
+        # size the connection pool so concurrent workers sharing this session
+        # reuse connections instead of opening and discarding new ones
+        pool_size = max(10, max_concurrency or 1)
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
 
         self.session.headers.update({'Authorization': 'token %s' %
                                     access_token, 'User-Agent': session_info})
 
-        # if not valid anymore, authenticate again
-        if self.__get_me() == 401:
+        # without a token there is nothing to check, and a token known to
+        # be fresh is used as is. Otherwise check it first and authenticate
+        # again if not valid anymore. Tokens rejected later on are renewed
+        # by _send
+        if not access_token:
+            self.auth()
+        elif self.token_fresh():
+            self.api_logger.info('Using existing auth token')
+        elif self.__get_me() == 401:
             self.api_logger.warning('Existing auth token has expired')
             self.auth()
 
+    def token_fresh(self):
+        return self.token_expires is not None and \
+            time.time() < self.token_expires - TOKEN_EXPIRY_MARGIN
+
     def get_access_token(self):
         return self.access_token
 
+    # every API call goes through here. Identical calls (GETs by default)
+    # are issued once per run and their response shared, including between
+    # concurrent workers asking at the same time. retain=False only shares
+    # calls that are in flight, for large bodies that shouldn't be kept in
+    # memory for the whole run. Failed responses are never kept
+    def _request(self, method, url, coalesce=None, retain=True, **kwargs):
+        if coalesce is None:
+            coalesce = method == 'GET'
+        if not coalesce:
+            return self._send(method, url, **kwargs)
+        key = (method, url, json.dumps(kwargs.get('params'), sort_keys=True),
+               kwargs.get('data'))
+        sent = []
+
+        def send():
+            sent.append(True)
+            r = self._send(method, url, **kwargs)
+            if r.status_code >= 400:
+                self.memo.forget(key)
+            return r
+        waited = time.time()
+        r = self.memo.do(key, send, retain=retain)
+        if not sent:
+            if self.profiler is not None:
+                self.profiler.cache_hit(method, url)
+            # time spent waiting on an identical call in flight
+            if self.tracer is not None:
+                self.tracer.wait('shared ' + endpoint(method, url), waited)
+        return r
+
+    # Connection errors, timeouts, 429s and 5xx responses are retried with
+    # exponential backoff and jitter (or after the delay given in
+    # Retry-After), and the adaptive limiter lowers the number of requests
+    # in flight while the instance is struggling. Only idempotent calls
+    # (GETs by default, retry=True for others) are retried in every case,
+    # see ratelimit.retryable. Once retries are exhausted the last response
+    # (or error) is passed on to the caller's usual error handling.
+    # retry_timeouts=False gives up as soon as a request times out and
+    # renew=False passes a 401 on rather than renewing the token
+    def _send(self, method, url, retry=None, retry_timeouts=True, renew=True,
+              **kwargs):
+        if retry is None:
+            retry = method == 'GET'
+        attempt = 0
+        renewed = False
+        while True:
+            token = self.access_token
+            queued = time.time()
+            with self.limiter:
+                started = time.time()
+                try:
+                    r = self.session.request(method, url, **kwargs)
+                    error = None
+                except (requests.exceptions.ConnectionError,
+                        requests.exceptions.Timeout) as e:
+                    r, error = None, e
+                latency = time.time() - started
+            if self.profiler is not None:
+                self._profile(method, url, latency, r, kwargs.get('stream'),
+                              retry=attempt > 0 or renewed)
+            if self.tracer is not None:
+                self._trace(method, url, queued, started, latency, r,
+                            attempt)
+            if isinstance(error, requests.exceptions.Timeout) and \
+                    not retry_timeouts:
+                raise error
+            # a token that expired or was revoked since it was last checked
+            # is renewed once and the request sent again
+            if error is None and r.status_code == 401 and renew \
+                    and not renewed and token and self.secret \
+                    and not url.endswith('/login'):
+                self.api_logger.warning('Auth token rejected by %s', url)
+                self.renew_token(token)
+                renewed = True
+                continue
+
+            if error is None and r.status_code not in RETRY_STATUSES:
+                self.limiter.success(latency)
+                return r
+            self.limiter.failure()
+            if error is not None:
+                status, retry_after = None, None
+            else:
+                status = r.status_code
+                retry_after = r.headers.get('Retry-After')
+            if attempt >= self.max_retries or \
+                    not retryable(status, retry_after, idempotent=retry):
+                if error is not None:
+                    raise error
+                return r
+            if error is not None:
+                delay = retry_delay(attempt)
+                reason = error
+            else:
+                delay = retry_delay(attempt, parse_retry_after(retry_after))
+                reason = status
+            self.api_logger.warning('Request to %s failed (%s), retrying in '
+                                    '%.1fs (%s of %s)', url, reason, delay,
+                                    attempt + 1, self.max_retries)
+            slept = time.time()
+            time.sleep(delay)
+            if self.tracer is not None:
+                self.tracer.wait('retry backoff', slept,
+                                 args={'url': url, 'attempt': attempt + 1})
+            attempt += 1
+
+    # bodies of streamed responses are counted as they are read instead
+    def _profile(self, method, url, latency, r, stream=False, retry=False):
+        nbytes = 0
+        if r is not None and not stream:
+            nbytes = len(r.content)
+        self.profiler.request(method, url, latency, nbytes, retry=retry,
+                              error=r is None or r.status_code >= 400)
+
+    # the wait for a slot of the limiter, then the request itself
+    def _trace(self, method, url, queued, started, latency, r, attempt):
+        name = endpoint(method, url)
+        self.tracer.wait('limiter wait', queued, started,
+                         args={'endpoint': name})
+        args = {'url': url.split('/api/3.0/', 1)[-1],
+                'status': r.status_code if r is not None else None}
+        if attempt:
+            args['attempt'] = attempt
+        self.tracer.complete(name, started, started + latency, cat='api',
+                             args=args)
+
+    # records a call answered from the metadata cache
+    def _cache_hit(self, method, url):
+        if self.profiler is not None:
+            self.profiler.cache_hit(method, url)
+
     def auth(self):
         self.api_logger.info('Authenticating')
         url = 'https://{}:{}/api/3.0/{}'.format(self.host, self.port, 'login')
@@ -43,13 +219,23 @@ class LookerApi(object):
         self.api_logger.info('Request to %s => POST /api/3.0/login, %s',
                              self.host, {'client_id': params['client_id'],
                                          'client_secret': "[FILTERED]"})
-        r = self.session.post(url, params=params, timeout=self.timeout)
-        access_token = r.json().get('access_token')
+        try:
+            r = self._request('POST', url, params=params,
+                              timeout=self.timeout)
+        except Exception as e:
+            self.api_logger.error(e)
+            print('Connection timed out. Please confirm the hostname')
+            sys.exit(1)
+        body = r.json()
+        access_token = body.get('access_token')
         self.session.headers.update({'Authorization': 'token %s'
                                      % access_token})
         if r.status_code == requests.codes.ok:
             self.api_logger.info('Request Complete: %s', r.status_code)
             self.access_token = access_token
+            self.token_expires = None
+            if body.get('expires_in'):
+                self.token_expires = time.time() + body['expires_in']
         else:
             self.api_logger.warning('Request Complete: %s', r.status_code)
             print('Authentication Error: Check supplied credentials.')
@@ -57,13 +243,19 @@ class LookerApi(object):
 
         return
 
+    # logs in again unless another thread already replaced token
+    def renew_token(self, token):
+        with self.auth_lock:
+            if self.access_token == token:
+                self.auth()
+
 # GET /user - meant for use by the class itself
     def __get_me(self):
         self.api_logger.info('Trying to auth in using existing auth token')
         url = 'https://{}:{}/api/3.0/user'.format(self.host, self.port)
         self.api_logger.info('Request to %s => POST /api/3.0/user', self.host)
         try:
-            r = self.session.get(url, timeout=self.timeout)
+            r = self._request('GET', url, renew=False, timeout=self.timeout)
         except Exception as e:
             self.api_logger.error(e)
             print('Connection timed out. Please confirm the hostname')
@@ -73,6 +265,11 @@ class LookerApi(object):
 
 # GET /lookml_models/
     def get_models(self, fields={}):
+        if self.cache is not None and not fields:
+            cached = self.cache.get('models')
+            if cached is not None:
+                self._cache_hit('GET', 'lookml_models')
+                return cached
         url = 'https://{}:{}/api/3.0/{}'.format(self.host,
                                                 self.port,
                                                 'lookml_models')
@@ -80,17 +277,24 @@ class LookerApi(object):
         self.api_logger.info('Request to %s => GET /api/3.0/lookml_models, %s',
                              self.host,
                              params)
-        r = self.session.get(url, params=params, timeout=self.timeout)
+        r = self._request('GET', url, params=params, timeout=self.timeout)
         try:
             r.raise_for_status()
         except requests.exceptions.HTTPError as e:
             self.api_logger.error('Request Complete: %s', r.status_code)
             raise(e)
         self.api_logger.info('Request Complete: %s', r.status_code)
+        if self.cache is not None and not fields:
+            self.cache.set(r.json(), 'models')
         return r.json()
 
 # GET /lookml_models/{{NAME}}
     def get_model(self, model_name=None, fields={}):
+        if self.cache is not None and not fields:
+            cached = self.cache.get('models', model_name)
+            if cached is not None:
+                self._cache_hit('GET', 'lookml_models/%s' % model_name)
+                return [cached]
         url = 'https://{}:{}/api/3.0/{}/{}'.format(self.host,
                                                    self.port,
                                                    'lookml_models',
@@ -98,17 +302,25 @@ class LookerApi(object):
         params = fields
         self.api_logger.info('Request to %s => GET /api/3.0/lookml_models/%s,'
                              ' %s', self.host, model_name, params)
-        r = self.session.get(url, params=params, timeout=self.timeout)
+        r = self._request('GET', url, params=params, timeout=self.timeout)
         try:
             r.raise_for_status()
         except requests.exceptions.HTTPError as e:
             self.api_logger.error('Request Complete: %s', r.status_code)
             raise(e)
         self.api_logger.info('Request Complete: %s', r.status_code)
+        if self.cache is not None and not fields:
+            self.cache.set(r.json(), 'models', model_name)
         return [r.json()]
 
 # GET /lookml_models/{{NAME}}/explores/{{NAME}}
     def get_explore(self, model_name=None, explore_name=None, fields={}):
+        if self.cache is not None and not fields:
+            cached = self.cache.get('explores', model_name, explore_name)
+            if cached is not None:
+                self._cache_hit('GET', 'lookml_models/%s/explores/%s'
+                                % (model_name, explore_name))
+                return [cached]
         url = 'https://{}:{}/api/3.0/{}/{}/{}/{}'.format(self.host,
                                                          self.port,
                                                          'lookml_models',
@@ -119,14 +331,20 @@ class LookerApi(object):
         self.api_logger.info('Request to %s => GET /api/3.0/lookml_models/%s'
                              '/explores/%s, %s', self.host, model_name,
                              explore_name, params)
-        r = self.session.get(url, params=params, timeout=self.timeout)
+        # explore bodies are large, so they are only shared while in flight
+        r = self._request('GET', url, params=params, timeout=self.timeout,
+                          retain=False)
         try:
             r.raise_for_status()
         except requests.exceptions.HTTPError as e:
             self.api_logger.error('Request Complete: %s', r.status_code)
             return []
         self.api_logger.info('Request Complete: %s', r.status_code)
-        return [r.json()]
+        # parsed once, bodies being large
+        body = r.json()
+        if self.cache is not None and not fields:
+            self.cache.set(body, 'explores', model_name, explore_name)
+        return [body]
 
 # GET /projects
     def get_projects(self, fields={}):
@@ -137,7 +355,7 @@ class LookerApi(object):
         self.api_logger.info('Request to %s => GET /api/3.0/projects, %s',
                              self.host,
                              params)
-        r = self.session.get(url, params=params, timeout=self.timeout)
+        r = self._request('GET', url, params=params, timeout=self.timeout)
         try:
             r.raise_for_status()
         except requests.exceptions.HTTPError as e:
@@ -157,7 +375,7 @@ class LookerApi(object):
                              self.host,
                              project_id,
                              params)
-        r = self.session.get(url, params=params, timeout=self.timeout)
+        r = self._request('GET', url, params=params, timeout=self.timeout)
         try:
             r.raise_for_status()
         except requests.exceptions.HTTPError as e:
@@ -176,18 +394,20 @@ class LookerApi(object):
         params = fields
         self.api_logger.info('Request to %s => GET /api/3.0/projects/%s/files,'
                              ' %s', self.host, project, params)
-        r = self.session.get(url, params=params, timeout=self.timeout)
+        r = self._request('GET', url, params=params, timeout=self.timeout)
         try:
             r.raise_for_status()
         except requests.exceptions.HTTPError as e:
             self.api_logger.warning('Request Complete: %s', r.status_code)
-            print('Project not found: %s', project)
+            print('Project not found: %s' % project)
             return
         self.api_logger.info('Request Complete: %s', r.status_code)
         return r.json()
 
 # POST /queries/run/{result_format}
-    def run_inline_query(self, result_format, body, fields={}):
+    # with stream=True (json only) the rows are returned as a generator that
+    # decodes them as the response arrives instead of all at once
+    def run_inline_query(self, result_format, body, fields={}, stream=False):
         url = 'https://{}:{}/api/3.0/{}/{}/{}'.format(self.host,
                                                       self.port,
                                                       'queries',
@@ -197,8 +417,103 @@ class LookerApi(object):
         self.api_logger.info('Request to %s => POST /api/3.0/queries/run/%s, '
                              '%s', self.host, result_format, params)
         self.api_logger.info('Query params=%s', body)
-        r = self.session.post(url, json.dumps(body), params=params,
-                              timeout=self.timeout)
+        # queries are read only, so identical ones running at the same time
+        # are only run once and failures are retried. Results can be large,
+        # so they aren't kept after that. A streamed response can only be
+        # read once, so it is never shared
+        r = self._request('POST', url, data=json.dumps(body), params=params,
+                          timeout=self.timeout, coalesce=not stream,
+                          retain=False, retry=True, stream=stream)
+        try:
+            r.raise_for_status()
+        except requests.exceptions.HTTPError as e:
+            self.api_logger.warning('Request Complete: %s', r.status_code)
+            print("Error: " + str(e))
+            r.close()
+            return
+        self.api_logger.info('Request Complete: %s', r.status_code)
+        if stream:
+            return self._stream_rows(r)
+        return r.json()
+
+    def _stream_rows(self, r):
+        chunks = r.iter_content(chunk_size=65536)
+        if self.profiler is not None:
+            chunks = self._count_chunks(r, chunks)
+        try:
+            for row in iter_json_array(chunks):
+                yield row
+        finally:
+            r.close()
+
+    def _count_chunks(self, r, chunks):
+        for chunk in chunks:
+            self.profiler.received(r.request.method, r.url, len(chunk))
+            yield chunk
+
+# GET /projects/{project_id}/git_branch
+    def get_git_branch(self, project_id, fields={}):
+        url = 'https://{}:{}/api/3.0/projects/{}/git_branch'.format(self.host,
+                                                                   self.port,
+                                                                   project_id)
+        params = fields
+        self.api_logger.info('Request to %s => GET /api/3.0/projects/%s/'
+                             'git_branch, %s', self.host, project_id, params)
+        r = self._request('GET', url, params=params, timeout=self.timeout)
+        try:
+            r.raise_for_status()
+        except requests.exceptions.HTTPError as e:
+            self.api_logger.warning('Request Complete: %s', r.status_code)
+            return
+        self.api_logger.info('Request Complete: %s', r.status_code)
+        return r.json()
+
+# POST /queries
+    def create_query(self, body, fields={}):
+        url = 'https://{}:{}/api/3.0/queries'.format(self.host, self.port)
+        params = fields
+        self.api_logger.info('Request to %s => POST /api/3.0/queries, %s',
+                             self.host, params)
+        self.api_logger.info('Query params=%s', body)
+        # a query only defines what to run, so creating it twice is harmless
+        r = self._request('POST', url, data=json.dumps(body), params=params,
+                          timeout=self.timeout, retry=True)
+        try:
+            r.raise_for_status()
+        except requests.exceptions.HTTPError as e:
+            self.api_logger.warning('Request Complete: %s', r.status_code)
+            print("Error: " + str(e))
+            return
+        self.api_logger.info('Request Complete: %s', r.status_code)
+        return r.json()
+
+# POST /query_tasks
+    def create_query_task(self, query_id, result_format, fields={}):
+        url = 'https://{}:{}/api/3.0/query_tasks'.format(self.host, self.port)
+        params = fields
+        body = {'query_id': query_id, 'result_format': result_format}
+        self.api_logger.info('Request to %s => POST /api/3.0/query_tasks, '
+                             '%s, %s', self.host, params, body)
+        r = self._request('POST', url, data=json.dumps(body), params=params,
+                          timeout=self.timeout)
+        try:
+            r.raise_for_status()
+        except requests.exceptions.HTTPError as e:
+            self.api_logger.warning('Request Complete: %s', r.status_code)
+            print("Error: " + str(e))
+            return
+        self.api_logger.info('Request Complete: %s', r.status_code)
+        return r.json()
+
+# GET /query_tasks/multi_results
+    def get_query_task_multi_results(self, query_task_ids, fields={}):
+        url = 'https://{}:{}/api/3.0/query_tasks/multi_results'.format(
+                  self.host, self.port)
+        params = dict(fields, query_task_ids=','.join(query_task_ids))
+        self.api_logger.info('Request to %s => GET /api/3.0/query_tasks/'
+                             'multi_results, %s', self.host, params)
+        r = self._request('GET', url, params=params, timeout=self.timeout,
+                          coalesce=False)
         try:
             r.raise_for_status()
         except requests.exceptions.HTTPError as e:
@@ -217,7 +532,10 @@ class LookerApi(object):
         self.api_logger.info('Request to %s => PATCH /api/3.0/session, %s',
                              self.host,
                              body)
-        r = self.session.patch(url, json=body, timeout=self.timeout)
+        r = self._request('PATCH', url, json=body, timeout=self.timeout,
+                          retry=True)
+        # responses depend on the workspace, so start afresh after switching
+        self.memo.clear()
         try:
             r.raise_for_status()
         except requests.exceptions.HTTPError as e:
@@ -225,6 +543,7 @@ class LookerApi(object):
             print("Error: " + str(e))
             return
         self.api_logger.info('Request Complete: %s', r.status_code)
+        self.workspace = str(mode)
         return r.json()
 
 # GET session
@@ -236,7 +555,8 @@ class LookerApi(object):
         self.api_logger.info('Request to %s => GET /api/3.0/session, %s',
                              self.host,
                              params)
-        r = self.session.get(url, timeout=self.timeout)
+        r = self._request('GET', url, timeout=self.timeout,
+                          coalesce=False)
         try:
             r.raise_for_status()
         except requests.exceptions.HTTPError as e:
@@ -256,7 +576,7 @@ class LookerApi(object):
                              self.host,
                              project_id,
                              params)
-        r = self.session.get(url, timeout=self.timeout)
+        r = self._request('GET', url, timeout=self.timeout)
         try:
             r.raise_for_status()
         except requests.exceptions.HTTPError as e:
@@ -277,7 +597,8 @@ class LookerApi(object):
                              project_id,
                              test_id,
                              params)
-        r = self.session.get(url, timeout=self.timeout)
+        r = self._request('GET', url, timeout=self.timeout,
+                          coalesce=False)
         try:
             r.raise_for_status()
         except requests.exceptions.HTTPError as e:
@@ -294,7 +615,7 @@ class LookerApi(object):
         self.api_logger.info('Request to %s => GET /api/3.0/connections, %s',
                              self.host,
                              params)
-        r = self.session.get(url, timeout=self.timeout)
+        r = self._request('GET', url, timeout=self.timeout)
         try:
             r.raise_for_status()
         except requests.exceptions.HTTPError as e:
@@ -304,14 +625,18 @@ class LookerApi(object):
         return r.json()
 
 # PUT /connections/{connection_name}/test
-    def test_connection(self, connection, fields={}):
+    # timeout overrides the api timeout for this test. A test that times out
+    # raises requests.exceptions.Timeout rather than being retried
+    def test_connection(self, connection, fields={}, timeout=None):
         url = 'https://{}:{}/api/3.0/connections/{}/test'.format(self.host,
                                                                  self.port,
                                                                  connection)
         params = fields
         self.api_logger.info('Request to %s => POST /api/3.0/connections/'
                              '%s/test, %s', self.host, connection, params)
-        r = self.session.put(url, params=params, timeout=self.timeout)
+        r = self._request('PUT', url, params=params,
+                          timeout=timeout or self.timeout,
+                          retry_timeouts=timeout is None)
         try:
             r.raise_for_status()
         except requests.exceptions.HTTPError as e:
@@ -327,7 +652,7 @@ class LookerApi(object):
         params = fields
         self.api_logger.info('Request to %s => POST /api/3.0/legacy_features,'
                              ' %s', self.host, params)
-        r = self.session.get(url, timeout=self.timeout)
+        r = self._request('GET', url, timeout=self.timeout)
         try:
             r.raise_for_status()
         except requests.exceptions.HTTPError as e:
@@ -343,7 +668,7 @@ class LookerApi(object):
         self.api_logger.info('Request to %s => POST /api/3.0/integrations, %s',
                              self.host,
                              params)
-        r = self.session.get(url, timeout=self.timeout)
+        r = self._request('GET', url, timeout=self.timeout)
         try:
             r.raise_for_status()
         except requests.exceptions.HTTPError as e:
@@ -359,7 +684,7 @@ class LookerApi(object):
         self.api_logger.info('Request to %s => POST /api/3.0/versions, %s',
                              self.host,
                              params)
-        r = self.session.get(url, timeout=self.timeout)
+        r = self._request('GET', url, timeout=self.timeout)
         try:
             r.raise_for_status()
         except requests.exceptions.HTTPError as e:
@@ -0,0 +1,51 @@
+#!/usr/local/bin/python3
+# memo.py
+import threading
+
+
+class _Call(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+# coalesces identical calls: while a call for a key is in flight, callers
+# asking for the same key wait for it and share its result instead of
+# issuing their own. Results are kept for the lifetime of the object (one
+# run) unless the caller asks for them not to be retained
+class SingleFlight(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, fn, retain=True):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            if not retain or call.error is not None:
+                self.forget(key)
+            call.done.set()
+        return call.result
+
+    def forget(self, key):
+        with self.lock:
+            self.calls.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.calls.clear()
@@ -0,0 +1,288 @@
+#!/usr/local/bin/python3
+# profiler.py
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from array import array
+from contextlib import contextmanager, nullcontext
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+# path segments that follow these are names or ids, so they are replaced by
+# a placeholder to group calls per endpoint rather than per url
+PLACEHOLDERS = {'lookml_models': '{model}',
+                'explores': '{explore}',
+                'projects': '{project}',
+                'git_connection_tests': '{test_id}',
+                'connections': '{connection}',
+                'run': '{result_format}'}
+
+
+# 'GET lookml_models/{model}/explores/{explore}' for a GET of
+# https://host:port/api/3.0/lookml_models/a/explores/b
+def endpoint(method, url):
+    path = url.split('?', 1)[0].split('/api/3.0/', 1)[-1].strip('/')
+    parts = path.split('/')
+    for i in range(1, len(parts)):
+        placeholder = PLACEHOLDERS.get(parts[i - 1])
+        if placeholder is not None:
+            parts[i] = placeholder
+    return '%s %s' % (method, '/'.join(parts))
+
+
+# peak resident set size of the process so far in bytes, 0 if unknown
+def peak_rss():
+    if resource is None:
+        return 0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def _mb(size):
+    return round(size / 1048576.0, 1)
+
+
+# nearest rank percentile of sorted values
+def percentile(values, p):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+class _Endpoint(object):
+    __slots__ = ('calls', 'cache_hits', 'retries', 'errors', 'bytes',
+                 'latencies')
+
+    def __init__(self):
+        self.calls = 0
+        self.cache_hits = 0
+        self.retries = 0
+        self.errors = 0
+        self.bytes = 0
+        # seconds, one per request sent
+        self.latencies = array('d')
+
+
+# collects per endpoint request stats and phase timings for a run. It is
+# attached to the API clients (and read by the commands) as looker.profiler,
+# which is None unless the run is profiled. With memory, allocations are
+# traced with tracemalloc from then on and measured per phase as well.
+# Every method is safe to call from several threads
+class Profiler(object):
+    def __init__(self, memory=False):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.clock = time.perf_counter()
+        self.endpoints = {}
+        # {name: [count, total seconds, max seconds, bytes allocated,
+        #         traced peak, rss peak]}
+        self.phases = {}
+        self.memory = memory
+        if memory:
+            tracemalloc.start()
+
+    def _endpoint(self, method, url):
+        name = endpoint(method, url)
+        stats = self.endpoints.get(name)
+        if stats is None:
+            stats = self.endpoints[name] = _Endpoint()
+        return stats
+
+    # a request that was sent, retries and token renewals included. error
+    # is set for responses with an error status and for failed connections
+    def request(self, method, url, latency, nbytes=0, retry=False,
+                error=False):
+        with self.lock:
+            stats = self._endpoint(method, url)
+            stats.calls += 1
+            stats.bytes += nbytes
+            stats.retries += retry
+            stats.errors += error
+            stats.latencies.append(latency)
+
+    # bytes of a streamed response, read after request() recorded it
+    def received(self, method, url, nbytes):
+        with self.lock:
+            self._endpoint(method, url).bytes += nbytes
+
+    # a call answered from the metadata cache or shared with an identical
+    # call, without sending a request
+    def cache_hit(self, method, url):
+        with self.lock:
+            self._endpoint(method, url).cache_hits += 1
+
+    # the memory of a phase is what it left allocated and the peaks reached
+    # by its end. Phases running side by side share the process, so the
+    # peaks are high watermarks rather than the phase's own
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        if self.memory:
+            allocated = tracemalloc.get_traced_memory()[0]
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            if self.memory:
+                traced, traced_peak = tracemalloc.get_traced_memory()
+                rss_peak = peak_rss()
+            with self.lock:
+                stats = self.phases.setdefault(name, [0, 0.0, 0.0, 0, 0, 0])
+                stats[0] += 1
+                stats[1] += elapsed
+                stats[2] = max(stats[2], elapsed)
+                if self.memory:
+                    stats[3] += traced - allocated
+                    stats[4] = max(stats[4], traced_peak)
+                    stats[5] = max(stats[5], rss_peak)
+
+    # endpoint rows, the slowest in total first
+    def endpoint_rows(self):
+        with self.lock:
+            endpoints = list(self.endpoints.items())
+        rows = []
+        for name, stats in endpoints:
+            latencies = sorted(stats.latencies)
+            rows.append({'endpoint': name,
+                         'calls': stats.calls,
+                         'cache_hits': stats.cache_hits,
+                         'retries': stats.retries,
+                         'errors': stats.errors,
+                         'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+                         'p95_ms': round(percentile(latencies, 95) * 1000, 1),
+                         'max_ms': round(percentile(latencies, 100) * 1000,
+                                         1),
+                         'total_s': round(sum(latencies), 3),
+                         'bytes': stats.bytes})
+        return sorted(rows, key=lambda r: r['total_s'], reverse=True)
+
+    # phase rows in the order the phases first completed
+    def phase_rows(self):
+        with self.lock:
+            phases = list(self.phases.items())
+        return [{'phase': name,
+                 'count': stats[0],
+                 'total_s': round(stats[1], 3),
+                 'max_s': round(stats[2], 3)}
+                for name, stats in phases]
+
+    def memory_rows(self):
+        with self.lock:
+            phases = list(self.phases.items())
+        return [{'phase': name,
+                 'count': stats[0],
+                 'allocated_mb': _mb(stats[3]),
+                 'traced_peak_mb': _mb(stats[4]),
+                 'rss_peak_mb': _mb(stats[5])}
+                for name, stats in phases]
+
+    # the lines of code that allocated the most memory still in use, as
+    # traced since the profiler was created
+    def top_allocators(self, count=10):
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            tracemalloc.Filter(False,
+                               '<frozen importlib._bootstrap_external>'),
+            tracemalloc.Filter(False, '<unknown>')))
+        rows = []
+        for stat in snapshot.statistics('lineno')[:count]:
+            frame = stat.traceback[0]
+            path = os.sep.join(frame.filename.split(os.sep)[-2:]) \
+                or '<unknown>'
+            rows.append({'allocated_at': '%s:%s' % (path, frame.lineno),
+                         'blocks': stat.count,
+                         'size_kb': round(stat.size / 1024.0, 1)})
+        return rows
+
+    def to_json(self, command=None):
+        return {'command': command,
+                'started': self.started,
+                'elapsed_s': round(time.perf_counter() - self.clock, 3),
+                'endpoints': self.endpoint_rows(),
+                'phases': self.phase_rows(),
+                'memory': self._memory_json() if self.memory else None}
+
+    def _memory_json(self):
+        traced, traced_peak = tracemalloc.get_traced_memory()
+        return {'traced_mb': _mb(traced),
+                'traced_peak_mb': _mb(traced_peak),
+                'rss_peak_mb': _mb(peak_rss()),
+                'phases': self.memory_rows(),
+                'top_allocators': self.top_allocators()}
+
+    def report(self, command=None):
+        from tabulate import tabulate
+        elapsed = time.perf_counter() - self.clock
+        lines = ['Profile: %s, %.2fs' % (command or 'henry', elapsed)]
+        endpoints = self.endpoint_rows()
+        if endpoints:
+            lines.append(tabulate(endpoints, headers='keys', tablefmt='psql',
+                                  numalign='right'))
+        phases = self.phase_rows()
+        if phases:
+            lines.append(tabulate(phases, headers='keys', tablefmt='psql',
+                                  numalign='right'))
+        return '\n'.join(lines)
+
+    def memory_report(self, command=None):
+        from tabulate import tabulate
+        traced, traced_peak = tracemalloc.get_traced_memory()
+        lines = ['Memory: %s, %.1fMB traced (%.1fMB peak), %.1fMB peak rss'
+                 % (command or 'henry', _mb(traced), _mb(traced_peak),
+                    _mb(peak_rss()))]
+        phases = self.memory_rows()
+        if phases:
+            lines.append(tabulate(phases, headers='keys', tablefmt='psql',
+                                  numalign='right'))
+        lines.append(tabulate(self.top_allocators(), headers='keys',
+                              tablefmt='psql', numalign='right'))
+        return '\n'.join(lines)
+
+    # appends the profile to path as a line of JSON, so that the runs
+    # profiled to the same file can be compared over time
+    def dump(self, path, command=None):
+        with open(path, 'a') as f:
+            f.write(json.dumps(self.to_json(command)) + '\n')
+
+
+# times a phase of the run with profiler and traces it as a span with
+# tracer, either of which may be None
+def track(name, profiler=None, tracer=None):
+    if tracer is None:
+        return nullcontext() if profiler is None else profiler.phase(name)
+    if profiler is None:
+        return tracer.span(name)
+    return _track(name, profiler, tracer)
+
+
+@contextmanager
+def _track(name, profiler, tracer):
+    with profiler.phase(name), tracer.span(name):
+        yield
+
+
+# tracks a phase of the run with the profiler and tracer of looker
+def phase(looker, name):
+    return track(name, getattr(looker, 'profiler', None),
+                 getattr(looker, 'tracer', None))
+
+
+# decorates a method of an object with a looker attribute (a Fetcher, a
+# command) to track every call as the phase name when the run is profiled
+# or traced
+def timed(name):
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(self, *args, **kwargs):
+            with phase(self.looker, name):
+                return fn(self, *args, **kwargs)
+        return wrapper
+    return decorate
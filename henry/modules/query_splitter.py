@@ -0,0 +1,203 @@
+#!/usr/local/bin/python3
+# query_splitter.py
+import copy
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from .profiler import timed
+
+
+# runs i__looker history queries over a date range split into windows of
+# window_days days. Windows run concurrently and any window that comes back
+# with as many rows as the query limit (i.e. was truncated) is split in half
+# and run again. The partial results are merged by summing measures of rows
+# that share the same dimension values. Filters on measures (e.g. the
+# min_queries threshold) are passed as `having` and applied after the merge
+# since a per window threshold would undercount.
+class QuerySplitter(object):
+    def __init__(self, looker, workers=1, window_days=7, runner=None):
+        self.looker = looker
+        self.workers = max(1, workers or 1)
+        self.window_days = window_days
+        # optional QueryTaskRunner that runs each round of windows as
+        # async query tasks instead of concurrent inline queries
+        self.runner = runner
+        self.split_logger = logging.getLogger('query_splitter')
+
+    # the last timeframe days, today included, which is what the "N days"
+    # filter expression means in Looker
+    def timeframe_range(self, timeframe):
+        end = date.today()
+        return end - timedelta(days=max(timeframe, 1) - 1), end
+
+    def run_timeframe(self, body, timeframe, measures=(), having=None,
+                      fields={}):
+        start, end = self.timeframe_range(timeframe)
+        return self.run(body, start, end, measures, having, fields)
+
+    def run(self, body, start, end, measures=(), having=None, fields={}):
+        return self.run_many([(body, start, end, measures, having)],
+                             fields)[0]
+
+    # runs several (body, start, end, measures, having) queries at once so
+    # that all of their windows are in flight together. Returns the merged
+    # rows of each query, or None for a query that failed
+    @timed('run history queries')
+    def run_many(self, queries, fields={}):
+        windows = []
+        for idx, (body, start, end, measures, having) in enumerate(queries):
+            windows.extend((idx, w_start, w_end)
+                           for w_start, w_end in self._windows(start, end))
+        results = [[] for q in queries]
+        while windows:
+            bodies = [self._window_body(queries[idx][0], queries[idx][4],
+                                        w_start, w_end)
+                      for idx, w_start, w_end in windows]
+            if self.runner is not None:
+                responses = self.runner.run_all(bodies, fields)
+            else:
+                responses = self._map(
+                    lambda b: self.looker.run_inline_query("json", b,
+                                                           fields=fields),
+                    bodies)
+            truncated = []
+            for (idx, w_start, w_end), rows in zip(windows, responses):
+                limit = int(queries[idx][0]['limit'])
+                if results[idx] is None:
+                    continue
+                if rows is None:
+                    # the api client has already reported the error
+                    results[idx] = None
+                elif len(rows) < limit:
+                    results[idx].append(rows)
+                elif w_start == w_end:
+                    self.split_logger.warning('Results for %s hit the %s row '
+                                              'limit and cannot be split '
+                                              'further', w_start, limit)
+                    results[idx].append(rows)
+                else:
+                    half = w_start + (w_end - w_start) // 2
+                    self.split_logger.info('Results for %s to %s were '
+                                           'truncated, splitting window',
+                                           w_start, w_end)
+                    truncated.extend([(idx, w_start, half),
+                                      (idx, half + timedelta(days=1), w_end)])
+            windows = [w for w in truncated if results[w[0]] is not None]
+
+        merged = []
+        for (body, start, end, measures, having), rows in zip(queries,
+                                                              results):
+            if rows is None:
+                merged.append(None)
+                continue
+            rows = self._merge(rows, body['fields'], measures)
+            for measure, threshold in (having or {}).items():
+                rows = [r for r in rows if (r[measure] or 0) >= threshold]
+            merged.append(self._sort(rows, body.get('sorts', [])))
+        return merged
+
+    # streams the rows of every window of body into an aggregate made by
+    # new(), which must provide add(row) and update(other). Each window is
+    # aggregated on its own so that a truncated one can be dropped and
+    # split, and complete windows are folded into a single aggregate. Rows
+    # are never kept or merged, so `having` thresholds can't be applied.
+    # Returns None if a query failed
+    @timed('aggregate history')
+    def aggregate(self, body, start, end, new, fields={}):
+        limit = int(body['limit'])
+        total = new()
+        windows = self._windows(start, end)
+        while windows:
+            bodies = [self._window_body(body, None, w_start, w_end)
+                      for w_start, w_end in windows]
+            if self.runner is not None:
+                results = [self._fold(rows, new) for rows in
+                           self.runner.run_all(bodies, fields)]
+            else:
+                results = self._map(
+                    lambda b: self._fold(self.looker.run_inline_query(
+                        "json", b, fields=fields, stream=True), new),
+                    bodies)
+            truncated = []
+            for (w_start, w_end), result in zip(windows, results):
+                if result is None:
+                    # the api client has already reported the error
+                    return None
+                count, window_total = result
+                if count >= limit and w_start != w_end:
+                    half = w_start + (w_end - w_start) // 2
+                    self.split_logger.info('Results for %s to %s were '
+                                           'truncated, splitting window',
+                                           w_start, w_end)
+                    truncated.extend([(w_start, half),
+                                      (half + timedelta(days=1), w_end)])
+                    continue
+                if count >= limit:
+                    self.split_logger.warning('Results for %s hit the %s row '
+                                              'limit and cannot be split '
+                                              'further', w_start, limit)
+                total.update(window_total)
+            windows = truncated
+        return total
+
+    # returns (row count, aggregate of rows) or None for a failed query
+    @timed('aggregate window')
+    def _fold(self, rows, new):
+        if rows is None:
+            return None
+        window_total = new()
+        count = 0
+        for row in rows:
+            window_total.add(row)
+            count += 1
+        return count, window_total
+
+    def _windows(self, start, end):
+        if not self.window_days:
+            return [(start, end)]
+        windows = []
+        while start <= end:
+            w_end = min(start + timedelta(days=self.window_days - 1), end)
+            windows.append((start, w_end))
+            start = w_end + timedelta(days=1)
+        return windows
+
+    def _window_body(self, body, having, start, end):
+        body = copy.deepcopy(body)
+        for measure in having or {}:
+            body['filters'].pop(measure, None)
+        # looker date ranges exclude their end date
+        body['filters']['history.created_date'] = '{} to {}'.format(
+            start.strftime('%Y/%m/%d'),
+            (end + timedelta(days=1)).strftime('%Y/%m/%d'))
+        return body
+
+    def _map(self, fn, items):
+        if self.workers == 1 or len(items) < 2:
+            return [fn(i) for i in items]
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return list(executor.map(fn, items))
+
+    # rows with the same dimension values are combined by adding up their
+    # measures. Without measures this simply removes duplicate rows
+    @timed('merge windows')
+    def _merge(self, results, fields, measures):
+        dimensions = [f for f in fields if f not in measures]
+        merged = {}
+        for rows in results:
+            for row in rows:
+                key = tuple(str(row.get(d)) for d in dimensions)
+                if key not in merged:
+                    merged[key] = dict(row)
+                    continue
+                for measure in measures:
+                    merged[key][measure] = ((merged[key][measure] or 0)
+                                            + (row[measure] or 0))
+        return list(merged.values())
+
+    def _sort(self, rows, sorts):
+        for sort in reversed(sorts):
+            field, _, direction = sort.partition(' ')
+            rows.sort(key=lambda r: (r.get(field) is None, r.get(field)),
+                      reverse=direction.strip().lower() == 'desc')
+        return rows
@@ -0,0 +1,104 @@
+#!/usr/local/bin/python3
+# query_tasks.py
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# statuses after which a query task will not produce (more) results
+FAILED_STATUSES = ('error', 'killed', 'expired')
+# seconds to wait for a batch of query tasks by default
+TIMEOUT = 600
+# polls in a row that can fail before the pending tasks are given up on
+MAX_FAILED_POLLS = 5
+
+
+# runs queries as Looker async query tasks instead of blocking
+# /queries/run calls. All queries of a batch are submitted up front and
+# their results are collected with /query_tasks/multi_results as they
+# finish, so long running i__looker queries neither hold a connection open
+# nor run into the api_conn_timeout.
+class QueryTaskRunner(object):
+    def __init__(self, looker, workers=1, poll_interval=1, timeout=TIMEOUT,
+                 max_failed_polls=MAX_FAILED_POLLS):
+        self.looker = looker
+        # queries and their tasks are created on up to this many threads
+        self.workers = max(1, workers or 1)
+        self.poll_interval = poll_interval
+        # maximum seconds to wait for a batch, None waits indefinitely
+        self.timeout = timeout
+        self.max_failed_polls = max_failed_polls
+        self.task_logger = logging.getLogger('query_tasks')
+
+    # returns the json rows of each body in the same order as bodies. A
+    # query that fails returns None, as run_inline_query does
+    def run_all(self, bodies, fields={}):
+        results = [None] * len(bodies)
+        pending = {}
+        tasks = self._map(lambda body: self._submit(body, fields), bodies)
+        for idx, task in enumerate(tasks):
+            if task is not None:
+                pending[task['id']] = idx
+        self.task_logger.info('Submitted %s query tasks', len(pending))
+
+        started = time.time()
+        failed_polls = 0
+        while pending:
+            response = self.looker.get_query_task_multi_results(
+                           list(pending))
+            if response is None:
+                failed_polls += 1
+                if failed_polls >= self.max_failed_polls:
+                    self.task_logger.error('Polling query tasks failed %s '
+                                           'times in a row, giving up on '
+                                           '%s', failed_polls, list(pending))
+                    print('Error: could not get the results of %s query '
+                          'tasks' % len(pending))
+                    break
+                response = {}
+            else:
+                failed_polls = 0
+            for task_id, result in response.items():
+                if task_id not in pending:
+                    continue
+                status = result.get('status')
+                if status == 'complete':
+                    results[pending.pop(task_id)] = self._rows(result)
+                elif status in FAILED_STATUSES:
+                    self.task_logger.error('Query task %s finished with '
+                                           'status %s: %s', task_id, status,
+                                           result.get('data'))
+                    print('Error: query task %s %s' % (task_id, status))
+                    pending.pop(task_id)
+            if not pending:
+                break
+            if self.timeout is not None and \
+                    time.time() - started > self.timeout:
+                self.task_logger.error('Timed out waiting for query tasks '
+                                       '%s', list(pending))
+                print('Error: timed out waiting for %s query tasks'
+                      % len(pending))
+                break
+            time.sleep(self.poll_interval)
+        self.task_logger.info('Query tasks complete')
+        return results
+
+    # creates the query of body and a task running it, None if either fails
+    def _submit(self, body, fields={}):
+        query = self.looker.create_query(body)
+        if query is None:
+            return None
+        return self.looker.create_query_task(query['id'], 'json', fields)
+
+    def _map(self, fn, items):
+        if self.workers == 1 or len(items) < 2:
+            return [fn(i) for i in items]
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return list(executor.map(fn, items))
+
+    # json results can come back as the row list itself or wrapped in a
+    # dict alongside the query metadata
+    def _rows(self, result):
+        data = result.get('data')
+        if isinstance(data, dict) and 'data' in data:
+            data = data['data']
+        return data
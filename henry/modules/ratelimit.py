@@ -0,0 +1,90 @@
+#!/usr/local/bin/python3
+# ratelimit.py
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+# responses worth retrying: rate limiting and transient server errors
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+# whether a request that failed with status (None for a connection error or
+# timeout) may be sent again. Requests that aren't idempotent are only
+# retried when the server says it did no work: a 429, or a 503 with
+# Retry-After
+def retryable(status, retry_after=None, idempotent=True):
+    if status is not None and status not in RETRY_STATUSES:
+        return False
+    return idempotent or status == 429 or (status == 503 and
+                                           bool(retry_after))
+
+
+# seconds to wait before retry number attempt (0 based). Uses exponential
+# backoff with full jitter unless the server asked for a specific delay
+def retry_delay(attempt, retry_after=None, base=0.5, cap=30):
+    if retry_after is not None:
+        return min(retry_after, cap * 4)
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+# Retry-After can either be a number of seconds or an HTTP date
+def parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+# limits the number of requests in flight with an AIMD policy: the limit
+# grows by one for every window of successful requests and is halved when a
+# request fails or is slower than latency_target. Used as a context manager
+# around each request.
+class AdaptiveLimiter(object):
+    def __init__(self, max_limit, min_limit=1, latency_target=None,
+                 cooldown=1.0):
+        self.max_limit = max(1, max_limit or 1)
+        self.min_limit = min(min_limit, self.max_limit)
+        self.limit = float(self.max_limit)
+        self.latency_target = latency_target
+        # failures of requests that were already in flight when the limit
+        # was lowered shouldn't lower it again straight away
+        self.cooldown = cooldown
+        self.last_decrease = 0
+        self.in_flight = 0
+        self.condition = threading.Condition()
+
+    def __enter__(self):
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify()
+
+    def success(self, latency=None):
+        if self.latency_target is not None and latency is not None \
+                and latency > self.latency_target:
+            self.failure()
+            return
+        with self.condition:
+            if self.limit < self.max_limit:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+                self.condition.notify_all()
+
+    def failure(self):
+        with self.condition:
+            now = time.time()
+            if now - self.last_decrease >= self.cooldown:
+                self.limit = max(self.min_limit, self.limit / 2)
+                self.last_decrease = now
@@ -0,0 +1,109 @@
+#!/usr/local/bin/python3
+# shards.py
+import argparse
+import heapq
+import json
+import logging
+import time
+import zlib
+from . import writers
+
+shard_logger = logging.getLogger('shards')
+
+
+# argparse type of --shard: 'i/N' is the i-th of N shards, counting from 1
+def parse_shard(value):
+    try:
+        i, n = (int(v) for v in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError('shard must be i/N, e.g. 1/4')
+    if n < 1 or not 1 <= i <= n:
+        raise argparse.ArgumentTypeError('shard must be i/N with '
+                                         '1 <= i <= N')
+    return i, n
+
+
+# whether the model (or model.explore) named by names belongs to shard,
+# (i, N) as parsed by parse_shard. crc32 rather than hash() since it gives
+# the same partition in every process and on every machine
+def in_shard(shard, *names):
+    if shard is None:
+        return True
+    i, n = shard
+    return zlib.crc32('.'.join(names).encode('utf-8')) % n == i - 1
+
+
+# writes the (position, row) pairs of one shard as a line of JSON each,
+# after a header line describing the run, and returns how many were
+# written. Positions are those of the rows in an unsharded run and have to
+# increase
+def write_shard(out, header, rows):
+    out.write(json.dumps(dict(header, created=time.time())) + '\n')
+    return writers.write_rows(writers.NDJSONWriter(out),
+                              ({'position': position, 'row': row}
+                               for position, row in rows))
+
+
+def _open(path):
+    if path.endswith('.gz'):
+        # imported here since the cli imports this module at startup
+        import gzip
+        return gzip.open(path, 'rt')
+    return open(path)
+
+
+# the header of the shard files at paths, which must come from the same
+# command run with the same parameters, and all of their rows in the order
+# of an unsharded run. Unless partial, every shard of the run has to be
+# there
+def read_shards(paths, partial=False):
+    headers = []
+    for path in paths:
+        with _open(path) as f:
+            line = f.readline()
+        try:
+            header = json.loads(line)
+            i, n = header['shard']
+        except (ValueError, KeyError, TypeError):
+            raise ValueError('%s is not a henry shard file' % path)
+        headers.append((i, path, header))
+    headers.sort(key=lambda h: h[0])
+    first = headers[0][2]
+    key = ('host', 'command', 'params')
+    seen = set()
+    for i, path, header in headers:
+        if any(header.get(k) != first.get(k) for k in key) or \
+                header['shard'][1] != first['shard'][1]:
+            raise ValueError('%s comes from another run than %s'
+                             % (path, headers[0][1]))
+        if i in seen:
+            raise ValueError('Shard %s/%s was given twice'
+                             % (i, first['shard'][1]))
+        seen.add(i)
+    n = first['shard'][1]
+    missing = ['%s/%s' % (i, n) for i in range(1, n + 1) if i not in seen]
+    if missing:
+        message = 'Missing shards %s' % ', '.join(missing)
+        if not partial:
+            raise ValueError(message + ', pass --partial to merge '
+                                       'the others anyway')
+        shard_logger.warning(message)
+    shard_logger.info('Merging %s shards of %s', len(headers),
+                      first['command'])
+    return first, _rows([path for _, path, _ in headers])
+
+
+# the rows of every shard file, interleaved by position as they are read
+def _rows(paths):
+    entries = heapq.merge(*[_entries(path) for path in paths],
+                          key=lambda entry: entry['position'])
+    for entry in entries:
+        yield entry['row']
+
+
+def _entries(path):
+    with _open(path) as f:
+        # the first line is the header
+        next(f, None)
+        for line in f:
+            yield json.loads(line)
@@ -1,5 +1,7 @@
 #!/usr/local/bin/python3
 # styler.py
+import heapq
+import itertools
 import logging
 from tabulate import tabulate
 from operator import itemgetter
@@ -15,27 +17,68 @@ def limit(data, limit=None):
         return data
 
 
+# validates sortkey and returns the field to sort on and whether the sort
+# is descending
+def sort_order(valid_values, sortkey):
+    style_logger.info('Sort params=> %s', sortkey)
+    valid_types = {'ASC': False, 'DESC': True}
+    if sortkey[1].upper() in valid_types.keys():
+        type = valid_types[sortkey[1].upper()]
+    else:
+        type = None
+
+    sk = sortkey[0] if sortkey[0] in valid_values else False
+    if not sk:
+        style_logger.error('Sortkey:%s is invalid', sortkey[0])
+        raise ValueError('Unrecognised order_by field, must be in %r' %
+                         valid_values)
+    elif type is None:
+        style_logger.error('Sort type is invalid')
+        raise ValueError('Unrecognised order_by field, must be in %r' %
+                         list(valid_types.keys()))
+    return sk, type
+
+
 def sort(data, valid_values, sortkey):
     if sortkey is None:
         return data
     else:
-        style_logger.info('Sort params=> %s', sortkey)
-        valid_types = {'ASC': False, 'DESC': True}
-        if sortkey[1].upper() in valid_types.keys():
-            type = valid_types[sortkey[1].upper()]
-        else:
-            type = None
-
-        sk = sortkey[0] if sortkey[0] in valid_values else False
-        if not sk:
-            style_logger.error('Sortkey:%s is invalid', sortkey[0])
-            raise ValueError('Unrecognised order_by field, must be in %r' %
-                             valid_values)
-        elif type is None:
-            style_logger.error('Sort type is invalid')
-            raise ValueError('Unrecognised order_by field, must be in %r' %
-                             list(valid_types.keys()))
-        else:
-            style_logger.info('Sorting data by %s %s', sk, type)
-            data = sorted(data, key=itemgetter(sk), reverse=type)
+        sk, type = sort_order(valid_values, sortkey)
+        style_logger.info('Sorting data by %s %s', sk, type)
+        data = sorted(data, key=itemgetter(sk), reverse=type)
     return data
+
+
+# the first n rows of data sorted on key, kept in a heap of size n instead
+# of sorting every row. Same result as sorted(data, ...)[:n], ties included
+def nsorted(data, n, key, reverse=False):
+    if reverse:
+        return heapq.nlargest(n, data, key=key)
+    return heapq.nsmallest(n, data, key=key)
+
+
+# sort followed by limit
+def top(data, valid_values, sortkey, count=None):
+    if sortkey is None or count is None:
+        return limit(sort(data, valid_values, sortkey), limit=count)
+    sk, type = sort_order(valid_values, sortkey)
+    style_logger.info('Selecting the top %s rows by %s %s', count[0], sk,
+                      type)
+    return nsorted(data, count[0], itemgetter(sk), reverse=type)
+
+
+# sorts and limits rows as they stream through. Rows are passed on as they
+# come unless they have to be sorted, which needs all of them first (but
+# only keeps the top ones when limited)
+def stream(rows, sortkey=None, limit=None):
+    if sortkey is not None:
+        rows = iter(rows)
+        first = next(rows, None)
+        if first is None:
+            return []
+        rows = top(itertools.chain([first], rows), list(first.keys()),
+                   sortkey, limit)
+    elif limit is not None:
+        style_logger.info('Limiting results to %s', limit[0])
+        rows = itertools.islice(rows, limit[0])
+    return rows
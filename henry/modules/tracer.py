@@ -0,0 +1,90 @@
+#!/usr/local/bin/python3
+# tracer.py
+import itertools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# waits shorter than this (in seconds) are left out of the trace
+MIN_WAIT = 0.001
+
+
+# records the spans of a run as Chrome trace events, which chrome://tracing
+# and Perfetto show on a timeline per thread to see what overlapped and
+# where the run was waiting. Like the Profiler it is attached to the API
+# clients as looker.tracer, which is None unless the run is traced, so an
+# untraced run only pays for checking that attribute. Times are epoch
+# seconds as returned by time.time()
+class Tracer(object):
+    def __init__(self):
+        self.started = time.time()
+        self.pid = os.getpid()
+        # appending to a list is atomic, so spans are recorded from any
+        # thread without a lock
+        self.events = []
+        # {thread id: thread name}
+        self.threads = {}
+        # ids pairing the begin and end events of overlapping spans
+        self.ids = itertools.count(1)
+
+    def _tid(self):
+        thread = threading.current_thread()
+        if thread.ident not in self.threads:
+            self.threads[thread.ident] = thread.name
+        return thread.ident
+
+    def _ts(self, t):
+        return round((t - self.started) * 1e6, 1)
+
+    # a span from started to ended. Spans of a thread must nest, so spans
+    # that can overlap others of the same thread, e.g. requests sent from
+    # one event loop, are recorded as async events with their own track
+    def complete(self, name, started, ended=None, cat='phase', args=None,
+                 overlap=False):
+        if ended is None:
+            ended = time.time()
+        event = {'name': name, 'cat': cat, 'pid': self.pid,
+                 'tid': self._tid(), 'ts': self._ts(started)}
+        if args:
+            event['args'] = args
+        if not overlap:
+            event['ph'] = 'X'
+            event['dur'] = round((ended - started) * 1e6, 1)
+            self.events.append(event)
+            return
+        event['ph'] = 'b'
+        event['id'] = next(self.ids)
+        self.events.append(event)
+        self.events.append({'name': name, 'cat': cat, 'ph': 'e',
+                            'id': event['id'], 'pid': self.pid,
+                            'tid': event['tid'], 'ts': self._ts(ended)})
+
+    # a wait from started until ended (or now), left out if it was too
+    # short to matter
+    def wait(self, name, started, ended=None, args=None, overlap=False):
+        if ended is None:
+            ended = time.time()
+        if ended - started >= MIN_WAIT:
+            self.complete(name, started, ended, cat='wait', args=args,
+                          overlap=overlap)
+
+    @contextmanager
+    def span(self, name, cat='phase', args=None):
+        started = time.time()
+        try:
+            yield
+        finally:
+            self.complete(name, started, cat=cat, args=args)
+
+    def to_json(self):
+        threads = [{'name': 'thread_name', 'ph': 'M', 'pid': self.pid,
+                    'tid': tid, 'args': {'name': name}}
+                   for tid, name in list(self.threads.items())]
+        return {'traceEvents': threads + list(self.events),
+                'displayTimeUnit': 'ms'}
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_json(), f)
@@ -0,0 +1,62 @@
+#!/usr/local/bin/python3
+# usage.py
+import re
+
+
+# history columns that reference fields, and the view.field names in them
+FIELD_COLUMNS = ('query.formatted_fields', 'query.formatted_filters',
+                 'query.formatted_pivots', 'query.sorts')
+FIELD_PATTERN = re.compile(r'(\w+\.\w+)')
+
+
+# returns the view.field names referenced by an i__looker history row. A field
+# appears once for every place it is used (fields, filters, pivots, sorts)
+def row_fields(row):
+    return FIELD_PATTERN.findall('\n'.join([str(row[c])
+                                            for c in FIELD_COLUMNS]))
+
+
+# in-memory aggregate of i__looker usage over a timeframe. Built once per run
+# by Fetcher.get_usage_snapshot so that commands can compute used and unused
+# explores, joins and fields without issuing a history query per explore
+class UsageSnapshot(object):
+    def __init__(self, explores=None, fields=None):
+        # {model: {explore: query_run_count}}
+        self.explores = explores or {}
+        # {model: {explore: {view.field: count}}}
+        self.fields = fields or {}
+
+    # same shape as Fetcher.get_used_models: {model: query_run_count}. Model
+    # counts are the sum of their explores' counts, so they are only
+    # complete in a snapshot taken without a min_queries threshold
+    def used_models(self, min_queries=0):
+        used = {}
+        for m, explores in self.explores.items():
+            count = sum(explores.values())
+            if count >= min_queries:
+                used[m] = count
+        return used
+
+    # same shape as Fetcher.get_used_explores: {explore: query_run_count}.
+    # Without a model, usage of explores sharing a name is summed up
+    def used_explores(self, model=None, explore=None):
+        models = self.explores if model is None else [model]
+        used = {}
+        for m in models:
+            for e, count in self.explores.get(m, {}).items():
+                if explore is None or e == explore:
+                    used[e] = used.get(e, 0) + count
+        return used
+
+    # same shape as Fetcher.get_used_explore_fields: usage of the fields
+    # queried through any of explores (typically an explore's scopes), keyed
+    # on model.explore.view.field
+    def used_explore_fields(self, model, explores):
+        models = self.fields if model is None else [model]
+        used = {}
+        for m in models:
+            model_fields = self.fields.get(m, {})
+            for explore in set(explores):
+                for field, count in model_fields.get(explore, {}).items():
+                    used[m + '.' + explore + '.' + field] = count
+        return used
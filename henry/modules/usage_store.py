@@ -0,0 +1,207 @@
+#!/usr/local/bin/python3
+# usage_store.py
+import json
+import logging
+import os
+import sqlite3
+import threading
+from collections import Counter
+from datetime import date, timedelta
+from urllib.parse import quote
+from .usage import FIELD_COLUMNS, UsageSnapshot, row_fields
+
+# bumped whenever the tables change, which drops and re-syncs the store
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS explore_usage (
+    day TEXT NOT NULL,
+    model TEXT NOT NULL,
+    explore TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (day, model, explore)
+);
+CREATE TABLE IF NOT EXISTS query_usage (
+    day TEXT NOT NULL,
+    model TEXT NOT NULL,
+    explore TEXT NOT NULL,
+    query TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (day, model, explore, query)
+);
+CREATE TABLE IF NOT EXISTS sync_state (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+# local SQLite copy of i__looker history usage, aggregated per day. Only the
+# days since the previous sync are fetched from the instance, and any
+# timeframe/min_queries combination is then answered locally. Since days are
+# kept after they fall out of i__looker, timeframes can exceed 90 days.
+# Field usage is kept per query (its fields, filters, sorts and pivots) so
+# that min_queries applies to queries, as it does on i__looker.
+class UsageStore(object):
+    def __init__(self, host, path=None):
+        self.store_logger = logging.getLogger('usage_store')
+        if path is None:
+            directory = os.path.join(os.path.expanduser('~'), '.henry',
+                                     'usage')
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, quote(host, safe='') + '.db')
+        self.path = path
+        # usage is read from worker threads as well, so the connection is
+        # shared between threads and used by one at a time
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        version = self.db.execute('PRAGMA user_version').fetchone()[0]
+        if version != SCHEMA_VERSION:
+            self.store_logger.info('Resetting usage store %s', path)
+            self.db.executescript('DROP TABLE IF EXISTS explore_usage;'
+                                  'DROP TABLE IF EXISTS field_usage;'
+                                  'DROP TABLE IF EXISTS sync_state;')
+            self.db.execute('PRAGMA user_version = %s' % SCHEMA_VERSION)
+        self.db.executescript(SCHEMA)
+        self.synced = False
+
+    def _state(self, key):
+        row = self.db.execute('SELECT value FROM sync_state WHERE key = ?',
+                              (key,)).fetchone()
+        return date.fromisoformat(row[0]) if row else None
+
+    def _set_state(self, key, day):
+        self.db.execute('INSERT OR REPLACE INTO sync_state VALUES (?, ?)',
+                        (key, day.isoformat()))
+
+    # brings the store up to date and makes sure it covers the last
+    # timeframe days. Today is always re-fetched as it is still filling up
+    def sync(self, splitter, timeframe=90):
+        with self.lock:
+            self._sync(splitter, timeframe)
+
+    def _sync(self, splitter, timeframe):
+        today = date.today()
+        since = today - timedelta(days=max(timeframe, 1) - 1)
+        first_day = self._state('first_day')
+        last_day = self._state('last_day')
+        windows = []
+        if last_day is None:
+            windows.append((since, today))
+        else:
+            if since < first_day:
+                windows.append((since, first_day - timedelta(days=1)))
+            if not self.synced or last_day < today:
+                windows.append((last_day, today))
+        for start, end in windows:
+            self._sync_window(splitter, start, end)
+        with self.db:
+            self._set_state('first_day', min(since, first_day or since))
+            self._set_state('last_day', today)
+        self.synced = True
+
+    # splitter is a QuerySplitter, which sets the date range on the queries
+    def _sync_window(self, splitter, start, end):
+        self.store_logger.info('Syncing usage from %s to %s', start, end)
+        filters = {"query.model": "-i^_^_looker"}
+        explore_body = {
+            "model": "i__looker",
+            "view": "history",
+            "fields": ["history.created_date", "query.model", "query.view",
+                       "history.query_run_count"],
+            "filters": filters,
+            "limit": "50000"
+        }
+        field_body = {
+            "model": "i__looker",
+            "view": "history",
+            "fields": ["history.created_date", "query.model", "query.view",
+                       "query.formatted_fields",
+                       "query.formatted_filters", "query.sorts",
+                       "query.formatted_pivots",
+                       "history.query_run_count"],
+            "filters": filters,
+            "limit": "100000"
+        }
+        measures = ['history.query_run_count']
+        explore_rows, field_rows = splitter.run_many(
+            [(explore_body, start, end, measures, None),
+             (field_body, start, end, measures, None)])
+        if explore_rows is None or field_rows is None:
+            self.store_logger.error('Usage sync from %s to %s failed',
+                                    start, end)
+            raise Exception('Failed to sync the local usage store')
+
+        explores = Counter()
+        for r in explore_rows:
+            explores[(r['history.created_date'], r['query.model'],
+                      r['query.view'])] += int(r['history.query_run_count'])
+        queries = Counter()
+        for r in field_rows:
+            queries[(r['history.created_date'], r['query.model'],
+                     r['query.view'],
+                     json.dumps([r[c] for c in FIELD_COLUMNS]))] += \
+                int(r['history.query_run_count'])
+
+        with self.db:
+            for table in ('explore_usage', 'query_usage'):
+                self.db.execute('DELETE FROM %s WHERE day BETWEEN ? AND ?'
+                                % table, (start.isoformat(), end.isoformat()))
+            self.db.executemany('INSERT OR REPLACE INTO explore_usage VALUES '
+                                '(?, ?, ?, ?)',
+                                [k + (v,) for k, v in explores.items()])
+            self.db.executemany('INSERT OR REPLACE INTO query_usage VALUES '
+                                '(?, ?, ?, ?, ?)',
+                                [k + (v,) for k, v in queries.items()])
+        self.store_logger.info('Synced %s explore and %s query aggregates',
+                               len(explores), len(queries))
+
+    def _since(self, timeframe):
+        return (date.today() - timedelta(days=max(timeframe, 1) - 1)) \
+               .isoformat()
+
+    # same shape as Fetcher.get_used_models: {model: query_run_count}
+    def used_models(self, timeframe=90, min_queries=0):
+        with self.lock:
+            rows = self.db.execute('SELECT model, SUM(count) '
+                                   'FROM explore_usage WHERE day >= ? '
+                                   'GROUP BY model HAVING SUM(count) >= ?',
+                                   (self._since(timeframe), min_queries))
+            return dict(rows)
+
+    # same shape as Fetcher.get_used_explores: {explore: query_run_count}
+    def used_explores(self, model=None, explore=None, timeframe=90,
+                      min_queries=0):
+        usage = self.snapshot(model, timeframe, min_queries, fields=False)
+        return usage.used_explores(model, explore)
+
+    def snapshot(self, model=None, timeframe=90, min_queries=0, fields=True):
+        with self.lock:
+            return self._snapshot(model, timeframe, min_queries, fields)
+
+    def _snapshot(self, model, timeframe, min_queries, fields):
+        params = [self._since(timeframe)]
+        where = 'day >= ?'
+        if model is not None:
+            where += ' AND model = ?'
+            params.append(model)
+        explore_usage = {}
+        for m, e, count in self.db.execute(
+                'SELECT model, explore, SUM(count) FROM explore_usage '
+                'WHERE %s GROUP BY model, explore HAVING SUM(count) >= ?'
+                % where, params + [min_queries]):
+            explore_usage.setdefault(m, {})[e] = count
+        field_usage = {}
+        if fields:
+            # queries under the threshold are left out before their fields
+            # are counted, as they are on i__looker
+            for m, e, query, count in self.db.execute(
+                    'SELECT model, explore, query, SUM(count) '
+                    'FROM query_usage WHERE %s '
+                    'GROUP BY model, explore, query '
+                    'HAVING SUM(count) >= ?' % where, params + [min_queries]):
+                usage = field_usage.setdefault(m, {}).setdefault(e, Counter())
+                row = dict(zip(FIELD_COLUMNS, json.loads(query)))
+                for field in row_fields(row):
+                    usage[field] += count
+        return UsageSnapshot(explores=explore_usage, fields=field_usage)
@@ -0,0 +1,200 @@
+#!/usr/local/bin/python3
+# writers.py
+import csv
+import json
+import logging
+import sys
+
+writer_logger = logging.getLogger('writers')
+
+# string columns are padded to at least this width so that most names line
+# up without knowing every row in advance
+MIN_WIDTH = 20
+# rows held back before the table starts so that column widths fit them
+BUFFER_ROWS = 50
+
+
+# writes rows as a fixed width table as they come, one line per row (more
+# for multi line cells). Column widths are set by the header and the first
+# BUFFER_ROWS rows, and longer values in later rows are wrapped onto more
+# lines so the grid stays aligned. Numbers are centered as in the tabulated
+# output and plain drops the header and the grid lines like tabulate's
+# plain format, leaving longer values as they are
+class TableWriter(object):
+    def __init__(self, out, plain=False, buffer_rows=BUFFER_ROWS):
+        self.out = out
+        self.plain = plain
+        self.buffer_rows = buffer_rows
+        self.buffer = []
+        self.columns = None
+        self.widths = None
+        self.numeric = None
+
+    def _rule(self):
+        return '+' + '+'.join('-' * (w + 2) for w in self.widths) + '+'
+
+    def _line(self, cells):
+        if self.plain:
+            return '  '.join(cells).rstrip()
+        return '| ' + ' | '.join(cells) + ' |'
+
+    # the lines of value, split further to fit width unless plain
+    def _wrap(self, value, width):
+        lines = value.split('\n')
+        if self.plain:
+            return lines
+        return [line[i:i + width] for line in lines
+                for i in range(0, max(len(line), 1), width)]
+
+    def _lines(self, values):
+        values = [self._wrap(v, w) for v, w in zip(values, self.widths)]
+        for i in range(max(len(v) for v in values)):
+            cells = []
+            for v, w, numeric in zip(values, self.widths, self.numeric):
+                cell = v[i] if i < len(v) else ''
+                cells.append(cell.center(w) if numeric else cell.ljust(w))
+            yield self._line(cells)
+
+    def _cell(self, value):
+        if value is None:
+            return ''
+        return str(value)
+
+    def _width(self, column, rows):
+        first = rows[0].get(column)
+        cells = [len(line) for row in rows
+                 for line in self._cell(row.get(column)).split('\n')]
+        return max([len(column), MIN_WIDTH if isinstance(first, str) else 0]
+                   + cells)
+
+    # sets the columns and their widths from the rows buffered so far and
+    # writes the header and those rows
+    def _start(self):
+        rows, self.buffer = self.buffer, []
+        self.columns = list(rows[0].keys())
+        self.widths = [self._width(c, rows) for c in self.columns]
+        self.numeric = [isinstance(v, (int, float))
+                        and not isinstance(v, bool)
+                        for v in rows[0].values()]
+        if not self.plain:
+            self.out.write(self._rule() + '\n')
+            self.out.write(self._line([c.ljust(w) for c, w in
+                                       zip(self.columns, self.widths)])
+                           + '\n')
+            self.out.write(self._rule() + '\n')
+        for row in rows:
+            self._write(row)
+
+    def _write(self, row):
+        for line in self._lines([self._cell(row.get(c))
+                                 for c in self.columns]):
+            self.out.write(line + '\n')
+
+    def write(self, row):
+        if self.columns is not None:
+            self._write(row)
+            return
+        self.buffer.append(row)
+        if len(self.buffer) >= self.buffer_rows:
+            self._start()
+
+    def close(self):
+        if self.buffer:
+            self._start()
+        if self.columns is not None and not self.plain:
+            self.out.write(self._rule() + '\n')
+        self.out.flush()
+
+
+# writes every row as a json object on its own line
+class NDJSONWriter(object):
+    def __init__(self, out):
+        self.out = out
+
+    def write(self, row):
+        self.out.write(json.dumps(row) + '\n')
+
+    def close(self):
+        self.out.flush()
+
+
+# writes rows as one json array, an element at a time
+class JSONWriter(object):
+    def __init__(self, out):
+        self.out = out
+        self.count = 0
+
+    def write(self, row):
+        self.out.write(('[\n' if not self.count else ',\n')
+                       + json.dumps(row))
+        self.count += 1
+
+    def close(self):
+        self.out.write('[]\n' if not self.count else '\n]\n')
+        self.out.flush()
+
+
+# writes rows as csv, or tsv with a tab delimiter. The header comes from the
+# first row and is left out when plain
+class DelimitedWriter(object):
+    def __init__(self, out, delimiter=',', plain=False):
+        self.out = out
+        self.delimiter = delimiter
+        self.plain = plain
+        self.writer = None
+
+    def write(self, row):
+        if self.writer is None:
+            self.writer = csv.DictWriter(self.out, fieldnames=list(row),
+                                         delimiter=self.delimiter,
+                                         lineterminator='\n')
+            if not self.plain:
+                self.writer.writeheader()
+        self.writer.writerow(row)
+
+    def close(self):
+        self.out.flush()
+
+
+FORMATS = ['table', 'json', 'ndjson', 'csv', 'tsv']
+
+
+def get_writer(format, out, plain=False):
+    if format == 'json':
+        return JSONWriter(out)
+    elif format == 'ndjson':
+        return NDJSONWriter(out)
+    elif format == 'csv':
+        return DelimitedWriter(out, ',', plain=plain)
+    elif format == 'tsv':
+        return DelimitedWriter(out, '\t', plain=plain)
+    return TableWriter(out, plain=plain)
+
+
+# opens path for writing text: '-' is stdout and paths ending in .gz are
+# gzip compressed
+def open_output(path):
+    if path == '-':
+        return sys.stdout
+    elif path.endswith('.gz'):
+        # imported here since the cli imports this module at startup
+        import gzip
+        return gzip.open(path, 'wt')
+    return open(path, 'w')
+
+
+# writes rows with writer as they are produced and returns how many were
+# written. flush pushes every row out right away, e.g. to a reader on the
+# other end of a pipe
+def write_rows(writer, rows, flush=False):
+    count = 0
+    try:
+        for row in rows:
+            writer.write(row)
+            if flush:
+                writer.out.flush()
+            count += 1
+    finally:
+        writer.close()
+    writer_logger.info('Wrote %s rows', count)
+    return count
@@ -12,7 +12,7 @@ DESCRIPTION = 'A Looker Cleanup Tool'
 URL = "https://github.com/josephaxisa/henry"
 EMAIL = 'jax@looker.com'
 AUTHOR = 'Joseph Axisa'
-REQUIRES_PYTHON = '>=3.6.0'
+REQUIRES_PYTHON = '>=3.7.0'
 VERSION = ''
 
 # What packages are required for this module to be executed?
@@ -23,6 +23,7 @@ REQUIRED = [
 # What packages are optional?
 EXTRAS = {
     # 'fancy feature': ['django'],
+    'async': ['aiohttp'],
 }
 
 here = os.path.abspath(os.path.dirname(__file__))
@@ -105,7 +106,6 @@ setup(
         'License :: OSI Approved :: MIT License',
         'Programming Language :: Python',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.6',
         'Programming Language :: Python :: 3.7',
     ],
     cmdclass={
@@ -0,0 +1,70 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+import pytest
+from benchmarks import instance as synthetic
+from benchmarks.fake_looker import FakeLooker, Handler
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLI = os.path.join(ROOT, 'henry', 'cli.py')
+
+
+# drops the connection instead of answering explore requests once
+# server.explores_left is down to 0, as a network failure part way
+# through a run would
+class FailingHandler(Handler):
+    def handle_explore(self, model, explore):
+        with self.server.lock:
+            left = self.server.explores_left
+            if left is not None:
+                self.server.explores_left = left - 1
+        if left is not None and left <= 0:
+            raise ConnectionAbortedError('explore request dropped')
+        return super(FailingHandler, self).handle_explore(model, explore)
+
+
+# a fake Looker instance served for the whole test session
+@pytest.fixture(scope='session')
+def fake_looker():
+    server = FakeLooker(synthetic.generate(**synthetic.SCALES['small']))
+    server.RequestHandlerClass = FailingHandler
+    server.explores_left = None
+    # dropped requests are expected, so they aren't printed
+    server.handle_error = lambda request, address: None
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+# runs the henry cli against fake_looker from a directory of its own, which
+# is also its home so that journals, caches and logs stay there. Returns
+# the completed process. merge only reads files, so it gets no port
+@pytest.fixture
+def henry(fake_looker, tmp_path):
+    with open(str(tmp_path / 'settings.json'), 'w') as f:
+        json.dump({'host': 'localhost', 'client_id': 'id',
+                   'client_secret': 'secret', 'api_max_retries': 0}, f)
+    env = dict(os.environ, HOME=str(tmp_path), PYTHONHASHSEED='0',
+               PYTHONPATH=os.pathsep.join([ROOT,
+                                           os.path.join(ROOT, 'henry')]))
+    for name in ('REQUESTS_CA_BUNDLE', 'CURL_CA_BUNDLE'):
+        env.pop(name, None)
+
+    def run(*args):
+        args = list(args)
+        if args[0] != 'merge':
+            args += ['--port', str(fake_looker.port)]
+        return subprocess.run([sys.executable, CLI] + args,
+                              cwd=str(tmp_path), env=env,
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                              universal_newlines=True, timeout=120)
+    return run
+
+
+# the rows of ndjson output
+def rows(output):
+    return [json.loads(line) for line in output.splitlines()]
@@ -0,0 +1,70 @@
+from collections import Counter
+from henry.modules import aggregator
+from henry.modules.aggregator import FieldAggregator
+from henry.modules.usage import row_fields
+
+
+def row(explore, fields, count, model='model', filters=None, sorts=None,
+        pivots=None):
+    return {'query.model': model, 'query.view': explore,
+            'query.formatted_fields': fields,
+            'query.formatted_filters': filters, 'query.sorts': sorts,
+            'query.formatted_pivots': pivots,
+            'history.query_run_count': count}
+
+
+ROWS = [row('explore_a', '["view.a", "view.b"]', 3),
+        row('explore_a', '["view.a"]', 2, filters='{"view.c": "> 1"}'),
+        row('explore_a', '["view.a"]', 1, sorts='["view.a desc"]'),
+        row('explore_b', '["view.a"]', 4, pivots='["view.d"]'),
+        row('explore_a', '["view.a", "view.b"]', '5', model='other')]
+
+
+# what the aggregator replaces: a counter keyed on every field reference
+def counted(rows):
+    usage = Counter()
+    for r in rows:
+        for field in row_fields(r):
+            usage['%s.%s.%s' % (r['query.model'], r['query.view'],
+                                field)] += int(r['history.query_run_count'])
+    return usage
+
+
+def aggregate(rows):
+    usage = FieldAggregator()
+    for r in rows:
+        usage.add(r)
+    return usage
+
+
+def test_counts_match_counting_every_row():
+    assert aggregate(ROWS).scoped() == dict(counted(ROWS))
+
+
+def test_fields_used_in_several_places_count_for_each():
+    usage = aggregate([row('e', '["view.a"]', 2, filters='{"view.a": "1"}',
+                           sorts='["view.a"]')])
+    assert usage.scoped() == {'model.e.view.a': 6}
+
+
+def test_usage_is_grouped_by_model_and_explore():
+    usage = aggregate(ROWS).usage
+    assert usage['model']['explore_a'] == Counter(
+        {'view.a': 7, 'view.b': 3, 'view.c': 2})
+    assert usage['model']['explore_b'] == Counter({'view.a': 4,
+                                                   'view.d': 4})
+    assert usage['other']['explore_a'] == Counter({'view.a': 5,
+                                                   'view.b': 5})
+
+
+def test_update_adds_up_aggregates():
+    usage = aggregate(ROWS[:2])
+    usage.update(aggregate(ROWS[2:]))
+    assert usage.scoped() == dict(counted(ROWS))
+
+
+def test_parse_cache_is_dropped_once_full(monkeypatch):
+    monkeypatch.setattr(aggregator, 'PARSE_CACHE_SIZE', 2)
+    usage = aggregate(ROWS * 3)
+    assert len(usage.parsed) <= 2
+    assert usage.scoped() == dict(counted(ROWS * 3))
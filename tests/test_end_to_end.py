@@ -0,0 +1,56 @@
+import pytest
+from .conftest import rows
+
+# commands that go explore by explore and keep a journal
+JOURNALED = ['analyze explores', 'analyze fields', 'vacuum explores',
+             'vacuum fields']
+
+
+@pytest.mark.parametrize('command', JOURNALED)
+def test_resumed_run_equals_an_uninterrupted_one(henry, fake_looker,
+                                                 command):
+    args = command.split() + ['--no_cache', '--format', 'ndjson']
+    complete = henry(*args)
+    assert complete.returncode == 0, complete.stderr
+    explores = fake_looker.requests['explore']
+
+    fake_looker.explores_left = 3
+    try:
+        interrupted = henry(*args)
+    finally:
+        fake_looker.explores_left = None
+    assert interrupted.returncode != 0
+    assert 'Progress saved: 3 explores done' in interrupted.stderr
+
+    before = fake_looker.requests['explore']
+    resumed = henry(*args + ['--resume'])
+    assert resumed.returncode == 0, resumed.stderr
+    assert 'Resuming run' in resumed.stderr
+    assert fake_looker.requests['explore'] - before < explores
+    assert rows(resumed.stdout) == rows(complete.stdout)
+
+
+def test_completed_runs_leave_nothing_to_resume(henry):
+    args = ['analyze', 'explores', '--no_cache', '--format', 'ndjson']
+    assert henry(*args).returncode == 0
+    resumed = henry(*args + ['--resume'])
+    assert 'Resuming run' not in resumed.stderr
+
+
+@pytest.mark.parametrize('command', ['analyze models', 'analyze explores',
+                                     'analyze fields', 'vacuum models',
+                                     'vacuum explores', 'vacuum fields'])
+def test_merged_shards_equal_an_unsharded_run(henry, tmp_path, command):
+    args = command.split() + ['--no_cache', '--format', 'ndjson']
+    unsharded = henry(*args)
+    assert unsharded.returncode == 0, unsharded.stderr
+    assert rows(unsharded.stdout)
+
+    paths = []
+    for i in (1, 2, 3):
+        paths.append(str(tmp_path / ('s%s.ndjson' % i)))
+        shard = henry(*args + ['--shard', '%s/3' % i, '--output', paths[-1]])
+        assert shard.returncode == 0, shard.stderr
+    merged = henry('merge', *paths + ['--format', 'ndjson'])
+    assert merged.returncode == 0, merged.stderr
+    assert rows(merged.stdout) == rows(unsharded.stdout)
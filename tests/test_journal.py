@@ -0,0 +1,71 @@
+import os
+from henry.modules.journal import Journal
+
+PARAMS = {'model': None, 'explore': None, 'timeframe': 90, 'min_queries': 0}
+
+
+def journal(tmp_path, resume=False, params=PARAMS):
+    return Journal('host', 'analyze explores', params, resume=resume,
+                   path=str(tmp_path))
+
+
+def test_run_ids_depend_on_the_run(tmp_path):
+    assert journal(tmp_path).run_id == journal(tmp_path).run_id
+    other = dict(PARAMS, timeframe=30)
+    assert journal(tmp_path).run_id != journal(tmp_path,
+                                               params=other).run_id
+
+
+def test_resume_reads_back_recorded_rows(tmp_path):
+    j = journal(tmp_path)
+    j.record('model', 'explore_a', {'explore': 'explore_a', 'count': 1})
+    j.record('model', 'explore_b', {'explore': 'explore_b', 'count': 2})
+    j.close()
+    resumed = journal(tmp_path, resume=True)
+    assert len(resumed) == 2
+    assert ('model', 'explore_a') in resumed
+    assert ['model', 'explore_b'] in resumed
+    assert resumed.get(('model', 'explore_b')) == {'explore': 'explore_b',
+                                                   'count': 2}
+    assert ('model', 'explore_c') not in resumed
+
+
+def test_rows_recorded_after_resuming_are_kept(tmp_path):
+    j = journal(tmp_path)
+    j.record('model', 'explore_a', 1)
+    j.close()
+    j = journal(tmp_path, resume=True)
+    j.record('model', 'explore_b', 2)
+    j.close()
+    assert len(journal(tmp_path, resume=True)) == 2
+
+
+def test_a_line_cut_short_is_ignored(tmp_path):
+    j = journal(tmp_path)
+    j.record('model', 'explore_a', 1)
+    j.file.write('{"model": "model", "explore": "expl')
+    j.close()
+    assert len(journal(tmp_path, resume=True)) == 1
+
+
+def test_starting_over_drops_recorded_rows(tmp_path):
+    j = journal(tmp_path)
+    j.record('model', 'explore_a', 1)
+    j.close()
+    assert len(journal(tmp_path)) == 0
+    assert len(journal(tmp_path, resume=True)) == 0
+
+
+def test_resuming_without_a_journal_starts_afresh(tmp_path):
+    j = journal(tmp_path, resume=True)
+    assert len(j) == 0
+    j.record('model', 'explore_a', 1)
+    j.close()
+    assert len(journal(tmp_path, resume=True)) == 1
+
+
+def test_remove_deletes_the_run(tmp_path):
+    j = journal(tmp_path / 'run')
+    j.record('model', 'explore_a', 1)
+    j.remove()
+    assert not os.path.exists(str(tmp_path / 'run'))
@@ -0,0 +1,43 @@
+import json
+import pytest
+from henry.modules.jsonstream import iter_json_array
+
+ROWS = [{'query.view': 'explore_a', 'history.query_run_count': 12},
+        {'query.view': 'café', 'history.query_run_count': 3.5},
+        {'query.formatted_fields': '["view.field"]', 'nested': [1, [2]]},
+        None, True, 'text, with ] and [', 123456789]
+
+
+def chunked(text, size):
+    data = text.encode('utf-8')
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 7, 64, 100000])
+def test_rows_are_decoded_across_chunk_boundaries(size):
+    text = json.dumps(ROWS, indent=1)
+    assert list(iter_json_array(chunked(text, size))) == ROWS
+
+
+@pytest.mark.parametrize('text', ['[]', ' [ ] ', '[\n]\n'])
+def test_empty_arrays(text):
+    assert list(iter_json_array(chunked(text, 1))) == []
+
+
+def test_number_cut_short_by_the_end_of_a_chunk():
+    assert list(iter_json_array([b'[1, 2', b'3]'])) == [1, 23]
+    assert list(iter_json_array([b'[12', b'34', b'5]'])) == [12345]
+
+
+def test_rows_are_yielded_as_they_arrive():
+    def chunks():
+        yield b'[{"a": 1},'
+        raise AssertionError('read ahead of the first row')
+    assert next(iter_json_array(chunks())) == {'a': 1}
+
+
+@pytest.mark.parametrize('text', ['{"a": 1}', '[1 2]', '[1,', '[1,]',
+                                  '[{"a": 1}', ''])
+def test_invalid_arrays_raise(text):
+    with pytest.raises(ValueError):
+        list(iter_json_array(chunked(text, 2)))
@@ -0,0 +1,81 @@
+import logging
+import pytest
+import requests
+from henry.modules import lookerapi
+from henry.modules.lookerapi import LookerApi
+from henry.modules.memo import SingleFlight
+from henry.modules.ratelimit import AdaptiveLimiter
+
+
+class Response(object):
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+# answers requests with the responses (or raises the errors) given, in order
+class Session(object):
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.sent = 0
+
+    def request(self, method, url, **kwargs):
+        self.sent += 1
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+# a LookerApi that doesn't log in, sending requests through session
+def api(responses):
+    looker = LookerApi.__new__(LookerApi)
+    looker.api_logger = logging.getLogger('lookerapi')
+    looker.access_token = 'token'
+    looker.secret = None
+    looker.max_retries = 3
+    looker.limiter = AdaptiveLimiter(1)
+    looker.memo = SingleFlight()
+    looker.profiler = None
+    looker.tracer = None
+    looker.session = Session(responses)
+    return looker
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(lookerapi, 'retry_delay', lambda *args: 0)
+
+
+def test_gets_are_retried_on_errors_and_5xx():
+    looker = api([requests.exceptions.ConnectionError(), Response(502),
+                  Response(200)])
+    assert looker._send('GET', 'url').status_code == 200
+    assert looker.session.sent == 3
+
+
+def test_retries_stop_after_max_retries():
+    looker = api([Response(500)] * 10)
+    assert looker._send('GET', 'url').status_code == 500
+    assert looker.session.sent == 4
+
+
+def test_posts_are_not_retried_after_timeouts_or_5xx():
+    looker = api([Response(500), Response(200)])
+    assert looker._send('POST', 'url').status_code == 500
+    looker = api([requests.exceptions.Timeout(), Response(200)])
+    with pytest.raises(requests.exceptions.Timeout):
+        looker._send('POST', 'url')
+    assert looker.session.sent == 1
+
+
+def test_posts_are_retried_when_the_server_did_no_work():
+    looker = api([Response(429), Response(503, {'Retry-After': '0'}),
+                  Response(200)])
+    assert looker._send('POST', 'url').status_code == 200
+    assert looker.session.sent == 3
+
+
+def test_idempotent_posts_can_opt_in_to_retries():
+    looker = api([Response(500), Response(200)])
+    assert looker._send('POST', 'url', retry=True).status_code == 200
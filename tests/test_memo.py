@@ -0,0 +1,91 @@
+import threading
+import time
+import pytest
+from henry.modules.memo import SingleFlight
+
+
+def test_results_are_kept_for_the_run():
+    memo = SingleFlight()
+    calls = []
+    assert memo.do('key', lambda: calls.append(1) or 'a') == 'a'
+    assert memo.do('key', lambda: calls.append(1) or 'b') == 'a'
+    assert len(calls) == 1
+
+
+def test_results_not_retained_are_forgotten_once_done():
+    memo = SingleFlight()
+    assert memo.do('key', lambda: 'a', retain=False) == 'a'
+    assert memo.do('key', lambda: 'b', retain=False) == 'b'
+
+
+def test_forget_and_clear_drop_results():
+    memo = SingleFlight()
+    memo.do('a', lambda: 1)
+    memo.do('b', lambda: 1)
+    memo.forget('a')
+    assert memo.do('a', lambda: 2) == 2
+    memo.clear()
+    assert memo.do('b', lambda: 2) == 2
+
+
+def test_concurrent_calls_share_the_one_in_flight():
+    memo = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        started.set()
+        release.wait()
+        return 'a'
+    results = []
+    leader = threading.Thread(target=lambda: results.append(
+                                  memo.do('key', fn, retain=False)))
+    leader.start()
+    started.wait()
+    followers = [threading.Thread(target=lambda: results.append(
+                                      memo.do('key', fn, retain=False)))
+                 for i in range(4)]
+    for t in followers:
+        t.start()
+    # gives the followers time to find the call in flight
+    time.sleep(0.1)
+    release.set()
+    for t in [leader] + followers:
+        t.join()
+    assert results == ['a'] * 5
+    assert len(calls) == 1
+
+
+def test_errors_reach_every_caller_and_are_not_kept():
+    memo = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+
+    def fail():
+        started.set()
+        release.wait()
+        raise ValueError('failed')
+    errors = []
+
+    def call():
+        try:
+            memo.do('key', fail)
+        except ValueError as e:
+            errors.append(e)
+    threads = [threading.Thread(target=call)]
+    threads[0].start()
+    started.wait()
+    threads.append(threading.Thread(target=call))
+    threads[1].start()
+    release.set()
+    for t in threads:
+        t.join()
+    assert len(errors) == 2
+    assert memo.do('key', lambda: 'a') == 'a'
+
+
+def test_errors_are_raised_to_the_caller():
+    with pytest.raises(KeyError):
+        SingleFlight().do('key', lambda: {}['missing'])
@@ -0,0 +1,158 @@
+from datetime import date, datetime, timedelta
+from henry.modules.aggregator import FieldAggregator
+from henry.modules.query_splitter import QuerySplitter
+
+START = date(2019, 1, 1)
+END = date(2019, 1, 30)
+
+
+# answers history queries from (day, model, explore, fields, count) records
+# as i__looker would: rows are grouped on the query's dimensions within its
+# date range, measure filters apply to the groups and at most limit rows
+# come back
+class StubLooker(object):
+    def __init__(self, history):
+        self.history = history
+        self.bodies = []
+        self.fail = False
+
+    def run_inline_query(self, result_format, body, fields={}, stream=False):
+        self.bodies.append(body)
+        if self.fail:
+            return None
+        start, end = [datetime.strptime(d, '%Y/%m/%d').date() for d in
+                      body['filters']['history.created_date'].split(' to ')]
+        threshold = int(body['filters'].get('history.query_run_count',
+                                            '>=0')[2:])
+        dimensions = [f for f in body['fields']
+                      if f != 'history.query_run_count']
+        groups = {}
+        for day, model, explore, used, count in self.history:
+            if not start <= day < end:
+                continue
+            row = {'query.model': model, 'query.view': explore,
+                   'query.formatted_fields': used,
+                   'query.formatted_filters': None, 'query.sorts': None,
+                   'query.formatted_pivots': None}
+            key = tuple(row[d] for d in dimensions)
+            group = groups.setdefault(key, dict(
+                {d: row[d] for d in dimensions},
+                **{'history.query_run_count': 0}))
+            group['history.query_run_count'] += count
+        rows = [r for r in groups.values()
+                if r['history.query_run_count'] >= threshold]
+        return rows[:int(body['limit'])]
+
+
+def history():
+    records = []
+    for i in range(30):
+        day = START + timedelta(days=i)
+        for e in range(4):
+            records.append((day, 'model', 'explore_%s' % e,
+                            '["view.field_%s"]' % (i % 3), e + 1))
+    return records
+
+
+def body(fields, limit=50000, min_queries=0):
+    return {'model': 'i__looker', 'view': 'history',
+            'fields': fields + ['history.query_run_count'],
+            'filters': {'history.query_run_count': '>=%s' % min_queries},
+            'limit': str(limit)}
+
+
+def totals(rows, key):
+    return {r[key]: r['history.query_run_count'] for r in rows}
+
+
+def test_windows_cover_the_range_without_overlap():
+    windows = QuerySplitter(None, window_days=7)._windows(START, END)
+    assert windows[0] == (START, START + timedelta(days=6))
+    assert windows[-1] == (date(2019, 1, 29), END)
+    for (_, end), (start, _) in zip(windows, windows[1:]):
+        assert start == end + timedelta(days=1)
+
+
+def test_no_window_days_runs_a_single_window():
+    assert QuerySplitter(None, window_days=0)._windows(START, END) == \
+        [(START, END)]
+
+
+def test_windows_are_merged_by_summing_measures():
+    looker = StubLooker(history())
+    splitter = QuerySplitter(looker, window_days=7)
+    rows = splitter.run(body(['query.view']), START, END,
+                        measures=['history.query_run_count'])
+    assert len(looker.bodies) == 5
+    assert totals(rows, 'query.view') == {'explore_%s' % e: 30 * (e + 1)
+                                          for e in range(4)}
+
+
+def test_window_bodies_exclude_their_end_date():
+    looker = StubLooker(history())
+    QuerySplitter(looker, window_days=7).run(body(['query.view']), START,
+                                             END)
+    assert looker.bodies[0]['filters']['history.created_date'] == \
+        '2019/01/01 to 2019/01/08'
+
+
+def test_truncated_windows_are_split_until_complete():
+    looker = StubLooker(history())
+    splitter = QuerySplitter(looker, window_days=0)
+    # every day has 4 explore/field rows, so only single days fit
+    rows = splitter.run(body(['query.view', 'query.formatted_fields'],
+                             limit=5),
+                        START, END, measures=['history.query_run_count'])
+    assert len(looker.bodies) > 1
+    assert sum(r['history.query_run_count'] for r in rows) == \
+        sum(r[4] for r in history())
+
+
+def test_having_is_applied_after_the_merge():
+    looker = StubLooker(history())
+    splitter = QuerySplitter(looker, window_days=1)
+    # no explore reaches 70 queries in a single day, but two do overall
+    rows = splitter.run(body(['query.view'], min_queries=70), START, END,
+                        measures=['history.query_run_count'],
+                        having={'history.query_run_count': 70})
+    assert sorted(totals(rows, 'query.view')) == ['explore_2', 'explore_3']
+    for b in looker.bodies:
+        assert 'history.query_run_count' not in b['filters']
+
+
+def test_run_many_returns_each_query_in_order():
+    looker = StubLooker(history())
+    splitter = QuerySplitter(looker, workers=4, window_days=7)
+    views, fields = splitter.run_many(
+        [(body(['query.view']), START, END, ['history.query_run_count'],
+          None),
+         (body(['query.formatted_fields']), START, END,
+          ['history.query_run_count'], None)])
+    assert set(totals(views, 'query.view')) == {'explore_%s' % e
+                                                for e in range(4)}
+    assert set(totals(fields, 'query.formatted_fields')) == \
+        {'["view.field_%s"]' % f for f in range(3)}
+
+
+def test_failed_queries_return_none():
+    looker = StubLooker(history())
+    looker.fail = True
+    splitter = QuerySplitter(looker, window_days=7)
+    assert splitter.run(body(['query.view']), START, END) is None
+    assert splitter.aggregate(body(['query.model', 'query.view']), START,
+                              END, FieldAggregator) is None
+
+
+def test_aggregate_matches_merged_rows():
+    fields = ['query.model', 'query.view', 'query.formatted_fields',
+              'query.formatted_filters', 'query.sorts',
+              'query.formatted_pivots']
+    looker = StubLooker(history())
+    splitter = QuerySplitter(looker, window_days=0)
+    usage = splitter.aggregate(body(fields, limit=5), START, END,
+                               FieldAggregator)
+    expected = FieldAggregator()
+    for row in splitter.run(body(fields), START, END,
+                            measures=['history.query_run_count']):
+        expected.add(row)
+    assert usage.scoped() == expected.scoped()
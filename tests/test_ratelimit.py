@@ -0,0 +1,96 @@
+import threading
+import time
+from email.utils import formatdate
+from henry.modules.ratelimit import AdaptiveLimiter, parse_retry_after, \
+    retry_delay, retryable
+
+
+def test_retry_delay_backs_off_exponentially_with_jitter():
+    for attempt in range(8):
+        for i in range(20):
+            assert 0 <= retry_delay(attempt) <= min(30, 0.5 * 2 ** attempt)
+
+
+def test_retry_delay_follows_retry_after_up_to_a_cap():
+    assert retry_delay(0, retry_after=7) == 7
+    assert retry_delay(0, retry_after=10000) == 120
+
+
+def test_parse_retry_after():
+    assert parse_retry_after(None) is None
+    assert parse_retry_after('') is None
+    assert parse_retry_after('3') == 3
+    assert parse_retry_after('-3') == 0
+    assert parse_retry_after('soon') is None
+    assert 50 < parse_retry_after(formatdate(time.time() + 60,
+                                             usegmt=True)) <= 60
+
+
+def test_idempotent_calls_are_retried_on_errors_and_5xx():
+    assert retryable(None)
+    for status in (429, 500, 502, 503, 504):
+        assert retryable(status)
+    assert not retryable(404)
+    assert not retryable(401)
+
+
+def test_other_calls_are_only_retried_when_no_work_was_done():
+    assert not retryable(None, idempotent=False)
+    assert not retryable(500, idempotent=False)
+    assert not retryable(503, idempotent=False)
+    assert retryable(503, '5', idempotent=False)
+    assert retryable(429, idempotent=False)
+
+
+def test_limiter_halves_on_failure_and_grows_back_on_success():
+    limiter = AdaptiveLimiter(8, cooldown=0)
+    limiter.failure()
+    assert limiter.limit == 4
+    limiter.failure()
+    assert limiter.limit == 2
+    for i in range(100):
+        limiter.success()
+    assert limiter.limit == 8
+
+
+def test_limiter_never_goes_below_its_minimum():
+    limiter = AdaptiveLimiter(8, min_limit=3, cooldown=0)
+    for i in range(10):
+        limiter.failure()
+    assert limiter.limit == 3
+
+
+def test_failures_within_the_cooldown_lower_the_limit_once():
+    limiter = AdaptiveLimiter(8, cooldown=60)
+    limiter.failure()
+    limiter.failure()
+    assert limiter.limit == 4
+
+
+def test_slow_requests_count_as_failures():
+    limiter = AdaptiveLimiter(8, latency_target=1, cooldown=0)
+    limiter.success(0.5)
+    assert limiter.limit == 8
+    limiter.success(2)
+    assert limiter.limit == 4
+
+
+def test_limiter_caps_requests_in_flight():
+    limiter = AdaptiveLimiter(3)
+    lock = threading.Lock()
+    state = {'in_flight': 0, 'most': 0}
+
+    def request():
+        with limiter:
+            with lock:
+                state['in_flight'] += 1
+                state['most'] = max(state['most'], state['in_flight'])
+            time.sleep(0.01)
+            with lock:
+                state['in_flight'] -= 1
+    threads = [threading.Thread(target=request) for i in range(12)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert state['most'] == 3
@@ -0,0 +1,96 @@
+import argparse
+import gzip
+import io
+import pytest
+from henry.modules.shards import in_shard, parse_shard, read_shards, \
+    write_shard
+
+HEADER = {'host': 'host', 'command': 'analyze explores',
+          'params': {'timeframe': 90}}
+NAMES = [('model_%s' % m, 'explore_%s' % e) for m in range(5)
+         for e in range(20)]
+
+
+def test_parse_shard():
+    assert parse_shard('2/4') == (2, 4)
+    for value in ('0/4', '5/4', '1/0', '1', 'a/b', '1/2/3'):
+        with pytest.raises(argparse.ArgumentTypeError):
+            parse_shard(value)
+
+
+def test_every_name_is_in_exactly_one_shard():
+    for names in NAMES:
+        assert sum(in_shard((i, 3), *names) for i in (1, 2, 3)) == 1
+
+
+def test_shards_are_roughly_even():
+    sizes = [sum(in_shard((i, 3), *names) for names in NAMES)
+             for i in (1, 2, 3)]
+    assert min(sizes) > len(NAMES) / 6
+
+
+def test_unsharded_runs_include_everything():
+    assert all(in_shard(None, *names) for names in NAMES)
+
+
+# writes the rows of every shard of n to files under tmp_path, as --shard
+# runs would, and returns their paths
+def shard_files(tmp_path, n, rows, header=HEADER, suffix='.ndjson'):
+    paths = []
+    for i in range(1, n + 1):
+        path = str(tmp_path / ('shard%s%s' % (i, suffix)))
+        opener = gzip.open if suffix.endswith('.gz') else io.open
+        with opener(path, 'wt') as f:
+            write_shard(f, dict(header, shard=[i, n]),
+                        [(p, r) for p, r in enumerate(rows)
+                         if in_shard((i, n), r['model'], r['explore'])])
+        paths.append(path)
+    return paths
+
+
+def names_rows():
+    return [{'model': m, 'explore': e} for m, e in NAMES]
+
+
+@pytest.mark.parametrize('suffix', ['.ndjson', '.ndjson.gz'])
+def test_merged_rows_are_in_the_order_of_an_unsharded_run(tmp_path,
+                                                          suffix):
+    rows = names_rows()
+    paths = shard_files(tmp_path, 3, rows, suffix=suffix)
+    header, merged = read_shards(reversed(paths))
+    assert header['command'] == 'analyze explores'
+    assert list(merged) == rows
+
+
+def test_missing_shards_need_partial(tmp_path):
+    rows = names_rows()
+    paths = shard_files(tmp_path, 3, rows)
+    with pytest.raises(ValueError, match='Missing shards 2/3'):
+        read_shards([paths[0], paths[2]])
+    header, merged = read_shards([paths[0], paths[2]], partial=True)
+    assert list(merged) == [r for r in rows
+                            if not in_shard((2, 3), r['model'],
+                                            r['explore'])]
+
+
+def test_shards_of_other_runs_are_refused(tmp_path):
+    (tmp_path / 'a').mkdir()
+    (tmp_path / 'b').mkdir()
+    first = shard_files(tmp_path / 'a', 2, names_rows())
+    other = dict(HEADER, params={'timeframe': 30})
+    second = shard_files(tmp_path / 'b', 2, names_rows(), header=other)
+    with pytest.raises(ValueError, match='comes from another run'):
+        read_shards([first[0], second[1]])
+
+
+def test_shards_given_twice_are_refused(tmp_path):
+    paths = shard_files(tmp_path, 2, names_rows())
+    with pytest.raises(ValueError, match='given twice'):
+        read_shards([paths[0], paths[0], paths[1]])
+
+
+def test_other_files_are_refused(tmp_path):
+    path = tmp_path / 'rows.ndjson'
+    path.write_text('{"model": "model_0"}\n')
+    with pytest.raises(ValueError, match='not a henry shard file'):
+        read_shards([str(path)])